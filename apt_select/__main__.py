@@ -1,15 +1,31 @@
 #!/usr/bin/env python
 """Main apt-select script"""
 
-import requests
 import re
 
-from sys import exit, stderr, version_info
-from os import getcwd
-from apt_select.arguments import get_args, DEFAULT_COUNTRY, SKIPPED_FILE_GENERATION
-from apt_select.mirrors import Mirrors
-from apt_select.apt import System, Sources, SourcesFileError
-from apt_select.utils import DEFAULT_REQUEST_HEADERS
+from sys import exit, stderr, stdout, version_info
+from os import getcwd, path
+from apt_select.arguments import (get_args, DEFAULT_COUNTRY, REGIONS,
+                                  SKIPPED_FILE_GENERATION)
+from apt_select.selector import (MirrorSelector, Selection, SelectionError,
+                                 MirrorListError, fetch_mirror_lists,
+                                 mirrors_url, status_level, read_manifest)
+from apt_select.apt import Sources, SourcesFileError
+from apt_select.utils import (URLGetTextError, configure_session, http_stats,
+                              write_progress)
+from apt_select.cache import MetadataCache
+from apt_select.throughput import format_throughput
+from apt_select.output import get_writer, mirror_record
+from apt_select.daemon import MirrorDaemon, serve_state
+from apt_select.store import open_store, StoreError
+from apt_select.history import LatencyHistory, HistoryError
+from apt_select.snapshot import (build_snapshot, load_snapshot,
+                                 SnapshotError, DEFAULT_SNAPSHOT)
+from apt_select.timing import (span, start_timeline, get_timeline,
+                               print_summary)
+
+# Functions of the profile printed when it isn't saved
+PROFILE_LINES = 30
 
 # Support input for Python 2 and 3
 get_input = input
@@ -23,9 +39,7 @@ def set_args():
     args = parser.parse_args()
 
     # Convert status argument to format used by Launchpad
-    args.min_status = args.min_status.replace('-', ' ')
-    if not args.ping_only and (args.min_status != 'unknown'):
-        args.min_status = args.min_status.capitalize()
+    args.min_status = status_level(args.min_status)
 
     if args.choose and (not args.top_number or args.top_number < 2):
         parser.print_usage()
@@ -34,64 +48,282 @@ def set_args():
             "where NUMBER is greater than 1."
         ))
 
-    if not args.country:
-        stderr.write('WARNING: no country code provided. defaulting to US.\n')
-        args.country = DEFAULT_COUNTRY
-    elif not re.match(r'^[a-zA-Z]{2}$', args.country):
+    if args.daemon and (args.choose or args.format):
+        parser.print_usage()
+        exit((
+            "error: --daemon option cannot be used with -c/--choose "
+            "or --format."
+        ))
+
+    if args.choose and args.format:
+        parser.print_usage()
+        exit("error: -c/--choose option cannot be used with --format.")
+
+    if args.batch and (args.choose or args.format or args.daemon):
+        parser.print_usage()
+        exit((
+            "error: --batch option cannot be used with -c/--choose, "
+            "--format or --daemon."
+        ))
+
+    for option in ('top_number', 'max_connections', 'samples',
+                   'lookup_workers', 'http_pool_size', 'history',
+                   'history_top'):
+        if getattr(args, option) < 1:
+            parser.print_usage()
+            exit("error: --%s NUMBER must be greater than 0." % (
+                option.replace('_', '-')
+            ))
+
+    if args.benchmark_throughput is not None and args.benchmark_throughput < 1:
+        parser.print_usage()
+        exit("error: --benchmark-throughput NUMBER must be greater than 0.")
+
+    if not 0 <= args.throughput_weight <= 1:
+        parser.print_usage()
+        exit("error: --throughput-weight WEIGHT must be from 0 to 1.")
+
+    if args.interval < 0:
+        parser.print_usage()
+        exit("error: --interval SECONDS must not be negative.")
+
+    for option in ('reprobe_every', 'reprobe_jitter', 'switch_margin',
+                   'switch_window'):
+        if getattr(args, option) < 0:
+            parser.print_usage()
+            exit("error: --%s must not be negative." % (
+                option.replace('_', '-')
+            ))
+
+    if args.history_explore < 0:
+        parser.print_usage()
+        exit("error: --history-explore NUMBER must not be negative.")
+
+    if args.latency_history and args.history_top < args.top_number:
+        parser.print_usage()
         exit((
-            "Invalid country. %s is not in ISO 3166-1 alpha-2 "
-            "format" % args.country
+            "error: --history-top NUMBER must not be less than "
+            "-t/--top-number."
         ))
 
+    if args.snapshot_max_age < 0:
+        parser.print_usage()
+        exit("error: --snapshot-max-age SECONDS must not be negative.")
+
+    if args.store_max_age < 0 or args.store_reprobe < 0:
+        parser.print_usage()
+        exit((
+            "error: --store-max-age and --store-reprobe must not be "
+            "negative."
+        ))
+
+    if args.http_retries < 0:
+        parser.print_usage()
+        exit("error: --http-retries NUMBER must not be negative.")
+
+    if args.global_list and args.country:
+        parser.print_usage()
+        exit("error: --global option cannot be used with -C/--country.")
+
+    if args.global_list:
+        args.country = []
+    elif not args.country:
+        stderr.write('WARNING: no country code provided. defaulting to US.\n')
+        args.country = [DEFAULT_COUNTRY]
+    else:
+        args.country = get_countries(args.country)
+
     return args
 
 
-def get_mirrors(mirrors_url, country):
-    """Fetch list of Ubuntu mirrors"""
-    stderr.write("Getting list of mirrors...")
-    response = requests.get(mirrors_url, headers=DEFAULT_REQUEST_HEADERS)
-    if response.status_code == requests.codes.NOT_FOUND:
-        exit(
-            "The mirror list for country: %s was not found at %s" % (
-                country, mirrors_url
+def get_countries(country_args):
+    """Expand country arguments to unique country codes, in given order"""
+    countries = []
+    for arg in country_args:
+        for country in arg.split(','):
+            country = country.strip()
+            if not country:
+                continue
+
+            if country.lower() in REGIONS:
+                expanded = REGIONS[country.lower()]
+            elif re.match(r'^[a-zA-Z]{2}$', country):
+                expanded = (country.upper(),)
+            else:
+                exit((
+                    "Invalid country. %s is not in ISO 3166-1 alpha-2 "
+                    "format, or a known region" % country
+                ))
+
+            countries.extend(c for c in expanded if c not in countries)
+
+    return countries
+
+
+def get_country_mirrors(countries, cache):
+    """Fetch lists of Ubuntu mirrors for the given countries
+
+       Returns de-duplicated list of mirrors, and the countries listing
+       each mirror."""
+    if len(countries) == 1:
+        stderr.write("Getting list of mirrors...")
+    else:
+        stderr.write("Getting lists of mirrors for %d countries..." % (
+            len(countries)
+        ))
+
+    try:
+        with span("mirror lists"):
+            mirrors_list, url_countries, errors = fetch_mirror_lists(
+                countries, cache
             )
-        )
+    except MirrorListError as err:
+        exit(str(err))
+
+    stderr.write("done.\n")
+    for country, err in errors:
+        stderr.write("\t%s: %s ignored\n" % (err, mirrors_url(country)))
+
+    return mirrors_list, url_countries
+
+
+def get_global_mirrors(cache):
+    """Fetch catalogue of every mirror listed by Launchpad
+
+       Returns its mirrors, and the country of each."""
+    stderr.write("Getting catalogue of all mirrors...")
+    selection = Selection([], None, None)
+    try:
+        MirrorSelector(global_list=True, cache=cache).fetch_lists(selection)
+    except MirrorListError as err:
+        exit(str(err))
 
     stderr.write("done.\n")
+    return selection.urls, selection.url_countries
 
-    return response.text.splitlines()
 
+def get_mirror_lists(args, cache):
+    """Fetch mirrors of the given countries, or all of them if global"""
+    if args.global_list:
+        return get_global_mirrors(cache)
 
-def print_status(info, rank):
+    return get_country_mirrors(args.country, cache)
+
+
+def print_http_stats(stats):
+    """Print summary of request timings to stderr"""
+    stderr.write((
+        "HTTP: %(requests)d request(s) in %(seconds).2f s, "
+        "%(connections)d connection(s) in %(connect_seconds).2f s, "
+        "~%(saved_seconds).2f s of handshakes saved by reuse\n" % stats
+    ))
+
+
+def format_stats(info):
+    """Return latency statistics of a mirror for the ranked report"""
+    return (
+        "min %(min).2f, median %(median).2f, p90 %(p90).2f, "
+        "stdev %(stdev).2f ms, loss %(loss_pct).0f%% of %(samples)d "
+        "via %(family)s" % dict(
+            info['Stats'],
+            loss_pct=info['Stats']['loss'] * 100,
+            family=info['Family']
+        )
+    )
+
+
+def print_status(info, rank, show_country=False, show_stats=False):
     """Print full mirror status report for ranked item"""
-    for key in ("Org", "Speed"):
-            info.setdefault(key, "N/A")
+    for key in ("Organisation", "Speed"):
+        info.setdefault(key, "N/A")
+
+    status = info['Status']
+    if 'Lag' in info:
+        status += " (%.1f h behind the freshest)" % (info['Lag'] / 3600.0)
+
+    speed = info['Speed']
+    if 'Throughput' in info:
+        speed += " (measured %s)" % format_throughput(info['Throughput'])
+
+    country = ""
+    if show_country:
+        country = "    Country: %s\n" % info['Country']
+
+    stats = ""
+    if show_stats:
+        stats = "    Stats:   %s\n" % format_stats(info)
 
     print((
         "%(rank)d. %(mirror)s\n"
+        "%(country)s"
         "%(tab)sLatency: %(ms).2f ms\n"
+        "%(stats)s"
         "%(tab)sOrg:     %(org)s\n"
         "%(tab)sStatus:  %(status)s\n"
         "%(tab)sSpeed:   %(speed)s" % {
             'tab': '    ',
             'rank': rank ,
             'mirror': info['Host'],
+            'country': country,
             'ms': info['Latency'],
+            'stats': stats,
             'org': info['Organisation'],
-            'status': info['Status'],
-            'speed': info['Speed']
+            'status': status,
+            'speed': speed
         }
     ))
 
 
-def print_latency(info, rank, max_host_len):
+def print_latency(info, rank, max_host_len, show_country=False,
+                  show_stats=False):
     """Print latency information for mirror in ranked report"""
-    print("%(rank)d. %(mirror)s: %(padding)s%(ms).2f ms" % {
-        'rank': rank,
-        'padding': (max_host_len - info.get('host_len', max_host_len)) * ' ',
-        'mirror': info['Host'],
-        'ms': info['Latency']
-    })
+    throughput = ""
+    if 'Throughput' in info:
+        throughput = ", %s" % format_throughput(info['Throughput'])
+
+    country = ""
+    if show_country:
+        country = " [%s]" % info['Country']
+
+    print((
+        "%(rank)d. %(mirror)s: %(padding)s%(ms).2f ms%(throughput)s"
+        "%(country)s" % {
+            'rank': rank,
+            'padding': (
+                (max_host_len - info.get('host_len', max_host_len)) * ' '
+            ),
+            'mirror': info['Host'],
+            'ms': info['Latency'],
+            'throughput': throughput,
+            'country': country
+        }
+    ))
+    if show_stats:
+        print("    %s" % format_stats(info))
+
+
+def print_report(archives, args):
+    """Print ranked report of the top mirrors"""
+    show_status = False
+    max_host_len = 0
+    if not args.ping_only and not archives.abort_launch:
+        show_status = True
+    else:
+        def set_hostname_len(url, i):
+            hostname_len = len(str(i) + archives.urls[url]['Host'])
+            archives.urls[url]['host_len'] = hostname_len
+            return hostname_len
+
+        max_host_len = max([set_hostname_len(url, i+1)
+                            for i, url in enumerate(archives.top_list)])
+    show_country = len(args.country) != 1
+    for i, url in enumerate(archives.top_list):
+        info = archives.urls[url]
+        rank = i + 1
+        if show_status:
+            print_status(info, rank, show_country, args.stats)
+        else:
+            print_latency(info, rank, max_host_len, show_country, args.stats)
 
 
 def ask(query):
@@ -128,74 +360,296 @@ def yes_or_no(query):
         answer = ask("Please enter '%s' or '%s': " % opts)
 
 
-def apt_select():
-    """Run apt-select: Ubuntu archive mirror reporting tool"""
+def open_snapshot(args):
+    """Return snapshot to look up mirrors in, or None if not using one"""
+    if args.ping_only or args.refresh:
+        return None
 
     try:
-        system = System()
-    except OSError as err:
-        exit("Error setting system information:\n\t%s" % err)
+        return load_snapshot(args.snapshot, args.snapshot_max_age)
+    except SnapshotError as err:
+        # Runs without a snapshot built fall back to scraping quietly
+        if args.snapshot == DEFAULT_SNAPSHOT and not path.isfile(
+                DEFAULT_SNAPSHOT):
+            return None
+
+        stderr.write("Unable to read snapshot %s: %s\n" % (
+            args.snapshot, err
+        ))
+        return None
+
+
+def write_snapshot(args, cache):
+    """Scrape and save a snapshot of the mirrors of the given countries"""
+    _, url_countries = get_mirror_lists(args, cache)
+
+    try:
+        snapshot = build_snapshot(url_countries, cache, args.lookup_workers)
+    except URLGetTextError as err:
+        exit("Unable to retrieve list of launchpad sites:\n\t%s" % err)
+
+    cache.save()
+    try:
+        snapshot.save(args.build_snapshot)
+    except SnapshotError as err:
+        exit("Error writing snapshot %s:\n\t%s" % (args.build_snapshot, err))
+
+    stderr.write("Snapshot of %d mirror(s) saved to %s\n" % (
+        len(snapshot.mirrors), args.build_snapshot
+    ))
+
+
+def new_selector(args, cache, store=None, snapshot=None, history=None,
+                 result_callback=None):
+    """Return MirrorSelector testing mirrors as given by arguments"""
+    return MirrorSelector(
+        countries=args.country,
+        top_number=args.top_number,
+        ping_only=args.ping_only,
+        min_status=args.min_status,
+        max_connections=args.max_connections,
+        samples=args.samples,
+        interval=args.interval,
+        rank_by=args.rank_by,
+        family=args.family,
+        race=args.race,
+        probe=args.probe,
+        status_source=args.status_source,
+        reference_archive=args.reference_archive,
+        lookup_workers=args.lookup_workers,
+        benchmark_throughput=args.benchmark_throughput,
+        throughput_weight=args.throughput_weight,
+        global_list=args.global_list,
+        min_speed=args.min_speed,
+        protocol=args.protocol,
+        cache=cache,
+        store=store,
+        snapshot=snapshot,
+        history=history,
+        stages={'prefilter': prefilter_mirrors, 'resolve': resolve_hosts},
+        result_callback=result_callback,
+        progress=write_progress
+    )
+
+
+def prefilter_mirrors(selector, selection):
+    """Prefilter stage reporting how many mirrors it leaves"""
+    total = len(selection.urls)
+    MirrorSelector.prefilter(selector, selection)
+    if len(selection.urls) < total:
+        stderr.write("Prefiltered to %d of %d mirror(s)\n" % (
+            len(selection.urls), total
+        ))
+
+
+def resolve_hosts(selector, selection):
+    """Resolve stage reporting the mirrors it leaves out"""
+    urls = selection.urls
+    MirrorSelector.resolve(selector, selection)
+    for url in urls:
+        if url in selection.errors:
+            stderr.write("%s: %s ignored\n" % (selection.errors[url], url))
+
+
+def rank_mirrors(selector, selection):
+    """Test mirrors of a selection, setting its ranked results"""
+    selector.run(selection, (
+        "prefilter", "resolve", "probe", "enrich", "filter", "rank"
+    ))
+    return selection
+
+
+def run_daemon(args, selector, sources, mirrors_list, url_countries):
+    """Re-rank mirrors until interrupted, serving state if asked to"""
+    def rank():
+        selection = selector.new_selection(sources=sources)
+        selection.urls = list(mirrors_list)
+        selection.url_countries = url_countries
+        try:
+            rank_mirrors(selector, selection)
+        except SelectionError as err:
+            stderr.write("%s\n" % err)
+        selector.cache.save()
+        return selection.archives
 
     try:
-        sources = Sources(system.codename)
+        daemon = MirrorDaemon(
+            rank,
+            sources,
+            getcwd(),
+            every=args.reprobe_every,
+            jitter=args.reprobe_jitter,
+            margin=args.switch_margin,
+            window=args.switch_window,
+            history=args.history,
+            dry_run=args.list_only
+        )
     except SourcesFileError as err:
         exit("Error with current apt sources:\n\t%s" % err)
 
-    args = set_args()
-    mirrors_loc = "mirrors.ubuntu.com"
-    mirrors_url = "http://%s/%s.txt" % (mirrors_loc, args.country.upper())
-    mirrors_list = get_mirrors(mirrors_url, args.country)
-
-    archives = Mirrors(mirrors_list, args.ping_only, args.min_status)
-    archives.get_rtts()
-    if archives.got["ping"] < args.top_number:
-        args.top_number = archives.got["ping"]
-
-    if args.top_number == 0:
-        exit("Cannot connect to any mirrors in %s\n." % mirrors_list)
-
-    if not args.ping_only:
-        archives.get_launchpad_urls()
-        if not archives.abort_launch:
-            # Mirrors needs a limit to stop launching threads
-            archives.status_num = args.top_number
-            stderr.write("Looking up %d status(es)\n" % args.top_number)
-            archives.lookup_statuses(
-                system.codename.capitalize(),
-                system.arch,
-                args.min_status
+    server = None
+    if args.listen:
+        try:
+            server = serve_state(daemon, args.listen)
+        except (ValueError, EnvironmentError) as err:
+            exit("Unable to serve state on %s: %s" % (args.listen, err))
+
+    try:
+        daemon.run()
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+
+
+def run_batch(args, selector):
+    """Select mirrors for the targets of a manifest, reporting each"""
+    try:
+        targets = read_manifest(args.batch)
+    except SelectionError as err:
+        exit(str(err))
+
+    if args.list_only:
+        for target in targets:
+            target.output = None
+
+    stderr.write("Selecting mirrors for %d target(s)\n" % len(targets))
+    try:
+        selections = selector.select_batch(targets)
+    except SelectionError as err:
+        exit(str(err))
+
+    failed = 0
+    for target, selection in zip(targets, selections):
+        print("%s %s %s" % (target.codename, target.arch, target.root))
+        if selection.error is not None:
+            failed += 1
+            print("    Error: %s" % selection.error)
+            continue
+
+        for result in selection.mirrors:
+            print("    %d. %s%s" % (
+                result.rank,
+                result.url,
+                "" if result.status is None else " (%s)" % result.status
+            ))
+        if selection.files:
+            for new_file_path in selection.files:
+                print("    New config file saved to %s" % new_file_path)
+        elif target.output is not None:
+            print("    %s is the currently used mirror." % selection.current)
+
+    if failed:
+        exit("%d of %d target(s) failed." % (failed, len(targets)))
+
+
+def apt_select(args):
+    """Run apt-select: Ubuntu archive mirror reporting tool"""
+
+    configure_session(
+        pool_size=args.http_pool_size,
+        timeout=args.http_timeout,
+        retries=args.http_retries
+    )
+    cache = MetadataCache(
+        ttl=args.cache_ttl,
+        refresh=args.refresh,
+        offline=args.offline
+    )
+    if args.build_snapshot:
+        write_snapshot(args, cache)
+        exit()
+
+    store = None
+    if args.store:
+        try:
+            store = open_store(
+                args.store,
+                max_age=args.store_max_age,
+                segment=args.store_segment,
+                reprobe=args.store_reprobe,
+                status_max_age=args.cache_ttl
             )
+        except StoreError as err:
+            exit("Error opening result store %s:\n\t%s" % (args.store, err))
 
-        if args.top_number > 1:
-            stderr.write('\n')
+    history = None
+    if args.latency_history:
+        try:
+            history = LatencyHistory(
+                args.latency_history,
+                top=args.history_top,
+                explore=args.history_explore
+            )
+        except HistoryError as err:
+            exit("Error opening latency history %s:\n\t%s" % (
+                args.latency_history, err
+            ))
+
+    writer = None
+    result_callback = None
+    if args.format:
+        writer = get_writer(args.format)
+        result_callback = lambda event, url, info: writer.write(
+            mirror_record(event, url, info)
+        )
 
-    if args.ping_only or archives.abort_launch:
-        archives.top_list = archives.ranked[:args.top_number]
+    # Records may have been written by the time of any exit, so the
+    # writer is closed to leave well-formed output
+    try:
+        selector = new_selector(
+            args, cache, store, open_snapshot(args), history, result_callback
+        )
+        if args.batch:
+            run_batch(args, selector)
+            exit()
+
+        try:
+            system = selector.system
+        except SelectionError as err:
+            exit(str(err))
+
+        try:
+            sources = Sources(system.codename)
+        except SourcesFileError as err:
+            exit("Error with current apt sources:\n\t%s" % err)
+
+        mirrors_list, url_countries = get_mirror_lists(args, cache)
+        cache.save()
+
+        if args.daemon:
+            run_daemon(args, selector, sources, mirrors_list, url_countries)
+            exit()
+
+        selection = selector.new_selection(sources=sources)
+        selection.urls = mirrors_list
+        selection.url_countries = url_countries
+        try:
+            rank_mirrors(selector, selection)
+        except SelectionError as err:
+            exit(str(err))
+
+        archives = selection.archives
+        args.top_number = selection.top_number
+        if args.http_stats:
+            print_http_stats(http_stats())
+
+        if writer is not None:
+            for i, url in enumerate(archives.top_list):
+                writer.write(
+                    mirror_record("rank", url, archives.urls[url], rank=i + 1)
+                )
+    finally:
+        if writer is not None:
+            writer.close()
 
     sources.set_current_archives()
     current_url = sources.urls['current']
     if archives.urls.get(current_url):
         archives.urls[current_url]['Host'] += " (current)"
 
-    show_status = False
-    max_host_len = 0
-    if not args.ping_only and not archives.abort_launch:
-        show_status = True
-    else:
-        def set_hostname_len(url, i):
-            hostname_len = len(str(i) + archives.urls[url]['Host'])
-            archives.urls[url]['host_len'] = hostname_len
-            return hostname_len
-
-        max_host_len = max([set_hostname_len(url, i+1)
-                            for i, url in enumerate(archives.top_list)])
-    for i, url in enumerate(archives.top_list):
-        info = archives.urls[url]
-        rank = i + 1
-        if show_status:
-            print_status(info, rank)
-        else:
-            print_latency(info, rank, max_host_len)
+    if writer is None:
+        print_report(archives, args)
 
     key = 0
     if args.choose:
@@ -204,8 +658,10 @@ def apt_select():
     if args.list_only:
         exit()
 
+    # Keep stdout to records alone when they're written
+    report = stderr if writer is not None else stdout
     new_mirror = archives.top_list[key]
-    print("Selecting mirror %(mirror)s ..." % {'mirror': new_mirror})
+    report.write("Selecting mirror %(mirror)s ...\n" % {'mirror': new_mirror})
     if current_url == new_mirror:
         stderr.write(
             "%(url)s is the currently used mirror.\n"
@@ -219,12 +675,14 @@ def apt_select():
     if work_dir == sources.DIRECTORY[0:-1]:
         query = (
             "'%(dir)s' is the current directory.\n"
-            "Generating a new '%(apt)s' file will "
-            "overwrite the current file.\n"
-            "You should copy or backup '%(apt)s' before replacing it.\n"
+            "Generating new apt sources files will "
+            "overwrite the current files.\n"
+            "You should copy or backup '%(apt)s' and '%(parts)s' before "
+            "replacing them.\n"
             "Continue?\n[yes|no] " % {
                 'dir': sources.DIRECTORY,
-                'apt': sources.APT_FILE
+                'apt': sources.LIST_FILE,
+                'parts': sources.PARTS_DIRECTORY
             }
         )
         yes_or_no(query)
@@ -233,18 +691,55 @@ def apt_select():
     try:
         sources.generate_new_config(work_dir, new_mirror)
     except SourcesFileError as err:
-        exit("Error generating new config file" % err)
+        exit("Error generating new config file:\n\t%s" % err)
     else:
-        print("New config file saved to %s" % sources.new_file_path)
+        for new_file_path in sources.new_file_paths:
+            report.write("New config file saved to %s\n" % new_file_path)
 
     exit()
 
 
+def report_instrumentation(args, profiler):
+    """Print or write timings and profile of the run, as asked to"""
+    timeline = get_timeline()
+    if timeline is not None:
+        if args.timings:
+            print_summary(timeline)
+        if args.trace:
+            try:
+                timeline.write_trace(args.trace)
+            except IOError as err:
+                stderr.write("Unable to write trace: %s\n" % err)
+
+    if profiler is not None:
+        if args.profile == '-':
+            import pstats
+            pstats.Stats(profiler, stream=stderr).sort_stats(
+                'cumulative'
+            ).print_stats(PROFILE_LINES)
+        else:
+            profiler.dump_stats(args.profile)
+
+
 def main():
+    args = set_args()
+    if args.timings or args.trace:
+        start_timeline()
+
+    profiler = None
+    if args.profile:
+        import cProfile
+        profiler = cProfile.Profile()
+
     try:
-        apt_select()
+        if profiler is not None:
+            profiler.runcall(apt_select, args)
+        else:
+            apt_select(args)
     except KeyboardInterrupt:
         stderr.write("Aborting...\n")
+    finally:
+        report_instrumentation(args, profiler)
 
 if __name__ == '__main__':
     main()
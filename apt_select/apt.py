@@ -1,8 +1,11 @@
 #!/usr/bin/env python
 
+import re
+
 from subprocess import check_output
-from os import path
+from os import path, listdir, makedirs
 from apt_select.utils import utf8_decode
+from apt_select.timing import span
 
 SUPPORTED_KERNEL = 'Linux'
 SUPPORTED_DISTRIBUTION_TYPE = 'Ubuntu'
@@ -89,61 +92,301 @@ class SourcesFileError(Exception):
     pass
 
 
+DIRECTORY = '/etc/apt/'
+DEB_TYPES = frozenset(['deb', 'deb-src'])
+ONE_LINE_SUFFIX = '.list'
+DEB822_SUFFIX = '.sources'
+_TOKEN = re.compile(r'\S+')
+
+
+def normalize_uri(uri):
+    """Return URI as indexed, regardless of a trailing slash"""
+    return uri.rstrip('/')
+
+
+class SourceEntry(object):
+    """A source of an apt file, with where its URI is written in the file"""
+
+    __slots__ = ('file_path', 'types', 'uri', 'suites', 'components',
+                 'line', 'start', 'end')
+
+    def __init__(self, file_path, types, uri, suites, components, line,
+                 start, end):
+        self.file_path = file_path
+        self.types = types
+        self.uri = uri
+        self.suites = suites
+        self.components = components
+        self.line = line
+        self.start = start
+        self.end = end
+
+
+class SourcesIndex(object):
+    """Enabled sources of apt files, indexed by URI, suite and component
+
+       Lines of each file are kept so URIs can be rewritten in place."""
+
+    def __init__(self):
+        self.files = []
+        self.lines = {}
+        self.entries = []
+        self.by_uri = {}
+        self.by_suite = {}
+        self.by_component = {}
+
+    def add(self, entry):
+        self.entries.append(entry)
+        self.by_uri.setdefault(normalize_uri(entry.uri), []).append(entry)
+        for suite in entry.suites:
+            self.by_suite.setdefault(suite, []).append(entry)
+        for component in entry.components:
+            self.by_component.setdefault(component, []).append(entry)
+
+    def find(self, uri=None, suite=None, component=None):
+        """Return entries matching all given fields, in file order"""
+        candidates = [self.entries]
+        if uri is not None:
+            candidates.append(self.by_uri.get(normalize_uri(uri), []))
+        if suite is not None:
+            candidates.append(self.by_suite.get(suite, []))
+        if component is not None:
+            candidates.append(self.by_component.get(component, []))
+
+        # Entries are indexed in file order, so the shortest list of
+        # candidates is filtered in order
+        return [
+            entry for entry in min(candidates, key=len)
+            if (uri is None or normalize_uri(entry.uri) ==
+                normalize_uri(uri)) and
+            (suite is None or suite in entry.suites) and
+            (component is None or component in entry.components)
+        ]
+
+    def rewrite(self, uris, new_uri):
+        """Return new lines of each file using any of uris, with only the
+           URI fields of their sources replaced by new_uri"""
+        spans = {}
+        for uri in set(normalize_uri(uri) for uri in uris):
+            for entry in self.by_uri.get(uri, ()):
+                spans.setdefault(entry.file_path, {}).setdefault(
+                    entry.line, []
+                ).append((entry.start, entry.end))
+
+        rewritten = {}
+        for file_path, line_spans in spans.items():
+            lines = list(self.lines[file_path])
+            for number, positions in line_spans.items():
+                line = lines[number]
+                # Replace from the end of the line, keeping offsets valid
+                for start, end in sorted(set(positions), reverse=True):
+                    line = line[:start] + new_uri + line[end:]
+                lines[number] = line
+            rewritten[file_path] = lines
+
+        return rewritten
+
+
+def _tokens(line, number, pos=0):
+    return [(match.group(), number, match.start(), match.end())
+            for match in _TOKEN.finditer(line, pos)]
+
+
+def _parse_one_line(index, file_path, lines):
+    """Index the sources of a one-line style file, e.g. sources.list"""
+    for number, line in enumerate(lines):
+        tokens = _tokens(line.split('#', 1)[0], number)
+        if len(tokens) < 3 or tokens[0][0] not in DEB_TYPES:
+            continue
+
+        # Skip options, e.g. [arch=amd64 signed-by=...]
+        i = 1
+        if tokens[1][0].startswith('['):
+            while i < len(tokens) and not tokens[i][0].endswith(']'):
+                i += 1
+            i += 1
+
+        if len(tokens) < i + 2:
+            continue
+
+        uri, _, start, end = tokens[i]
+        # URIs may have spaces in brackets, e.g. cdrom:[Ubuntu 24.04]/
+        while '[' in uri and ']' not in uri and i + 2 < len(tokens):
+            i += 1
+            end = tokens[i][3]
+            uri = line[start:end]
+
+        if len(tokens) < i + 2:
+            continue
+
+        index.add(SourceEntry(
+            file_path,
+            [tokens[0][0]],
+            uri,
+            [tokens[i + 1][0]],
+            [token[0] for token in tokens[i + 2:]],
+            number,
+            start,
+            end
+        ))
+
+
+def _add_stanza(index, file_path, fields):
+    def values(name):
+        return [token[0] for token in fields.get(name, ())]
+
+    if [value.lower() for value in values('enabled')[:1]] == ['no']:
+        return
+
+    types = [value for value in values('types') if value in DEB_TYPES]
+    if not types:
+        return
+
+    for uri, number, start, end in fields.get('uris', ()):
+        index.add(SourceEntry(
+            file_path,
+            types,
+            uri,
+            values('suites'),
+            values('components'),
+            number,
+            start,
+            end
+        ))
+
+
+def _parse_deb822(index, file_path, lines):
+    """Index the sources of a deb822 style file, e.g. ubuntu.sources"""
+    fields = {}
+    name = None
+    # A blank line at the end closes the last stanza
+    for number, line in enumerate(lines + ['']):
+        if line.startswith('#'):
+            continue
+
+        if not line.strip():
+            if fields:
+                _add_stanza(index, file_path, fields)
+            fields = {}
+            name = None
+        elif line[0] in ' \t':
+            # Continuation of the previous field's value
+            if name is not None:
+                fields[name].extend(_tokens(line, number))
+        else:
+            field, sep, _ = line.partition(':')
+            if not sep:
+                name = None
+                continue
+
+            name = field.strip().lower()
+            fields[name] = _tokens(line, number, len(field) + 1)
+
+
+def read_sources(file_paths):
+    """Read apt files in a single pass into an index of their sources"""
+    index = SourcesIndex()
+    for file_path in file_paths:
+        try:
+            with span("sources read", "io", path=file_path), \
+                    open(file_path, 'r') as f:
+                lines = f.readlines()
+        except IOError as err:
+            raise SourcesFileError((
+                "Unable to read system apt file: %s" % err
+            ))
+
+        index.files.append(file_path)
+        index.lines[file_path] = lines
+        if file_path.endswith(DEB822_SUFFIX):
+            _parse_deb822(index, file_path, lines)
+        else:
+            _parse_one_line(index, file_path, lines)
+
+    return index
+
+
 class Sources(object):
-    """Class for apt configuration files"""
+    """Class for apt configuration files
+
+       Reads sources.list, and the .list and deb822 .sources files of
+       sources.list.d."""
 
-    DEB_SCHEMES = frozenset(['deb', 'deb-src'])
     PROTOCOLS = frozenset(['http', 'ftp', 'https'])
 
-    DIRECTORY = '/etc/apt/'
+    DIRECTORY = DIRECTORY
     LIST_FILE = 'sources.list'
+    PARTS_DIRECTORY = 'sources.list.d'
     _CONFIG_PATH = DIRECTORY + LIST_FILE
+    _PARTS_PATH = DIRECTORY + PARTS_DIRECTORY
 
-    def __init__(self, codename):
+    def __init__(self, codename, directory=DIRECTORY):
         self._codename = codename.lower()
-        if not path.isfile(self._CONFIG_PATH):
+        # Another root's apt directory can be read, e.g. a chroot's
+        self.DIRECTORY = path.join(directory, '')
+        self._CONFIG_PATH = self.DIRECTORY + self.LIST_FILE
+        self._PARTS_PATH = self.DIRECTORY + self.PARTS_DIRECTORY
+        if not self.__file_paths():
             raise SourcesFileError((
-                "%s must exist as file" % self._CONFIG_PATH
+                "%s or files in %s must exist" % (
+                    self._CONFIG_PATH, self._PARTS_PATH
+                )
             ))
 
         self._required_component = "main"
-        self._lines = []
+        self.index = None
         self.urls = []
         self.skip_gen_msg = "Skipping file generation"
         self.new_file_path = None
+        self.new_file_paths = []
+
+    def __file_paths(self):
+        """Return paths of apt's sources files, in the order apt reads them"""
+        file_paths = []
+        if path.isfile(self._CONFIG_PATH):
+            file_paths.append(self._CONFIG_PATH)
 
-    def __set_sources_lines(self):
-        """Read system config file and store the lines in memory for parsing
-           and generation of new config file"""
         try:
-            with open(self._CONFIG_PATH, 'r') as f:
-                self._lines = f.readlines()
-        except IOError as err:
-            raise SourcesFileError((
-                "Unable to read system apt file: %s" % err
-            ))
+            names = sorted(listdir(self._PARTS_PATH))
+        except OSError:
+            names = []
 
-    def __confirm_apt_source_uri(self, uri):
-        """Check if line follows correct sources.list URI"""
-        if (uri and (uri[0] in self.DEB_SCHEMES) and
-                uri[1].split('://')[0] in self.PROTOCOLS):
-            return True
+        file_paths.extend(
+            path.join(self._PARTS_PATH, name) for name in names
+            if name.endswith((ONE_LINE_SUFFIX, DEB822_SUFFIX)) and
+            path.isfile(path.join(self._PARTS_PATH, name))
+        )
+        return file_paths
 
-        return False
+    def __confirm_apt_source_uri(self, entry):
+        """Check if source's URI is that of a mirror"""
+        return entry.uri.split('://')[0] in self.PROTOCOLS
 
     def __get_current_archives(self):
-        """Parse through all lines of the system apt file to find current
-           mirror urls"""
+        """Find current mirror urls in the indexed sources"""
         urls = {}
-        for line in self._lines:
-            fields = line.split()
-            if self.__confirm_apt_source_uri(fields):
-                if (not urls and
-                        (self._codename in fields[2]) and
-                        (fields[3] == self._required_component)):
-                    urls['current'] = fields[1]
-                elif urls and (fields[2] == '%s-security' % self._codename):
-                    urls['security'] = fields[1]
+        security = '%s-security' % self._codename
+        suites = {}
+        for entry in self.index.find(component=self._required_component):
+            if self.__confirm_apt_source_uri(entry):
+                suites.setdefault(normalize_uri(entry.uri), set()).update(
+                    suite for suite in entry.suites
+                    if self._codename in suite and suite != security
+                )
+
+        # The mirror serves most of the release's suites, unlike
+        # third party archives of the same release. Ties go to the first.
+        best = 0
+        for entry in self.index.find(component=self._required_component):
+            uri_suites = suites.get(normalize_uri(entry.uri), ())
+            if len(uri_suites) > best:
+                best = len(uri_suites)
+                urls['current'] = entry.uri
+
+        if urls:
+            for entry in self.index.find(suite=security):
+                if self.__confirm_apt_source_uri(entry):
+                    urls['security'] = entry.uri
                     break
 
         return urls
@@ -151,35 +394,46 @@ class Sources(object):
     def set_current_archives(self):
         """Read in the system apt config, parse to find current mirror urls
            to set as attribute"""
-        try:
-            self.__set_sources_lines()
-        except SourcesFileError as err:
-            raise SourcesFileError(err)
-
+        self.index = read_sources(self.__file_paths())
         urls = self.__get_current_archives()
         if not urls:
             raise SourcesFileError((
-                "Error finding current %s URI in %s\n%s\n" %
+                "Error finding current %s URI in %s or %s\n%s\n" %
                 (self._required_component, self._CONFIG_PATH,
-                 self.skip_gen_msg)
+                 self._PARTS_PATH, self.skip_gen_msg)
             ))
 
         self.urls = urls
 
-    def __set_config_lines(self, new_mirror):
-        """Replace all instances of the current urls with the new mirror"""
-        self._lines = ''.join(self._lines)
-        for url in self.urls.values():
-            self._lines = self._lines.replace(url, new_mirror)
-
     def generate_new_config(self, work_dir, new_mirror):
-        """Write new configuration file to current working directory"""
-        self.__set_config_lines(new_mirror)
-        self.new_file_path = work_dir.rstrip('/') + '/' + self.LIST_FILE
-        try:
-            with open(self.new_file_path, 'w') as f:
-                f.write(self._lines)
-        except IOError as err:
-            raise SourcesFileError((
-                "Unable to generate new sources.list:\n\t%s\n" % err
-            ))
+        """Write files using the current urls to the working directory, with
+           the new mirror in their place
+
+           Files keep their path relative to the apt directory, e.g.
+           sources.list.d/ubuntu.sources."""
+        rewritten = self.index.rewrite(self.urls.values(), new_mirror)
+        self.new_file_paths = []
+        for file_path in self.index.files:
+            if file_path not in rewritten:
+                continue
+
+            new_path = path.join(
+                work_dir, path.relpath(file_path, self.DIRECTORY)
+            )
+            try:
+                if not path.isdir(path.dirname(new_path)):
+                    makedirs(path.dirname(new_path))
+                with span("sources write", "io", path=new_path), \
+                        open(new_path, 'w') as f:
+                    f.writelines(rewritten[file_path])
+            except (IOError, OSError) as err:
+                raise SourcesFileError((
+                    "Unable to generate new %s:\n\t%s\n" % (
+                        path.basename(file_path), err
+                    )
+                ))
+            self.new_file_paths.append(new_path)
+
+        self.new_file_path = (
+            self.new_file_paths[0] if self.new_file_paths else None
+        )
@@ -1,10 +1,60 @@
 #!/usr/bin/env python
 """Process command line options for apt-select"""
 
-from argparse import ArgumentParser, RawTextHelpFormatter
+from argparse import (ArgumentParser, ArgumentTypeError,
+                      RawTextHelpFormatter)
+from apt_select.probe import (DEFAULT_MAX_CONNECTIONS, DEFAULT_NUM_TRIPS,
+                              DEFAULT_INTERVAL, DEFAULT_STAT, STATS, PROBES,
+                              DEFAULT_PROBE)
+from apt_select.cache import DEFAULT_TTL
+from apt_select.mirrors import DEFAULT_LOOKUP_WORKERS
+from apt_select.freshness import PRIMARY_ARCHIVE
+from apt_select.catalogue import PROTOCOLS, parse_speed
+from apt_select.throughput import DEFAULT_CANDIDATES, DEFAULT_WEIGHT
+from apt_select.utils import DEFAULT_POOL_SIZE, DEFAULT_TIMEOUT, DEFAULT_RETRIES
+from apt_select.output import FORMATS
+from apt_select.store import DEFAULT_MAX_AGE, DEFAULT_REPROBE, DEFAULT_SEGMENT
+from apt_select.snapshot import (DEFAULT_SNAPSHOT,
+                                 DEFAULT_MAX_AGE as DEFAULT_SNAPSHOT_MAX_AGE)
+from apt_select.history import (DEFAULT_HISTORY as DEFAULT_LATENCY_HISTORY,
+                                DEFAULT_TOP, DEFAULT_EXPLORE)
+from apt_select.daemon import (DEFAULT_EVERY, DEFAULT_JITTER, DEFAULT_MARGIN,
+                               DEFAULT_WINDOW, DEFAULT_HISTORY)
 
 DEFAULT_COUNTRY = 'US'
+# Region aliases for -C/--country, expanded to the ISO 3166-1 alpha-2 codes
+# of their countries
+REGIONS = {
+    'north-america': ('US', 'CA', 'MX'),
+    'central-america': ('CR', 'GT', 'HN', 'NI', 'PA', 'SV'),
+    'south-america': ('AR', 'BO', 'BR', 'CL', 'CO', 'EC', 'PE', 'PY', 'UY',
+                      'VE'),
+    'western-europe': ('AT', 'BE', 'CH', 'DE', 'FR', 'GB', 'IE', 'LU',
+                       'NL'),
+    'northern-europe': ('DK', 'EE', 'FI', 'IS', 'LT', 'LV', 'NO', 'SE'),
+    'southern-europe': ('ES', 'GR', 'HR', 'IT', 'PT', 'SI'),
+    'eastern-europe': ('BG', 'BY', 'CZ', 'HU', 'MD', 'PL', 'RO', 'RS', 'SK',
+                       'UA'),
+    'east-asia': ('CN', 'HK', 'JP', 'KR', 'MN', 'TW'),
+    'southeast-asia': ('ID', 'KH', 'MY', 'PH', 'SG', 'TH', 'VN'),
+    'south-asia': ('BD', 'IN', 'LK', 'NP', 'PK'),
+    'middle-east': ('AE', 'IL', 'IR', 'QA', 'SA', 'TR'),
+    'oceania': ('AU', 'NC', 'NZ'),
+    'africa': ('DZ', 'EG', 'KE', 'MA', 'MU', 'NG', 'TN', 'ZA'),
+}
+REGIONS['europe'] = tuple(sorted(set(
+    REGIONS['western-europe'] + REGIONS['northern-europe'] +
+    REGIONS['southern-europe'] + REGIONS['eastern-europe']
+)))
+REGIONS['americas'] = (
+    REGIONS['north-america'] + REGIONS['central-america'] +
+    REGIONS['south-america']
+)
+REGIONS['asia'] = (
+    REGIONS['east-asia'] + REGIONS['southeast-asia'] + REGIONS['south-asia']
+)
 DEFAULT_NUMBER = 1
+STATUS_SOURCES = ("launchpad", "release")
 STATUS_ARGS = (
     "up-to-date",
     "one-day-behind",
@@ -14,6 +64,17 @@ STATUS_ARGS = (
 )
 SKIPPED_FILE_GENERATION = 4
 
+def speed(text):
+    """Return bits per second of a speed argument, e.g. 1Gbps"""
+    bps = parse_speed(text)
+    if bps is None:
+        raise ArgumentTypeError(
+            "invalid speed: %r, expected e.g. 100Mbps or 1G" % text
+        )
+
+    return bps
+
+
 def get_args():
     """Get parsed command line arguments"""
     parser = ArgumentParser(
@@ -29,13 +90,18 @@ def get_args():
     parser.add_argument(
         '-C',
         '--country',
-        nargs='?',
+        nargs='*',
         type=str,
         help=(
-            "specify a country to test its list of mirrors\n"
+            "specify countries to test their lists of mirrors together\n"
             "used to match country list file names found at mirrors.ubuntu.com\n"
-            "COUNTRY should follow ISO 3166-1 alpha-2 format\n"
-            "default: %s" % DEFAULT_COUNTRY
+            "COUNTRY should follow ISO 3166-1 alpha-2 format, or be a region:\n"
+            "   %(regions)s\n"
+            "multiple countries may also be separated by commas\n"
+            "default: %(default)s" % {
+                'regions': "\n   ".join(sorted(REGIONS)),
+                'default': DEFAULT_COUNTRY
+            }
         ),
         metavar='COUNTRY'
     )
@@ -52,6 +118,162 @@ def get_args():
         default=DEFAULT_NUMBER,
         metavar='NUMBER'
     )
+    parser.add_argument(
+        '--max-connections',
+        type=int,
+        help=(
+            "maximum number of latency tests in flight at once\n"
+            "default: %d\n" % DEFAULT_MAX_CONNECTIONS
+        ),
+        default=DEFAULT_MAX_CONNECTIONS,
+        metavar='NUMBER'
+    )
+    family_group = parser.add_mutually_exclusive_group(required=False)
+    family_group.add_argument(
+        '-4',
+        '--ipv4',
+        dest='family',
+        action='store_const',
+        const='4',
+        help="test latency to IPv4 addresses only\n",
+        default='any'
+    )
+    family_group.add_argument(
+        '-6',
+        '--ipv6',
+        dest='family',
+        action='store_const',
+        const='6',
+        help=(
+            "test latency to IPv6 addresses only\n"
+            "by default, both are tested and mirrors are ranked by the\n"
+            "address family apt would connect with\n"
+        ),
+        default='any'
+    )
+    parser.add_argument(
+        '--probe',
+        choices=PROBES,
+        help=(
+            "how latency is tested, one of:\n"
+            "   tcp: time to connect to the mirror\n"
+            "   http: time to the first byte of a request for the\n"
+            "   release's InRelease file, over kept alive connections\n"
+            "   mirrors not serving the release are left out\n"
+            "default: %s\n" % DEFAULT_PROBE
+        ),
+        default=DEFAULT_PROBE,
+        metavar='PROBE'
+    )
+    parser.add_argument(
+        '--samples',
+        type=int,
+        help=(
+            "number of latency tests of each mirror\n"
+            "mirrors failing some of them are still ranked\n"
+            "default: %d\n" % DEFAULT_NUM_TRIPS
+        ),
+        default=DEFAULT_NUM_TRIPS,
+        metavar='NUMBER'
+    )
+    parser.add_argument(
+        '--interval',
+        type=float,
+        help=(
+            "minimum seconds between latency tests of a mirror\n"
+            "tests of different mirrors are interleaved regardless\n"
+            "default: %s\n" % DEFAULT_INTERVAL
+        ),
+        default=DEFAULT_INTERVAL,
+        metavar='SECONDS'
+    )
+    parser.add_argument(
+        '--rank-by',
+        choices=STATS,
+        help=(
+            "latency statistic to rank mirrors by\n"
+            "choices: %(stats)s\n"
+            "default: %(default)s\n" % {
+                'stats': ", ".join(STATS),
+                'default': DEFAULT_STAT
+            }
+        ),
+        default=DEFAULT_STAT,
+        metavar='STAT'
+    )
+    parser.add_argument(
+        '--race',
+        action='store_true',
+        help=(
+            "halve the mirrors tested after each round of tests,\n"
+            "down to contenders for the top NUMBER\n"
+        ),
+        default=False
+    )
+    parser.add_argument(
+        '-s',
+        '--stats',
+        action='store_true',
+        help="report all latency statistics of mirrors\n",
+        default=False
+    )
+    parser.add_argument(
+        '--lookup-workers',
+        type=int,
+        help=(
+            "number of status lookups in flight at once\n"
+            "default: %d\n" % DEFAULT_LOOKUP_WORKERS
+        ),
+        default=DEFAULT_LOOKUP_WORKERS,
+        metavar='NUMBER'
+    )
+    parser.add_argument(
+        '--status-source',
+        choices=STATUS_SOURCES,
+        help=(
+            "where statuses come from, one of:\n"
+            "   launchpad: mirror pages scraped from Launchpad\n"
+            "   release: lag of the Date of mirrors' release files\n"
+            "   behind the freshest seen, without Launchpad\n"
+            "default: %s\n" % STATUS_SOURCES[0]
+        ),
+        default=STATUS_SOURCES[0],
+        metavar='SOURCE'
+    )
+    parser.add_argument(
+        '--reference-archive',
+        help=(
+            "archive whose release file mirrors' lag is measured from\n"
+            "with --status-source release, besides the freshest mirror\n"
+            "default: %s\n" % PRIMARY_ARCHIVE
+        ),
+        default=PRIMARY_ARCHIVE,
+        metavar='URL'
+    )
+    parser.add_argument(
+        '--benchmark-throughput',
+        nargs='?',
+        type=int,
+        help=(
+            "measure download speed of the NUMBER lowest latency mirrors\n"
+            "and rank them by a score of latency and throughput\n"
+            "default: %d when given without NUMBER\n" % DEFAULT_CANDIDATES
+        ),
+        const=DEFAULT_CANDIDATES,
+        default=None,
+        metavar='NUMBER'
+    )
+    parser.add_argument(
+        '--throughput-weight',
+        type=float,
+        help=(
+            "weight of throughput in the score, from 0 to 1\n"
+            "latency is weighted by the remainder\n"
+            "default: %s\n" % DEFAULT_WEIGHT
+        ),
+        default=DEFAULT_WEIGHT,
+        metavar='WEIGHT'
+    )
     test_group = parser.add_mutually_exclusive_group(required=False)
     test_group.add_argument(
         '-m',
@@ -112,6 +334,340 @@ def get_args():
         ),
         default=False
     )
+    parser.add_argument(
+        '--format',
+        choices=FORMATS,
+        help=(
+            "write mirror records to stdout as they're measured,\n"
+            "instead of the report, in one of: %s\n"
+            "cannot be used with -c/--choose\n" % ", ".join(FORMATS)
+        ),
+        default=None,
+        metavar='FORMAT'
+    )
+
+    parser.add_argument(
+        '--cache-ttl',
+        type=int,
+        help=(
+            "seconds cached mirror metadata is used before revalidation\n"
+            "default: %d\n" % DEFAULT_TTL
+        ),
+        default=DEFAULT_TTL,
+        metavar='SECONDS'
+    )
+    cache_group = parser.add_mutually_exclusive_group(required=False)
+    cache_group.add_argument(
+        '--refresh',
+        action='store_true',
+        help="revalidate all cached mirror metadata\n",
+        default=False
+    )
+    cache_group.add_argument(
+        '--offline',
+        action='store_true',
+        help=(
+            "use cached mirror metadata only, without fetching it\n"
+            "latency to mirrors is still tested\n"
+        ),
+        default=False
+    )
+
+    catalogue_group = parser.add_argument_group('catalogue')
+    catalogue_group.add_argument(
+        '--global',
+        dest='global_list',
+        action='store_true',
+        help=(
+            "test every mirror in Launchpad's archive mirrors table,\n"
+            "instead of countries' lists\n"
+            "cannot be used with -C/--country\n"
+        ),
+        default=False
+    )
+    catalogue_group.add_argument(
+        '--min-speed',
+        type=speed,
+        help=(
+            "only test mirrors advertising at least SPEED\n"
+            "on Launchpad, e.g. 100Mbps or 1Gbps\n"
+        ),
+        default=None,
+        metavar='SPEED'
+    )
+    catalogue_group.add_argument(
+        '--protocol',
+        choices=PROTOCOLS,
+        help=(
+            "only test mirrors serving PROTOCOL, using its URL\n"
+            "choices: %s\n" % ", ".join(PROTOCOLS)
+        ),
+        default=None,
+        metavar='PROTOCOL'
+    )
+
+    snapshot_group = parser.add_argument_group('snapshot')
+    snapshot_group.add_argument(
+        '--snapshot',
+        help=(
+            "use Launchpad metadata of a snapshot file instead of\n"
+            "scraping it, looking up mirrors missing from it only\n"
+            "ignored with --refresh\n"
+            "default: the snapshot built with --build-snapshot, if any\n"
+        ),
+        default=DEFAULT_SNAPSHOT,
+        metavar='FILE'
+    )
+    snapshot_group.add_argument(
+        '--snapshot-max-age',
+        type=int,
+        help=(
+            "seconds a snapshot's statuses are used for\n"
+            "default: %d\n" % DEFAULT_SNAPSHOT_MAX_AGE
+        ),
+        default=DEFAULT_SNAPSHOT_MAX_AGE,
+        metavar='SECONDS'
+    )
+    snapshot_group.add_argument(
+        '--build-snapshot',
+        nargs='?',
+        help=(
+            "scrape Launchpad metadata of the mirrors of the given\n"
+            "countries to a snapshot FILE, then exit\n"
+            "default: snapshot.json.gz in apt-select's cache directory\n"
+        ),
+        const=DEFAULT_SNAPSHOT,
+        default=None,
+        metavar='FILE'
+    )
+
+    store_group = parser.add_argument_group('shared results')
+    store_group.add_argument(
+        '--store',
+        help=(
+            "share Launchpad statuses and latency with other hosts\n"
+            "through a SQLite file, or an http(s):// key-value URL\n"
+        ),
+        default=None,
+        metavar='LOCATION'
+    )
+    store_group.add_argument(
+        '--store-segment',
+        help=(
+            "name of the network segment latency is shared within\n"
+            "default: %s\n" % DEFAULT_SEGMENT
+        ),
+        default=DEFAULT_SEGMENT,
+        metavar='NAME'
+    )
+    store_group.add_argument(
+        '--store-max-age',
+        type=int,
+        help=(
+            "seconds shared latency is reused for\n"
+            "statuses are reused for --cache-ttl SECONDS\n"
+            "default: %d\n" % DEFAULT_MAX_AGE
+        ),
+        default=DEFAULT_MAX_AGE,
+        metavar='SECONDS'
+    )
+    store_group.add_argument(
+        '--store-reprobe',
+        type=int,
+        help=(
+            "number of best mirrors re-tested when shared latency is fresh\n"
+            "default: %d\n" % DEFAULT_REPROBE
+        ),
+        default=DEFAULT_REPROBE,
+        metavar='NUMBER'
+    )
+
+    history_group = parser.add_argument_group('latency history')
+    history_group.add_argument(
+        '--latency-history',
+        nargs='?',
+        help=(
+            "keep latency estimates per network in a SQLite FILE,\n"
+            "only testing the mirrors predicted best, a few others,\n"
+            "and those without an estimate\n"
+            "default: latency.db in apt-select's cache directory\n"
+        ),
+        const=DEFAULT_LATENCY_HISTORY,
+        default=None,
+        metavar='FILE'
+    )
+    history_group.add_argument(
+        '--history-top',
+        type=int,
+        help=(
+            "number of mirrors predicted best that are tested,\n"
+            "at least -t/--top-number\n"
+            "default: %d\n" % DEFAULT_TOP
+        ),
+        default=DEFAULT_TOP,
+        metavar='NUMBER'
+    )
+    history_group.add_argument(
+        '--history-explore',
+        type=int,
+        help=(
+            "number of other mirrors with estimates tested at random\n"
+            "default: %d\n" % DEFAULT_EXPLORE
+        ),
+        default=DEFAULT_EXPLORE,
+        metavar='NUMBER'
+    )
+
+    timing_group = parser.add_argument_group('instrumentation')
+    timing_group.add_argument(
+        '--timings',
+        action='store_true',
+        help="report time spent in each phase of the run\n",
+        default=False
+    )
+    timing_group.add_argument(
+        '--trace',
+        help=(
+            "write phase and mirror operation timings to FILE\n"
+            "as a Chrome trace, see chrome://tracing\n"
+        ),
+        default=None,
+        metavar='FILE'
+    )
+    timing_group.add_argument(
+        '--profile',
+        nargs='?',
+        help=(
+            "run under cProfile, saving stats to FILE for pstats\n"
+            "prints the most costly functions without FILE\n"
+        ),
+        const='-',
+        default=None,
+        metavar='FILE'
+    )
+
+    http_group = parser.add_argument_group('HTTP')
+    http_group.add_argument(
+        '--http-pool-size',
+        type=int,
+        help=(
+            "number of connections kept alive per host\n"
+            "default: %d\n" % DEFAULT_POOL_SIZE
+        ),
+        default=DEFAULT_POOL_SIZE,
+        metavar='NUMBER'
+    )
+    http_group.add_argument(
+        '--http-timeout',
+        type=float,
+        help=(
+            "seconds to wait for a connection or response\n"
+            "default: %d\n" % DEFAULT_TIMEOUT
+        ),
+        default=DEFAULT_TIMEOUT,
+        metavar='SECONDS'
+    )
+    http_group.add_argument(
+        '--http-retries',
+        type=int,
+        help=(
+            "number of retries of failed requests, with backoff\n"
+            "default: %d\n" % DEFAULT_RETRIES
+        ),
+        default=DEFAULT_RETRIES,
+        metavar='NUMBER'
+    )
+    http_group.add_argument(
+        '--http-stats',
+        action='store_true',
+        help="report request and connection timings\n",
+        default=False
+    )
+
+    daemon_group = parser.add_argument_group('daemon')
+    daemon_group.add_argument(
+        '--daemon',
+        action='store_true',
+        help=(
+            "keep running, re-testing mirrors on a schedule\n"
+            "generate a new file when another mirror stays better\n"
+            "with -l/--list, switches are only reported\n"
+        ),
+        default=False
+    )
+    daemon_group.add_argument(
+        '--reprobe-every',
+        type=float,
+        help=(
+            "seconds between re-tests of mirrors\n"
+            "default: %d\n" % DEFAULT_EVERY
+        ),
+        default=DEFAULT_EVERY,
+        metavar='SECONDS'
+    )
+    daemon_group.add_argument(
+        '--reprobe-jitter',
+        type=float,
+        help=(
+            "maximum seconds re-tests are randomly moved by\n"
+            "default: %d\n" % DEFAULT_JITTER
+        ),
+        default=DEFAULT_JITTER,
+        metavar='SECONDS'
+    )
+    daemon_group.add_argument(
+        '--switch-margin',
+        type=float,
+        help=(
+            "percentage a mirror's median latency must be lower\n"
+            "than the current mirror's to replace it\n"
+            "default: %d\n" % DEFAULT_MARGIN
+        ),
+        default=DEFAULT_MARGIN,
+        metavar='PERCENT'
+    )
+    daemon_group.add_argument(
+        '--switch-window',
+        type=float,
+        help=(
+            "seconds a mirror must stay better to replace the current\n"
+            "default: %d\n" % DEFAULT_WINDOW
+        ),
+        default=DEFAULT_WINDOW,
+        metavar='SECONDS'
+    )
+    daemon_group.add_argument(
+        '--history',
+        type=int,
+        help=(
+            "number of recent re-tests the median latency is taken over\n"
+            "default: %d\n" % DEFAULT_HISTORY
+        ),
+        default=DEFAULT_HISTORY,
+        metavar='NUMBER'
+    )
+    daemon_group.add_argument(
+        '--listen',
+        help=(
+            "serve state and decisions as JSON over HTTP\n"
+            "on [HOST:]PORT, or a UNIX socket if ADDRESS is a path\n"
+        ),
+        default=None,
+        metavar='ADDRESS'
+    )
+
+    batch_group = parser.add_argument_group('batch')
+    batch_group.add_argument(
+        '--batch',
+        help=(
+            "select mirrors for each target of a manifest, with lines of\n"
+            "CODENAME ARCH ROOT OUTPUT, writing new files of ROOT's\n"
+            "sources to OUTPUT. mirrors are probed once for all targets\n"
+            "cannot be used with -c/--choose, --format or --daemon\n"
+        ),
+        default=None,
+        metavar='MANIFEST'
+    )
 
     return parser
 
@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+"""Persistent on-disk cache of mirror metadata
+
+   Parsed documents are stored per namespace in JSON files under the user's
+   cache directory. Entries older than the cache's time to live are
+   revalidated with the validators (ETag/Last-Modified) issued alongside
+   them, so unchanged documents aren't downloaded or parsed again."""
+
+import json
+from sys import stderr
+from os import environ, path, makedirs, rename, getpid
+from threading import Lock
+from time import time
+from apt_select.utils import get_conditional_text, URLGetTextError
+from apt_select.timing import span
+
+CACHE_DIR = path.join(
+    environ.get('XDG_CACHE_HOME') or path.expanduser('~/.cache'),
+    'apt-select'
+)
+DEFAULT_TTL = 3600
+
+MIRROR_LISTS = 'mirror-lists'
+LAUNCHPAD_INDEX = 'launchpad-index'
+LAUNCHPAD_MIRRORS = 'launchpad-mirrors'
+LAUNCHPAD_CATALOGUE = 'launchpad-catalogue'
+
+
+class CacheMissError(URLGetTextError):
+    """Error class for documents unavailable from the cache while offline"""
+    pass
+
+
+class MetadataCache(object):
+    """Cache of parsed documents fetched over HTTP"""
+
+    def __init__(self, directory=CACHE_DIR, ttl=DEFAULT_TTL,
+                 refresh=False, offline=False):
+        self._directory = directory
+        self._ttl = ttl
+        self._refresh = refresh
+        self._offline = offline
+        self._namespaces = {}
+        self._dirty = set()
+        self._lock = Lock()
+
+    def __file_path(self, namespace):
+        return path.join(self._directory, namespace + '.json')
+
+    def __load(self, namespace):
+        """Return entries of a namespace, reading them from disk once"""
+        try:
+            return self._namespaces[namespace]
+        except KeyError:
+            pass
+
+        entries = {}
+        try:
+            with open(self.__file_path(namespace), 'r') as f:
+                entries = json.load(f)
+        except (IOError, OSError, ValueError):
+            pass
+
+        self._namespaces[namespace] = entries
+        return entries
+
+    def get(self, namespace, key):
+        """Return cache entry for key, or None if it isn't stored"""
+        with self._lock:
+            return self.__load(namespace).get(key)
+
+    def set(self, namespace, key, value, validators=None):
+        """Store value for key, stamped with the current time"""
+        entry = {'value': value, 'time': time()}
+        entry.update(validators or {})
+        with self._lock:
+            self.__load(namespace)[key] = entry
+            self._dirty.add(namespace)
+
+    def __touch(self, namespace, key, entry, validators):
+        entry.update(validators)
+        entry['time'] = time()
+        with self._lock:
+            self._dirty.add(namespace)
+
+    def is_fresh(self, entry):
+        """Check if an entry can be used without revalidation"""
+        return (not self._refresh and
+                (time() - entry.get('time', 0)) < self._ttl)
+
+    def fetch(self, namespace, key, url, parse, stream=False, valid=None):
+        """Return parsed document at url, stored in namespace by key
+
+           parse is called on the document text when it has to be
+           downloaded, and must return a JSON serializable value. If
+           streamed, parse is passed a generator of text chunks instead.
+           Stored values failing the valid check are downloaded again."""
+        entry = self.get(namespace, key)
+        if self._offline:
+            if entry is None:
+                raise CacheMissError("%s is not cached" % url)
+            return entry['value']
+
+        if entry is not None and valid and not valid(entry['value']):
+            entry = None
+
+        if entry is not None and self.is_fresh(entry):
+            return entry['value']
+
+        etag = modified = None
+        if entry is not None:
+            etag, modified = entry.get('etag'), entry.get('modified')
+
+        text, validators = get_conditional_text(url, etag, modified, stream)
+        if text is None:
+            self.__touch(namespace, key, entry, validators)
+            return entry['value']
+
+        value = parse(text)
+        self.set(namespace, key, value, validators)
+        return value
+
+    def save(self):
+        """Write modified namespaces to the cache directory"""
+        with self._lock, span("cache save"):
+            dirty, self._dirty = self._dirty, set()
+            try:
+                if not path.isdir(self._directory):
+                    makedirs(self._directory)
+
+                for namespace in dirty:
+                    file_path = self.__file_path(namespace)
+                    tmp_path = "%s.%d" % (file_path, getpid())
+                    with open(tmp_path, 'w') as f:
+                        json.dump(self._namespaces[namespace], f)
+                    rename(tmp_path, file_path)
+            except (IOError, OSError) as err:
+                stderr.write("Unable to save cache: %s\n" % err)
@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+"""Catalogue of every archive mirror listed by Launchpad
+
+   Launchpad's archive mirrors page lists mirrors under a heading row per
+   country, each row linking the mirror's Launchpad page and its archive
+   by every protocol served, followed by its advertised speed and status.
+   The whole table is parsed as it's streamed into entries such as:
+
+       {"Launchpad": "https://launchpad.net/ubuntu/+mirror/...",
+        "Name": "Example Mirror", "Country": "Germany",
+        "Protocols": {"http": "http://...", "https": "https://..."},
+        "Speed": "1 Gbps", "Bandwidth": 1000000000, "Status": "Up to date"}
+
+   A Catalogue indexes the entries by country, protocol and archive URL,
+   and by bandwidth, so candidates can be narrowed down before any of
+   them is probed."""
+
+import re
+from bisect import bisect_left
+from apt_select.cache import LAUNCHPAD_CATALOGUE
+from apt_select.timing import span
+
+try:
+    from HTMLParser import HTMLParser
+except ImportError:
+    from html.parser import HTMLParser
+
+LAUNCHPAD_BASE = "https://launchpad.net"
+LAUNCHPAD_URL = LAUNCHPAD_BASE + "/ubuntu/+archivemirrors"
+PROTOCOLS = ("http", "https", "ftp")
+_SPEED = re.compile(r'^\s*(\d+(?:\.\d+)?)\s*([kKmMgGtT]?)(?:bps|bit/s)?\s*$')
+_SPEED_UNITS = {'': 1, 'k': 10 ** 3, 'm': 10 ** 6, 'g': 10 ** 9, 't': 10 ** 12}
+
+
+def parse_speed(text):
+    """Return bits per second of a speed such as "100 Mbps" or "1G", or
+       None if it isn't one"""
+    match = _SPEED.match(text or "")
+    if match is None:
+        return None
+
+    number, unit = match.groups()
+    return int(float(number) * _SPEED_UNITS[unit.lower()])
+
+
+class _CatalogueParser(HTMLParser):
+    """Incremental parser of the rows of Launchpad's archive mirror table"""
+
+    MIRROR_PATH = "/ubuntu/+mirror/"
+
+    def __init__(self, base):
+        HTMLParser.__init__(self)
+        self.entries = []
+        self.done = False
+        self._base = base
+        self._depth = 0
+        self._head = False
+        self._country = None
+        self._cells = None
+        self._links = None
+
+    def handle_starttag(self, tag, attrs):
+        if self.done:
+            return
+
+        if tag == 'table':
+            self._depth += 1
+        elif not self._depth:
+            return
+        elif tag == 'thead':
+            self._head = True
+        elif tag == 'tr':
+            self._cells = []
+            self._links = []
+        elif tag in ('td', 'th') and self._cells is not None:
+            self._cells.append([tag, ""])
+        elif tag == 'a' and self._links is not None:
+            href = dict(attrs).get('href')
+            if href:
+                self._links.append(href)
+
+    def handle_data(self, data):
+        if self._cells:
+            self._cells[-1][1] += data
+
+    def handle_endtag(self, tag):
+        if self.done or not self._depth:
+            return
+
+        if tag == 'table':
+            self._depth -= 1
+            # Only the first table lists mirrors
+            self.done = not self._depth
+        elif tag == 'thead':
+            self._head = False
+        elif tag == 'tr' and self._cells is not None:
+            if not self._head:
+                self.__add_row(
+                    [(cell, text.strip()) for cell, text in self._cells],
+                    self._links
+                )
+            self._cells = self._links = None
+
+    def __add_row(self, cells, links):
+        """Start a country at a heading row, or add a mirror's row"""
+        if cells and all(cell == 'th' for cell, _ in cells):
+            self._country = cells[0][1] or self._country
+            return
+
+        pages = [href for href in links if href.startswith(self.MIRROR_PATH)]
+        if not pages:
+            return
+
+        protocols = {}
+        for href in links:
+            scheme = href.split(':', 1)[0]
+            if href not in pages and scheme not in protocols:
+                protocols[scheme] = href
+
+        texts = [text for _, text in cells]
+        speed = next((text for text in texts if parse_speed(text)), None)
+        self.entries.append({
+            "Launchpad": self._base + pages[0],
+            "Name": texts[0],
+            "Country": self._country,
+            "Protocols": protocols,
+            "Speed": speed,
+            "Bandwidth": parse_speed(speed),
+            "Status": texts[-1] if len(texts) > 1 else None
+        })
+
+
+def parse_catalogue(chunks, base=LAUNCHPAD_BASE):
+    """Return entries of every mirror from chunks of the archive mirrors
+       page HTML"""
+    parser = _CatalogueParser(base)
+    for chunk in chunks:
+        parser.feed(chunk)
+        if parser.done:
+            break
+
+    close = getattr(chunks, 'close', None)
+    if close:
+        close()
+
+    return parser.entries
+
+
+class Catalogue(object):
+    """Mirror entries indexed by country, protocol, archive URL and
+       bandwidth"""
+
+    def __init__(self, entries):
+        self.entries = list(entries)
+        self.by_country = {}
+        self.by_protocol = {}
+        self.by_url = {}
+        for i, entry in enumerate(self.entries):
+            country = (entry["Country"] or "").lower()
+            self.by_country.setdefault(country, []).append(i)
+            for protocol, url in entry["Protocols"].items():
+                self.by_protocol.setdefault(protocol, []).append(i)
+                self.by_url[url] = i
+
+        # Entries in ascending order of bandwidth, unknown ones first
+        self._by_bandwidth = sorted(
+            range(len(self.entries)),
+            key=lambda i: self.entries[i]["Bandwidth"] or 0
+        )
+        self._bandwidths = [
+            self.entries[i]["Bandwidth"] or 0 for i in self._by_bandwidth
+        ]
+
+    def __len__(self):
+        return len(self.entries)
+
+    def entry(self, url):
+        """Return entry of the mirror serving an archive URL, or None"""
+        i = self.by_url.get(url)
+        if i is None:
+            i = self.by_url.get(url.rstrip('/') + '/')
+        return None if i is None else self.entries[i]
+
+    def find(self, countries=None, min_speed=None, protocol=None):
+        """Return entries of mirrors in any of the given countries, named
+           as by Launchpad, advertising at least min_speed bits per second
+           and serving protocol, in catalogue order"""
+        found = set(range(len(self.entries)))
+        if countries is not None:
+            in_countries = set()
+            for country in countries:
+                in_countries.update(self.by_country.get(country.lower(), ()))
+            found &= in_countries
+        if min_speed is not None:
+            found.intersection_update(self._by_bandwidth[
+                bisect_left(self._bandwidths, min_speed):
+            ])
+        if protocol is not None:
+            found.intersection_update(self.by_protocol.get(protocol, ()))
+
+        return [self.entries[i] for i in sorted(found)]
+
+
+def load_catalogue(cache=None, launchpad_url=LAUNCHPAD_URL,
+                   launchpad_base=LAUNCHPAD_BASE):
+    """Return catalogue of Launchpad's archive mirrors page"""
+    from apt_select.mirrors import _fetch
+
+    with span("launchpad catalogue"):
+        entries = _fetch(
+            cache,
+            LAUNCHPAD_CATALOGUE,
+            launchpad_url,
+            lambda chunks: parse_catalogue(chunks, launchpad_base),
+            stream=True
+        )
+
+    return Catalogue(entries)
@@ -0,0 +1,265 @@
+#!/usr/bin/env python
+"""Long running re-ranking of mirrors
+
+   Mirrors are re-tested on a schedule, keeping a rolling history of each
+   mirror's latency in memory. A new sources.list is only generated once a
+   different mirror has stayed better than the one in use, by a margin,
+   for a window of time. State and decisions are served as JSON over HTTP,
+   on a local TCP port or UNIX socket."""
+
+import json
+from collections import deque
+from os import path, remove
+from random import uniform
+from sys import stderr
+from threading import Thread, Lock, Event
+from apt_select.apt import SourcesFileError
+
+try:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn, UnixStreamServer
+except ImportError:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn, UnixStreamServer
+
+try:
+    from time import monotonic as clock
+except ImportError:
+    from time import time as clock
+
+from time import time
+
+DEFAULT_EVERY = 900
+DEFAULT_JITTER = 60
+DEFAULT_MARGIN = 10
+DEFAULT_WINDOW = 3600
+DEFAULT_HISTORY = 8
+DEFAULT_LISTEN_HOST = '127.0.0.1'
+# Decisions kept for the state endpoint
+MAX_DECISIONS = 50
+
+
+def median(values):
+    """Return median of unsorted values"""
+    ordered = sorted(values)
+    middle = len(ordered) // 2
+    if len(ordered) % 2:
+        return ordered[middle]
+
+    return (ordered[middle - 1] + ordered[middle]) / 2.0
+
+
+class MirrorDaemon(object):
+    """Re-rank mirrors on a schedule, switching mirror on sustained drift
+
+       rank is called each cycle to return a Mirrors instance whose
+       top_list holds mirrors eligible for use, in rank order, or None if
+       no mirrors could be tested, in which case the cycle is skipped.
+       Mirrors are compared by the median of their latency over the last
+       history cycles. A challenger replaces the current mirror once its
+       median has been at least margin percent lower for window seconds."""
+
+    def __init__(self, rank, sources, work_dir, every=DEFAULT_EVERY,
+                 jitter=DEFAULT_JITTER, margin=DEFAULT_MARGIN,
+                 window=DEFAULT_WINDOW, history=DEFAULT_HISTORY,
+                 dry_run=False):
+        self._rank = rank
+        self._sources = sources
+        self._work_dir = work_dir
+        self._every = every
+        self._jitter = jitter
+        self._margin = margin
+        self._window = window
+        self._history_len = history
+        self._dry_run = dry_run
+        self._lock = Lock()
+        self._stopped = Event()
+
+        sources.set_current_archives()
+        self.current = sources.urls['current']
+        self.history = {}
+        self.challenger = None
+        self.challenger_since = None
+        self.cycles = 0
+        self.last_cycle = None
+        self.next_cycle = None
+        self.decisions = deque(maxlen=MAX_DECISIONS)
+
+    def score(self, url):
+        """Return rolling median latency of a mirror, None if untested"""
+        latencies = self.history.get(url)
+        if not latencies:
+            return None
+
+        return median(latencies)
+
+    def __record(self, archives):
+        """Add latencies of a cycle's tests to the rolling history"""
+        for url, info in archives.urls.items():
+            if "Latency" not in info:
+                continue
+
+            if url not in self.history:
+                self.history[url] = deque(maxlen=self._history_len)
+            self.history[url].append(info["Latency"])
+
+    def __decide(self, eligible, now):
+        """Track the best eligible challenger, returning it once it has
+           outperformed the current mirror for the whole window"""
+        scored = [(self.score(url), url) for url in eligible
+                  if url != self.current and self.score(url) is not None]
+        if not scored:
+            self.challenger = None
+            return None
+
+        best_score, best = min(scored)
+        current_score = self.score(self.current)
+        if (current_score is not None and
+                best_score > current_score * (1 - self._margin / 100.0)):
+            self.challenger = None
+            return None
+
+        if best != self.challenger:
+            self.challenger = best
+            self.challenger_since = now
+
+        if now - self.challenger_since < self._window:
+            return None
+
+        return best
+
+    def __switch(self, url, now):
+        """Generate apt sources files for a new mirror"""
+        decision = {
+            "time": now,
+            "from": self.current,
+            "to": url,
+            "from_ms": self.score(self.current),
+            "to_ms": self.score(url),
+            "file": None,
+            "files": [],
+        }
+        if not self._dry_run:
+            try:
+                # Re-read the system files, generation replaces their mirror
+                self._sources.set_current_archives()
+                self._sources.generate_new_config(self._work_dir, url)
+            except SourcesFileError as err:
+                decision["error"] = str(err)
+                self.decisions.append(decision)
+                stderr.write("Error generating new config file: %s\n" % err)
+                return
+
+            decision["file"] = self._sources.new_file_path
+            decision["files"] = self._sources.new_file_paths
+
+        stderr.write("Switched mirror %s -> %s\n" % (self.current, url))
+        self.decisions.append(decision)
+        self.current = url
+        self.challenger = None
+
+    def cycle(self):
+        """Re-test and re-rank mirrors once"""
+        archives = self._rank()
+        if archives is None:
+            stderr.write("No mirrors were tested, skipping cycle\n")
+            return
+
+        now = time()
+        with self._lock:
+            self.__record(archives)
+            switch_to = self.__decide(archives.top_list, now)
+            if switch_to is not None:
+                self.__switch(switch_to, now)
+            self.cycles += 1
+            self.last_cycle = now
+
+    def state(self):
+        """Return JSON serialisable state and decisions"""
+        with self._lock:
+            return {
+                "current": self.current,
+                "current_ms": self.score(self.current),
+                "challenger": self.challenger,
+                "challenger_ms": self.score(self.challenger),
+                "challenger_since": (
+                    self.challenger_since if self.challenger else None
+                ),
+                "cycles": self.cycles,
+                "last_cycle": self.last_cycle,
+                "next_cycle": self.next_cycle,
+                "margin_pct": self._margin,
+                "window": self._window,
+                "history": dict(
+                    (url, list(latencies))
+                    for url, latencies in self.history.items()
+                ),
+                "decisions": list(self.decisions),
+            }
+
+    def run(self):
+        """Run cycles until stopped, with a random delay between them"""
+        while not self._stopped.is_set():
+            start = clock()
+            self.cycle()
+            delay = self._every + uniform(-self._jitter, self._jitter)
+            delay = max(delay - (clock() - start), 0)
+            with self._lock:
+                self.next_cycle = time() + delay
+            self._stopped.wait(delay)
+
+    def stop(self):
+        self._stopped.set()
+
+
+class _StateHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/state'):
+            self.send_error(404)
+            return
+
+        body = json.dumps(self.server.mirror_daemon.state(), sort_keys=True)
+        body = body.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        # Requests aren't logged, UNIX socket clients have no address
+        pass
+
+
+class _TCPStateServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _UnixStateServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        if path.exists(self.server_address):
+            remove(self.server_address)
+        UnixStreamServer.server_bind(self)
+
+
+def serve_state(daemon, address):
+    """Serve daemon state from a background thread, returning the server
+
+       address is a UNIX socket path if it contains '/', otherwise a
+       [HOST:]PORT to listen on."""
+    if '/' in address:
+        server = _UnixStateServer(address, _StateHandler)
+    else:
+        host, _, port = address.rpartition(':')
+        server = _TCPStateServer(
+            (host or DEFAULT_LISTEN_HOST, int(port)),
+            _StateHandler
+        )
+
+    server.mirror_daemon = daemon
+    thread = Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+"""Freshness of mirrors from the Date of their release files
+
+   Every run of the archive publisher dates the release files of the
+   suites it updates. A mirror's lag is how much older its release file
+   is than the freshest copy seen, of the primary archive or of any
+   mirror checked, and is mapped onto Launchpad's status levels. Only the
+   head of each release file is fetched, and no HTML is parsed."""
+
+from calendar import timegm
+from email.utils import parsedate_tz, mktime_tz
+from threading import Lock
+from apt_select.utils import get_range_text, URLGetTextError
+from apt_select.timing import span
+
+PRIMARY_ARCHIVE = "http://archive.ubuntu.com/ubuntu/"
+# The release pocket of a stable release isn't published to again, so
+# lag is measured on its updates
+SUITE = "%s-updates"
+RELEASE_FILE = "InRelease"
+# Bytes of a release file fetched, its Date being near the top
+HEAD_SIZE = 4096
+# Most seconds a mirror may lag by for each status, best first
+LAG_STATUSES = (
+    (3600, "Up to date"),
+    (86400, "One day behind"),
+    (2 * 86400, "Two days behind"),
+    (7 * 86400, "One week behind"),
+)
+UNKNOWN = "unknown"
+
+
+def release_url(url, codename):
+    """Return URL of the release file of a mirror's updates suite"""
+    return "%s/dists/%s/%s" % (
+        url.rstrip('/'), SUITE % codename.lower(), RELEASE_FILE
+    )
+
+
+def parse_release_date(text):
+    """Return seconds since the epoch of a release file's Date field, or
+       None if it has none"""
+    for line in text.splitlines():
+        if line.startswith("Date:"):
+            parsed = parsedate_tz(line[len("Date:"):].strip())
+            if parsed is None:
+                return None
+            if parsed[9] is None:
+                return timegm(parsed[:9])
+            return mktime_tz(parsed)
+
+    return None
+
+
+def lag_status(lag):
+    """Return status level of a mirror lagging by seconds"""
+    for most, status in LAG_STATUSES:
+        if lag <= most:
+            return status
+
+    return UNKNOWN
+
+
+class FreshnessCheck(object):
+    """Status of mirrors from the lag of their release files behind the
+       freshest one fetched
+
+       Release files can be fetched from many threads at once. Statuses
+       are only final once every release file compared is fetched."""
+
+    def __init__(self, codename, reference_url=PRIMARY_ARCHIVE,
+                 progress=None):
+        self._codename = codename
+        self._reference_url = reference_url
+        # Called with text reporting failed fetches, silent if None
+        self._progress = progress
+        self._lock = Lock()
+        self.newest = None
+
+    def __report(self, text):
+        if self._progress is not None:
+            self._progress(text)
+
+    def __seen(self, released):
+        with self._lock:
+            if self.newest is None or released > self.newest:
+                self.newest = released
+
+    def release_date(self, url):
+        """Return Date of a mirror's release file"""
+        file_url = release_url(url, self._codename)
+        with span("release file", "mirror", url=file_url):
+            released = parse_release_date(get_range_text(file_url, HEAD_SIZE))
+
+        if released is None:
+            raise URLGetTextError("no Date in %s" % file_url)
+
+        return released
+
+    def set_reference(self):
+        """Take the primary archive's release file as the freshest yet"""
+        if not self._reference_url:
+            return
+
+        try:
+            self.__seen(self.release_date(self._reference_url))
+        except URLGetTextError as err:
+            self.__report((
+                "%s: %s\nLag is measured against the freshest mirror\n" % (
+                    self._reference_url, err
+                )
+            ))
+
+    def fetch(self, url):
+        """Return Date of a mirror's release file, or None if it can't be
+           read, keeping track of the freshest"""
+        try:
+            released = self.release_date(url)
+        except URLGetTextError as err:
+            self.__report("connection to %s: %s\n" % (
+                release_url(url, self._codename), err
+            ))
+            return None
+
+        self.__seen(released)
+        return released
+
+    def status(self, released):
+        """Return status info of a release file dated released, lagging
+           behind the freshest fetched, or None if it couldn't be read"""
+        if released is None:
+            return {"Status": UNKNOWN}
+
+        lag = max(self.newest - released, 0)
+        return {"Status": lag_status(lag), "Released": released, "Lag": lag}
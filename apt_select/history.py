@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+"""Local history of latency to mirrors' networks
+
+   Latency measured to each mirror is folded into an exponentially
+   weighted moving average, kept per source subnet, i.e. the network
+   tests are run from, and per prefix of the mirror's address. Mirrors
+   in a network close to another one tested before share its estimate.
+
+   On repeat runs, only the mirrors with the best estimates, a few others
+   picked at random to explore, and any without an estimate are tested,
+   their results refreshing the estimates. Failed tests are folded in as
+   a penalty, so mirrors failing them are tested again only to explore:
+
+       apt-select --latency-history --history-top 10 --history-explore 3"""
+
+import random
+import socket
+from sys import stderr
+from os import path, makedirs
+from threading import Lock
+from time import time
+from apt_select.cache import CACHE_DIR
+from apt_select.timing import span
+
+DEFAULT_HISTORY = path.join(CACHE_DIR, 'latency.db')
+# Weight of a new measurement in a prefix's estimate
+DEFAULT_ALPHA = 0.3
+# Seconds an estimate is predicted from before it's considered unknown
+DEFAULT_MAX_AGE = 7 * 86400
+# Mirrors with the best estimates tested, and others picked to explore
+DEFAULT_TOP = 10
+DEFAULT_EXPLORE = 3
+# Milliseconds a failed test counts as, that of a connection timing out
+FAILURE_PENALTY = 2500
+# Bits of addresses grouped into a network
+PREFIX_BITS = {socket.AF_INET: 24, socket.AF_INET6: 48}
+
+
+class HistoryError(Exception):
+    """Error class for reading from or writing to a latency history"""
+    pass
+
+
+def address_prefix(family, address):
+    """Return network of an address, e.g. 192.0.2.0/24"""
+    bits = PREFIX_BITS[family]
+    packed = bytearray(socket.inet_pton(family, address))
+    for i in range(len(packed)):
+        keep = min(max(bits - 8 * i, 0), 8)
+        packed[i] &= (0xff << (8 - keep)) & 0xff
+
+    return "%s/%d" % (socket.inet_ntop(family, bytes(packed)), bits)
+
+
+def source_address(family, sockaddr):
+    """Return local address packets to sockaddr are sent from
+
+       Connecting a UDP socket only picks a route, sending nothing."""
+    sock = socket.socket(family, socket.SOCK_DGRAM)
+    try:
+        sock.connect(sockaddr)
+        return sock.getsockname()[0]
+    finally:
+        sock.close()
+
+
+class LatencyHistory(object):
+    """Latency estimates kept in a local SQLite database file"""
+
+    def __init__(self, db_path=DEFAULT_HISTORY, alpha=DEFAULT_ALPHA,
+                 max_age=DEFAULT_MAX_AGE, top=DEFAULT_TOP,
+                 explore=DEFAULT_EXPLORE):
+        import sqlite3
+        self._error = sqlite3.Error
+        self._lock = Lock()
+        self._sources = {}
+        self.alpha = alpha
+        self.max_age = max_age
+        self.top = top
+        self.explore = explore
+        try:
+            directory = path.dirname(db_path)
+            if directory and not path.isdir(directory):
+                makedirs(directory)
+            self._db = sqlite3.connect(
+                db_path, timeout=10, check_same_thread=False
+            )
+            with self._db:
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS latency ("
+                    "source TEXT, prefix TEXT, estimate REAL, "
+                    "samples INTEGER, updated REAL, "
+                    "PRIMARY KEY (source, prefix))"
+                )
+        except (self._error, OSError) as err:
+            raise HistoryError(err)
+
+    def source(self, family, sockaddr):
+        """Return subnet tests to sockaddr are run from, found once per
+           address family"""
+        with self._lock:
+            if family not in self._sources:
+                try:
+                    address = source_address(family, sockaddr)
+                except (socket.error, ValueError):
+                    address = None
+                self._sources[family] = (
+                    None if address is None else
+                    address_prefix(family, address.split('%')[0])
+                )
+
+            return self._sources[family]
+
+    def __read(self, sources):
+        """Return (estimate, samples, updated) of the keys of sources"""
+        rows = {}
+        try:
+            with self._lock, span("latency history read"):
+                for source in sources:
+                    for prefix, estimate, samples, updated in self._db.execute(
+                            "SELECT prefix, estimate, samples, updated "
+                            "FROM latency WHERE source = ?", (source,)):
+                        rows[(source, prefix)] = (estimate, samples, updated)
+        except self._error as err:
+            stderr.write("latency history read: %s\n" % err)
+
+        return rows
+
+    def estimates(self, keys):
+        """Return fresh estimates of (source, prefix) keys, in ms"""
+        now = time()
+        rows = self.__read(frozenset(source for source, _ in keys))
+        return dict(
+            (key, rows[key][0]) for key in keys
+            if key in rows and now - rows[key][2] <= self.max_age
+        )
+
+    def update(self, measured):
+        """Fold latencies measured to (source, prefix) keys, in ms, into
+           their estimates"""
+        now = time()
+        rows = self.__read(frozenset(source for source, _ in measured))
+        updated = []
+        for key, latency in measured.items():
+            estimate, samples, stored = rows.get(key, (None, 0, 0))
+            if estimate is None or now - stored > self.max_age:
+                estimate, samples = latency, 0
+            else:
+                estimate += self.alpha * (latency - estimate)
+            updated.append(key + (estimate, samples + 1, now))
+
+        try:
+            with self._lock, self._db, span("latency history write"):
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO latency VALUES (?, ?, ?, ?, ?)",
+                    updated
+                )
+        except self._error as err:
+            stderr.write("latency history write: %s\n" % err)
+
+    def choose(self, predicted, unknown):
+        """Return mirrors to test: those without an estimate, the top of
+           those predicted, and a random few of the rest
+
+           predicted maps mirrors to their estimates."""
+        ranked = sorted(predicted, key=predicted.get)
+        rest = ranked[self.top:]
+        explored = random.sample(rest, min(self.explore, len(rest)))
+        return list(unknown) + ranked[:self.top] + explored
@@ -3,59 +3,236 @@
 
    Provides latency testing and mirror attribute getting from Launchpad."""
 
-from sys import stderr
-from socket import (socket, AF_INET, SOCK_STREAM,
-                    gethostbyname, error, timeout, gaierror)
-from time import time
-from apt_select.utils import progress_msg, get_text, URLGetTextError
+from copy import copy
+from socket import AF_INET, AF_INET6
+from apt_select.utils import (progress_msg, get_text, iter_text,
+                              URLGetTextError)
+from apt_select.probe import (RoundTrips, HTTPRoundTrips,
+                              DEFAULT_MAX_CONNECTIONS, DEFAULT_NUM_TRIPS,
+                              DEFAULT_INTERVAL, DEFAULT_STAT, DEFAULT_PROBE)
+from apt_select.cache import LAUNCHPAD_INDEX, LAUNCHPAD_MIRRORS
+from apt_select.throughput import measure_throughput, THROUGHPUT_PATH
+from apt_select.resolver import resolve_all, with_port, FAMILY_NAMES
+from apt_select.store import RTTS, STATUSES
+from apt_select.freshness import FreshnessCheck, PRIMARY_ARCHIVE
+from apt_select.records import MirrorRecord, Ranking
+from apt_select.history import address_prefix, FAILURE_PENALTY
+from apt_select.timing import span, record_span
 try:
     from urlparse import urlparse
 except ImportError:
     from urllib.parse import urlparse
 
-from threading import Thread
+try:
+    from HTMLParser import HTMLParser
+except ImportError:
+    from html.parser import HTMLParser
+
+from threading import Thread, Event, Lock
+from time import time
 
 try:
-    from queue import Queue, Empty
+    from time import monotonic as clock
 except ImportError:
-    from Queue import Queue, Empty
+    from time import time as clock
 
-from bs4 import BeautifulSoup, FeatureNotFound
-PARSER = "lxml"
 try:
-    BeautifulSoup("", PARSER)
-except FeatureNotFound:
-    PARSER = "html.parser"
+    from queue import Queue, Empty
+except ImportError:
+    from Queue import Queue, Empty
 
 try:
     xrange
 except NameError:
     xrange = range
 
+DEFAULT_LOOKUP_WORKERS = 4
+# Release file heads are small and fetched for every ranked mirror, so
+# are fetched by a wider pool than Launchpad pages
+FRESHNESS_WORKERS = 16
+# Mirrors kept testing while racing, per mirror to be ranked
+RACE_KEEP_FACTOR = 2
+# Milliseconds apt waits on its preferred address family before trying
+# another, as recommended by RFC 8305
+HAPPY_EYEBALLS_DELAY = 250
+DEFAULT_PORTS = {"http": 80, "https": 443, "ftp": 21}
+FAMILIES = {"4": (AF_INET,), "6": (AF_INET6,), "any": (AF_INET, AF_INET6)}
+FAMILY_CODES = dict((name, family) for family, name in FAMILY_NAMES.items())
+# We don't care about lookups longer than 7 seconds as we're only
+# getting 16 KB
+LOOKUP_TIMEOUT = 7
+
+
+_parser = None
+
+
+def get_parser():
+    """Return BeautifulSoup and the fastest tree builder available
+
+       Imported and detected on first use, as only status lookups parse
+       HTML trees."""
+    global _parser
+    if _parser is None:
+        from bs4 import BeautifulSoup, FeatureNotFound
+        try:
+            BeautifulSoup("", "lxml")
+        except FeatureNotFound:
+            _parser = (BeautifulSoup, "html.parser")
+        else:
+            _parser = (BeautifulSoup, "lxml")
+
+    return _parser
+
+
+def _fetch(cache, namespace, url, parse, stream=False, valid=None):
+    """Return parsed document at url, from cache if one is in use"""
+    if cache is None:
+        return parse(iter_text(url) if stream else get_text(url))
+
+    return cache.fetch(namespace, url, url, parse, stream, valid)
+
+
+class _LaunchpadIndexParser(HTMLParser):
+    """Incremental parser of the anchors in Launchpad's archive mirror table
+
+       Each mirror's Launchpad page link precedes the links to its archive,
+       so only the most recent page link has to be kept while reading."""
+
+    MIRROR_PATH = "/ubuntu/+mirror/"
+
+    def __init__(self, base, wanted=None):
+        HTMLParser.__init__(self)
+        self.index = {}
+        self.done = False
+        self.truncated = False
+        self._base = base
+        self._remaining = set(wanted) if wanted is not None else None
+        self._depth = 0
+        self._prev = ""
+
+    def handle_starttag(self, tag, attrs):
+        if self.done:
+            return
+
+        if tag == 'table':
+            self._depth += 1
+        elif tag == 'a' and self._depth:
+            href = dict(attrs).get('href')
+            if not href:
+                return
+
+            if href.startswith(self.MIRROR_PATH):
+                self._prev = href
+            elif self._prev:
+                self.index[href] = self._base + self._prev
+                if self._remaining is not None:
+                    self._remaining.discard(href)
+                    self.truncated = self.done = not self._remaining
+
+    def handle_endtag(self, tag):
+        if tag == 'table' and self._depth:
+            self._depth -= 1
+            # Only the first table lists mirrors
+            self.done = self.done or not self._depth
+
+
+def parse_launchpad_index(chunks, base, wanted=None):
+    """Map archive URLs to their Launchpad pages from chunks of the archive
+       mirrors page HTML
+
+       Reading stops as soon as every wanted URL is found. Returns the
+       mapping, and whether all of the page's mirrors are in it."""
+    parser = _LaunchpadIndexParser(base, wanted)
+    for chunk in chunks:
+        parser.feed(chunk)
+        if parser.done:
+            break
+
+    close = getattr(chunks, 'close', None)
+    if close:
+        close()
+
+    return {"mirrors": parser.index, "complete": not parser.truncated}
+
+
+def parse_mirror_page(launch_html):
+    """Parse mirror attributes and the statuses of all series/arches from
+       a Launchpad mirror page"""
+    info = {"Statuses": []}
+    soup_class, tree_builder = get_parser()
+    soup = soup_class(launch_html, tree_builder)
+    # Find elements of the ids we need
+    for line in soup.find_all(id=['arches', 'speed', 'organisation']):
+        if line.name == 'table':
+            # Status information lives in a table column alongside
+            # series name and machine architecture
+            for tr in line.find('tbody').find_all('tr'):
+                arches = [x.get_text() for x in tr.find_all('td')]
+                if len(arches) >= 3:
+                    info["Statuses"].append(arches[:3])
+        else:
+            # "Speed" lives in a dl, and we use the key -> value as such
+            info.update({
+                line.dt.get_text().strip(':'): line.dd.get_text()
+            })
 
-class ConnectError(Exception):
-    """Socket connection errors"""
-    pass
+    return info
 
 
 class Mirrors(object):
     """Base for collection of archive mirrors"""
 
-    def __init__(self, url_list, ping_only, min_status):
+    def __init__(self, url_list, ping_only, min_status,
+                 max_connections=DEFAULT_MAX_CONNECTIONS, cache=None,
+                 samples=DEFAULT_NUM_TRIPS, interval=DEFAULT_INTERVAL,
+                 rank_by=DEFAULT_STAT, families=FAMILIES["any"],
+                 store=None, snapshot=None, probe=DEFAULT_PROBE,
+                 codename=None, history=None):
         self.urls = {}
+        self._store = store
+        self._history = history
+        # Latency history keys of each tested mirror, by address family
+        self._history_keys = {}
+        self._snapshot = snapshot
+        self._families = families
+        self._errors = {}
+        self._cache = cache
         self._url_list = url_list
         self._num_trips = 0
+        self._samples = samples
+        self._rank_by = rank_by
+        # Mirrors dropped from a race, ranked behind its contenders
+        self._dropped = frozenset()
         self.got = {"ping": 0, "data": 0}
-        self.ranked = []
+        self.ranked = Ranking()
         self.top_list = []
-        self._trip_queue = Queue()
+        # Called with (event, url, info) as each mirror's results complete
+        self.result_callback = None
+        # Called with text reporting progress, silent if None
+        self.progress = None
+        if probe == "http":
+            self._trips = HTTPRoundTrips(
+                codename, max_connections, samples, interval=interval
+            )
+        else:
+            self._trips = RoundTrips(
+                max_connections, samples, interval=interval
+            )
+        # Latency of different probes isn't comparable, so isn't shared
+        self._rtts_key = None
+        if store is not None:
+            self._rtts_key = store.segment
+            if probe != DEFAULT_PROBE:
+                self._rtts_key += "/" + probe
         if not ping_only:
             self._launchpad_base = "https://launchpad.net"
             self._launchpad_url = (
                 self._launchpad_base + "/ubuntu/+archivemirrors"
             )
-            self._launchpad_html = ""
             self.abort_launch = False
+            self._launch_looked_up = False
+            # Launchpad records by page, shared with copies of the mirrors
+            self._records = _Records()
             self._status_opts = (
                 "unknown",
                 "One week behind",
@@ -67,254 +244,694 @@ class Mirrors(object):
             self._status_opts = self._status_opts[index:]
             # Default to top
             self.status_num = 1
+            self.lookup_workers = DEFAULT_LOOKUP_WORKERS
+
+    def __notify(self, event, url, info=None):
+        if self.result_callback is not None:
+            self.result_callback(event, url, info or self.urls[url])
+
+    def __report(self, text):
+        if self.progress is not None:
+            self.progress(text)
+
+    def copy(self):
+        """Return mirrors sharing these latency results and Launchpad
+           records, to look up statuses for another release or arch"""
+        archives = copy(self)
+        archives.urls = dict(
+            (url, info.copy()) for url, info in self.urls.items()
+        )
+        archives.ranked = self.ranked.copy()
+        archives.top_list = []
+        archives.got = {"ping": self.got["ping"], "data": 0}
+        return archives
 
     def get_launchpad_urls(self):
-        """Obtain mirrors' corresponding launchpad URLs"""
-        stderr.write("Getting list of launchpad URLs...")
+        """Obtain mirrors' corresponding launchpad URLs, once for these
+           mirrors and their copies"""
+        if self._launch_looked_up:
+            return
+
+        self._launch_looked_up = True
+        wanted = frozenset(self.urls)
+        if self._snapshot is not None:
+            known = set()
+            for url in wanted:
+                launch_url = self._snapshot.launchpad_url(url)
+                if launch_url is not None:
+                    self.urls[url]["Launchpad"] = launch_url
+                    known.add(url)
+
+            # Only mirrors missing from the snapshot are looked up
+            wanted = wanted - known
+            if not wanted:
+                return
+
+        self.__report("Getting list of launchpad URLs...")
         try:
-            self._launchpad_html = get_text(self._launchpad_url)
+            with span("launchpad index"):
+                index = _fetch(
+                    self._cache,
+                    LAUNCHPAD_INDEX,
+                    self._launchpad_url,
+                    lambda chunks: parse_launchpad_index(
+                        chunks, self._launchpad_base, wanted
+                    ),
+                    stream=True,
+                    # A partially read index is only of use to the mirrors in it
+                    valid=lambda index: (
+                        index.get("complete") or
+                        wanted.issubset(index.get("mirrors", ()))
+                    )
+                )
         except URLGetTextError as err:
-            stderr.write((
+            self.__report((
                 "%s: %s\nUnable to retrieve list of launchpad sites\n"
                 "Reverting to latency only\n" % (self._launchpad_url, err)
             ))
             self.abort_launch = True
         else:
-            stderr.write("done.\n")
-            self.__parse_launchpad_list()
-
-    def __parse_launchpad_list(self):
-        """Parse Launchpad's list page to find each mirror's
-           Official page"""
-        soup = BeautifulSoup(self._launchpad_html, PARSER)
-        prev = ""
-        for element in soup.table.descendants:
+            self.__report("done.\n")
+            for url, launch_url in index["mirrors"].items():
+                if url in self.urls:
+                    self.urls[url]["Launchpad"] = launch_url
+
+            self.__save_cache()
+
+    def __save_cache(self):
+        if self._cache is not None:
+            self._cache.save()
+
+    def __kickoff_trips(self, url_list):
+        """Resolve mirror hosts concurrently, queueing round trips to each
+           of their addresses, of the mirrors chosen by the latency history
+           if there is one
+
+           Returns number of addresses queued per mirror"""
+
+        parsed = {}
+        for url in url_list:
+            parsed[url] = urlparse(url)
+
+        resolved = {}
+        hosts = [p.hostname for p in parsed.values() if p.hostname]
+        with span("resolve hosts"):
+            for host, addrs, err in resolve_all(hosts, self._families):
+                resolved[host] = addrs or err
+
+        candidates = []
+        seen = set()
+        for url in url_list:
+            if url in seen:
+                continue
+
+            parsed_url = parsed[url]
+            addrs = resolved.get(parsed_url.hostname, "no host name")
             try:
-                url = element.a
-            except AttributeError:
-                pass
-            else:
-                try:
-                    url = url["href"]
-                except TypeError:
-                    pass
-                else:
-                    if url in self.urls:
-                        self.urls[url]["Launchpad"] = (
-                            self._launchpad_base + prev
-                        )
+                port = parsed_url.port or DEFAULT_PORTS.get(
+                    parsed_url.scheme, DEFAULT_PORTS["http"]
+                )
+            except ValueError as err:
+                addrs = err
 
-                    if url.startswith("/ubuntu/+mirror/"):
-                        prev = url
+            if not isinstance(addrs, list):
+                self.__report("%s: %s ignored\n" % (addrs, url))
+                continue
 
-    def __kickoff_trips(self):
-        """Instantiate round trips class for all, initiating queued threads"""
+            seen.add(url)
+            candidates.append((url, parsed_url, addrs, port))
 
-        for url in self._url_list:
-            host = urlparse(url).netloc
-            try:
-                thread = Thread(
-                    target=_RoundTrip(url, host, self._trip_queue).min_rtt
-                )
-            except gaierror as err:
-                stderr.write("%s: %s ignored\n" % (err, url))
+        if self._history is not None:
+            candidates = self.__choose_by_history(candidates)
+
+        addresses = {}
+        for url, parsed_url, addrs, port in candidates:
+            self.urls[url] = MirrorRecord(
+                Host=parsed_url.netloc,
+                Families={},
+                Preferred=FAMILY_NAMES[addrs[0][0]]
+            )
+            for family, sockaddr in addrs:
+                self._trips.add(url, family, with_port(sockaddr, port))
+            addresses[url] = len(addrs)
+
+        self._num_trips = len(addresses)
+        return addresses
+
+    def __choose_by_history(self, candidates):
+        """Return the candidates the latency history doesn't predict to be
+           slower than the best, and a few others to explore"""
+        estimated = []
+        for url, _, addrs, _ in candidates:
+            keys = self._history_keys.setdefault(url, {})
+            for family, sockaddr in addrs:
+                source = self._history.source(family, sockaddr)
+                if source is not None:
+                    keys.setdefault(FAMILY_NAMES[family], (
+                        source, address_prefix(family, sockaddr[0])
+                    ))
+            estimated.extend(keys.values())
+
+        estimates = self._history.estimates(estimated)
+        predicted = {}
+        unknown = []
+        for url, _, _, _ in candidates:
+            known = [estimates[key] for key in self._history_keys[url].values()
+                     if key in estimates]
+            if known:
+                predicted[url] = min(known)
             else:
-                self.urls[url] = {"Host": host}
-                thread.daemon = True
-                thread.start()
-                self._num_trips += 1
+                unknown.append(url)
 
-    def get_rtts(self):
-        """Test latency to all mirrors"""
+        chosen = frozenset(self._history.choose(predicted, unknown))
+        if len(chosen) < len(candidates):
+            self.__report((
+                "Skipping %d mirror(s) predicted slower by latency "
+                "history\n" % (len(candidates) - len(chosen))
+            ))
+        return [candidate for candidate in candidates
+                if candidate[0] in chosen]
+
+    def __save_history(self):
+        """Fold latency tested to each mirror into its network's estimate,
+           samples lost counting as the failure penalty"""
+        stat = self.__latency_stat()
+        measured = {}
+        for url, keys in self._history_keys.items():
+            info = self.urls.get(url)
+            if info is None:
+                continue
+
+            for name, key in keys.items():
+                stats = info["Families"].get(name)
+                latency = FAILURE_PENALTY
+                if stats is not None:
+                    latency = stats[stat] + stats["loss"] * FAILURE_PENALTY
+                measured.setdefault(key, []).append(latency)
+
+        self._history.update(dict(
+            (key, sum(latencies) / len(latencies))
+            for key, latencies in measured.items()
+        ))
+
+    def __shared_rtts_key(self, url):
+        # Each mirror's result is stored under its own key, so hosts
+        # storing theirs at once don't overwrite each other's
+        return "%s/%s" % (self._rtts_key, url)
+
+    def __load_shared_rtts(self):
+        """Take fresh latency results of other hosts from the store
+
+           Returns the mirrors to be tested: the best ranked reused
+           mirrors, and any without fresh results."""
+        for url in self._url_list:
+            result = self._store.get(
+                RTTS, self.__shared_rtts_key(url), self._store.max_age
+            )
+            if not result:
+                continue
 
-        stderr.write("Testing latency to mirror(s)\n")
-        self.__kickoff_trips()
+            self.urls[url] = MirrorRecord(
+                Host=result["Host"],
+                Families={},
+                Preferred=result["Preferred"]
+            )
+            for name, stats in result["Families"].items():
+                self.__set_stats(url, FAMILY_CODES[name], stats, None)
 
-        processed = 0
-        progress_msg(processed, self._num_trips)
-        for _ in xrange(self._num_trips):
-            try:
-                min_rtt = self._trip_queue.get(block=True)
-            except Empty:
-                pass
-            else:
-                # we can ignore empty rtt results (None) from the queue
-                # as in this case ConnectError was already raised
-                if min_rtt:
-                    self._trip_queue.task_done()
-                    self.urls[min_rtt[0]].update({"Latency": min_rtt[1]})
-                    self.got["ping"] += 1
+        reused = sorted(self.urls, key=self.__rank_key)
+        if reused:
+            self.__report("Reusing shared latency of %d mirror(s)\n" % (
+                len(reused)
+            ))
+        reprobe = frozenset(reused[:self._store.reprobe])
+        return [url for url in self._url_list
+                if url in reprobe or url not in self.urls]
+
+    def __save_shared_rtts(self, tested):
+        """Store latency results of tested mirrors"""
+        for url in tested:
+            info = self.urls.get(url)
+            if info and info["Families"]:
+                self._store.set(RTTS, self.__shared_rtts_key(url), {
+                    "Host": info["Host"],
+                    "Families": info["Families"],
+                    "Preferred": info["Preferred"]
+                })
+
+    def get_rtts(self, race_num=None):
+        """Test latency to all mirrors
 
-            processed += 1
-            progress_msg(processed, self._num_trips)
+           If race_num is given, mirrors that can't reach the top race_num
+           are dropped from further tests after each round, and ranked
+           behind the remaining contenders."""
+
+        tested = self._url_list
+        if self._store is not None:
+            tested = self.__load_shared_rtts()
+
+        self.__report("Testing latency to mirror(s)\n")
+        waiting = self.__kickoff_trips(tested)
+        processed = 0
+        rounds = 1 if race_num else self._samples
+        progress_msg(processed, self._num_trips, self.progress)
+        with span("latency tests"):
+            for url, family, stats, err in self._trips.run(num_trips=rounds):
+                self.__set_stats(url, family, stats, err)
+                waiting[url] -= 1
+                if not waiting[url]:
+                    record_span(
+                        "latency test", self._trips.started(url), "mirror",
+                        url=url
+                    )
+                    processed += 1
+                    progress_msg(processed, self._num_trips, self.progress)
+                    if not race_num and "Latency" in self.urls[url]:
+                        self.__notify("latency", url)
+
+            self.__report('\n')
+            if race_num:
+                contenders = self.__race(race_num, self._samples - rounds)
+                self._dropped = frozenset(self.urls).difference(contenders)
+                for url in sorted(self.urls):
+                    if "Latency" in self.urls[url]:
+                        self.__notify("latency", url)
+
+        if self._store is not None:
+            self.__save_shared_rtts(tested)
+        if self._history is not None:
+            self.__save_history()
 
-        stderr.write('\n')
         # Mirrors without latency info are removed
-        self.urls = {
-            key: val for key, val in self.urls.items() if "Latency" in val
-        }
+        for url in list(self.urls):
+            if "Latency" not in self.urls[url]:
+                self.__report("\tconnection to %s: %s\n" % (
+                    self.urls[url]["Host"], self._errors.get(url)
+                ))
+                del self.urls[url]
+        self.got["ping"] = len(self.urls)
 
-        self.ranked = sorted(
-            self.urls, key=lambda x: self.urls[x]["Latency"]
+        self.ranked = Ranking(
+            (url, self.__rank_key(url)) for url in self.urls
         )
 
-    def __queue_lookups(self, codename, arch, data_queue):
-        """Queue threads for data retrieval from launchpad.net
-
-           Returns number of threads started to fulfill number of
-           requested statuses"""
-        num_threads = 0
-        for url in self.ranked:
-            try:
-                launch_url = self.urls[url]["Launchpad"]
-            except KeyError:
-                pass
+    def __set_stats(self, url, family, stats, err):
+        """Update a mirror's latency with that of the address family apt
+           would connect with"""
+        info = self.urls[url]
+        if stats is None:
+            # Errors are only reported if no address can be connected to
+            self._errors[url] = err
+            return
+
+        info["Families"][FAMILY_NAMES[family]] = stats
+        stat = self.__latency_stat()
+        families = info["Families"]
+        # apt connects with its preferred family, only falling back to
+        # another one if it's slower than the Happy Eyeballs delay
+        chosen = min(families, key=lambda x: families[x][stat] + (
+            0 if x == info["Preferred"] else HAPPY_EYEBALLS_DELAY
+        ))
+        info.update({
+            "Latency": families[chosen][stat],
+            "Stats": families[chosen],
+            "Family": chosen
+        })
+
+    def __race(self, race_num, remaining):
+        """Run remaining rounds of tests, successively halving the mirrors
+           tested down to contenders for the top race_num"""
+        keep = RACE_KEEP_FACTOR * race_num
+        contenders = list(self.urls)
+        while remaining:
+            # Mirrors failing every test so far keep a chance if there's room
+            contenders.sort(key=lambda x: (
+                self.__rank_key(x) if "Stats" in self.urls[x]
+                else (True, float('inf'), float('inf'))
+            ))
+            num_trips = 1
+            if len(contenders) > keep:
+                contenders = contenders[:max(keep, (len(contenders) + 1) // 2)]
             else:
-                thread = Thread(
-                    target=_LaunchData(
-                        url,
-                        launch_url,
-                        codename,
-                        arch,
-                        data_queue
-                    ).get_info
-                )
-                thread.daemon = True
-                thread.start()
+                num_trips = remaining
+
+            for url, family, stats, err in self._trips.run(
+                    contenders, num_trips):
+                self.__set_stats(url, family, stats, err)
+            remaining -= num_trips
+
+        self.__report("Raced to %d contender(s) with %d test(s)\n" % (
+            len(contenders), self._trips.probes()
+        ))
+        return contenders
+
+    def __latency_stat(self):
+        """Return the statistic reported as a mirror's latency
+
+           Mirrors ranked by jitter or loss report their median latency"""
+        if self._rank_by in ("min", "median", "p90"):
+            return self._rank_by
+
+        return "median"
+
+    def __rank_key(self, url):
+        # Statistics of mirrors dropped after a sample or two, e.g. their
+        # deviation or loss, can't be compared with those of contenders
+        stats = self.urls[url]["Stats"]
+        return url in self._dropped, stats[self._rank_by], stats["median"]
+
+    def benchmark_throughput(self, codename, arch, candidates_num, weight):
+        """Measure download speed of the lowest latency mirrors, re-ranking
+           them by a score weighing throughput against latency
+
+           Scores are relative to the best latency and throughput measured,
+           lower being better. Mirrors that can't be downloaded from are
+           ranked after the rest of the candidates."""
+        candidates = self.ranked.top(candidates_num)
+        if not candidates:
+            return
+
+        path = THROUGHPUT_PATH % {'codename': codename, 'arch': arch}
+        num = len(candidates)
+        self.__report("Testing throughput of %d mirror(s)\n" % num)
+        processed = 0
+        progress_msg(processed, num, self.progress)
+        with span("throughput tests"):
+            for url, bps in measure_throughput(
+                    candidates, path, progress=self.progress):
+                if bps is not None:
+                    self.urls[url]["Throughput"] = bps
+                    self.__notify("throughput", url)
+                processed += 1
+                progress_msg(processed, num, self.progress)
+
+        self.__report('\n')
+        measured = [self.urls[url]["Throughput"] for url in candidates
+                    if "Throughput" in self.urls[url]]
+        best_bps = max(measured) if measured else 0
+        best_latency = max(
+            min(self.urls[url]["Latency"] for url in candidates), 1e-3
+        )
+        for url in candidates:
+            info = self.urls[url]
+            if "Throughput" not in info:
+                info["Score"] = float('inf')
+                continue
+
+            info["Score"] = (
+                (1 - weight) * info["Latency"] / best_latency +
+                weight * best_bps / info["Throughput"]
+            )
 
-                num_threads += 1
+        # Candidates stay ahead of the rest, ordered by score
+        for url in candidates:
+            self.ranked.add(url, (float('-inf'), self.urls[url]["Score"]))
 
-            # We expect number of retrieved status requests may already
-            # be greater than 0.  This would be the case anytime an initial
-            # pass ran into errors.
-            if num_threads == (self.status_num - self.got["data"]):
-                break
+    def __start_lookups(self, candidates, lookup, data_queue, workers):
+        """Start a fixed pool of workers threads calling
+           lookup(url, data_queue) to retrieve each candidate's status
 
-        return num_threads
+           Workers take candidates in latency rank order, so a constant
+           number of lookups is in flight until the pool is cancelled.
+           Returns the cancellation event and the start time of each
+           lookup."""
+        tasks = Queue()
+        for url in candidates:
+            tasks.put(url)
 
-    def lookup_statuses(self, codename, arch, min_status):
-        """Scrape statuses/info in from launchpad.net mirror pages"""
-        while (self.got["data"] < self.status_num) and self.ranked:
-            data_queue = Queue()
-            num_threads = self.__queue_lookups(codename, arch, data_queue)
-            if num_threads == 0:
-                break
-            # Get output of all started thread methods from queue
-            progress_msg(self.got["data"], self.status_num)
-            for _ in xrange(num_threads):
+        cancelled = Event()
+        started = {}
+
+        def work():
+            while not cancelled.is_set():
                 try:
-                    # We don't care about timeouts longer than 7 seconds as
-                    # we're only getting 16 KB
-                    info = data_queue.get(block=True, timeout=7)
+                    url = tasks.get_nowait()
                 except Empty:
-                    pass
-                else:
-                    data_queue.task_done()
-                    if info[1] and info[1]["Status"] in self._status_opts:
-                        self.urls[info[0]].update(info[1])
-                        self.got["data"] += 1
-                        self.top_list.append(info[0])
-                        progress_msg(self.got["data"], self.status_num)
-
-                    # Eliminate the url from the ranked list as long as
-                    # something is received from the queue (for selective
-                    # iteration if another queue needs to be built)
-                    self.ranked.remove(info[0])
-
-                if (self.got["data"] == self.status_num):
-                    break
+                    return
 
-            # Reorder by latency as queue returns vary building final list
-            self.top_list.sort(key=lambda x: self.urls[x]["Latency"])
+                started[url] = time()
+                lookup(url, data_queue)
 
-            data_queue.join()
+        for _ in xrange(min(workers, len(candidates))):
+            thread = Thread(target=work)
+            thread.daemon = True
+            thread.start()
 
+        return cancelled, started
 
-class _RoundTrip(object):
-    """Socket connections for latency reporting"""
-
-    def __init__(self, url, host, trip_queue):
-        self._url = url
-        self._host = host
-        self._trip_queue = trip_queue
-        self._addr = gethostbyname(host)
-
-    def __tcp_ping(self):
-        """Return socket latency to host's resolved IP address"""
-        port = 80
-        sock = socket(AF_INET, SOCK_STREAM)
-        sock.settimeout(2.5)
-        send_tstamp = time()*1000
-        try:
-            sock.connect((self._addr, port))
-        except (timeout, error) as err:
-            raise ConnectError(err)
-
-        recv_tstamp = time()*1000
-        rtt = recv_tstamp - send_tstamp
-        sock.close()
-        return rtt
-
-    def min_rtt(self):
-        """Return lowest rtt"""
-        rtts = []
-        for _ in xrange(3):
+    def lookup_statuses(self, codename, arch, min_status):
+        """Scrape statuses/info in from launchpad.net mirror pages"""
+        candidates = [url for url in self.ranked
+                      if "Launchpad" in self.urls[url]]
+        if not candidates:
+            self.__save_cache()
+            return
+
+        start = clock()
+        data_queue = Queue()
+        cancelled, started = self.__start_lookups(
+            candidates,
+            lambda url, data_queue: _LaunchData(
+                url,
+                self.urls[url]["Launchpad"],
+                codename,
+                arch,
+                data_queue,
+                self._cache,
+                self._store,
+                self._snapshot,
+                self._records,
+                self.progress
+            ).get_info(),
+            data_queue,
+            self.lookup_workers
+        )
+        results = {}
+        head = 0
+        progress_msg(self.got["data"], self.status_num, self.progress)
+        while (self.got["data"] < self.status_num and
+               head < len(candidates)):
+            # Statuses are accepted in latency rank order, so the wait is
+            # on the best ranked mirror still without a result
+            url = candidates[head]
+            wait = LOOKUP_TIMEOUT
+            if url in started:
+                wait = max(started[url] + LOOKUP_TIMEOUT - time(), 0)
             try:
-                rtt = self.__tcp_ping()
-            except ConnectError as err:
-                stderr.write("\tconnection to %s: %s\n" % (self._host, err))
-                self._trip_queue.put_nowait(None)
-                return
+                info = data_queue.get(block=True, timeout=wait)
+            except Empty:
+                if url not in started:
+                    # Workers are busy with slow pages, the mirror's own
+                    # timeout only runs once its lookup starts
+                    continue
+
+                self.__report("connection to %s: timed out\n" % (
+                    self.urls[url]["Launchpad"]
+                ))
+                results[url] = None
             else:
-                rtts.append(rtt)
+                results.setdefault(info[0], info[1])
+
+            while head < len(candidates) and candidates[head] in results:
+                url = candidates[head]
+                info = results[url]
+                head += 1
+                if info:
+                    self.__notify("status", url, dict(self.urls[url], **info))
+                if info and info["Status"] in self._status_opts:
+                    self.urls[url].update(info)
+                    self.got["data"] += 1
+                    self.top_list.append(url)
+                    progress_msg(
+                        self.got["data"], self.status_num, self.progress
+                    )
+                    if self.got["data"] == self.status_num:
+                        break
+
+        record_span("status lookups", start)
+        # Outstanding lookups aren't needed, leave them to finish unread
+        cancelled.set()
+        self.__save_cache()
+
+    def check_freshness(self, codename, reference_url=PRIMARY_ARCHIVE):
+        """Set statuses from the lag of mirrors' release files behind the
+           primary archive's, or the freshest mirror's, without Launchpad
+
+           Release files of every ranked mirror are fetched concurrently,
+           as the freshest one is only known once all of them are. Each
+           fetch times out on its own, once started."""
+        start = clock()
+        check = FreshnessCheck(codename, reference_url, self.progress)
+        data_queue = Queue()
+        candidates = list(self.ranked)
+        cancelled, started = self.__start_lookups(
+            candidates,
+            lambda url, data_queue: data_queue.put((url, check.fetch(url))),
+            data_queue,
+            max(self.lookup_workers, FRESHNESS_WORKERS)
+        )
+        with span("reference release file"):
+            check.set_reference()
+
+        released = {}
+        timed_out = 0
+        while len(released) < len(candidates):
+            deadlines = [started[url] + LOOKUP_TIMEOUT for url in candidates
+                         if url in started and url not in released]
+            wait = LOOKUP_TIMEOUT
+            if deadlines:
+                wait = max(min(deadlines) - time(), 0)
+            try:
+                url, date = data_queue.get(block=True, timeout=wait)
+            except Empty:
+                now = time()
+                for url in candidates:
+                    if (url in started and url not in released and
+                            started[url] + LOOKUP_TIMEOUT <= now):
+                        released[url] = None
+                        timed_out += 1
+                continue
+
+            released.setdefault(url, date)
+
+        if timed_out:
+            self.__report("%d release file(s) timed out\n" % timed_out)
+        cancelled.set()
+        progress_msg(self.got["data"], self.status_num, self.progress)
+        for url in candidates:
+            # Mirrors whose release file couldn't be read are unknown
+            info = check.status(released.get(url))
+            self.__notify("status", url, dict(self.urls[url], **info))
+            if info["Status"] in self._status_opts:
+                self.urls[url].update(info)
+                self.got["data"] += 1
+                self.top_list.append(url)
+                progress_msg(
+                    self.got["data"], self.status_num, self.progress
+                )
+                if self.got["data"] == self.status_num:
+                    break
+
+        record_span("freshness checks", start)
+
+
+class _Records(object):
+    """Launchpad records read in a run, by page, each page being read once
+       however many lookups want it at the same time"""
 
-        self._trip_queue.put((self._url, min(rtts)))
+    def __init__(self):
+        self._lock = Lock()
+        self._records = {}
+        self._pending = {}
+
+    def get(self, launch_url, read):
+        """Return record of a page, calling read for it unless another
+           lookup has read it, or is reading it"""
+        with self._lock:
+            reading = self._pending.get(launch_url)
+            if reading is None and launch_url not in self._records:
+                self._pending[launch_url] = Event()
+
+        if reading is not None:
+            reading.wait(LOOKUP_TIMEOUT)
+
+        with self._lock:
+            if launch_url in self._records:
+                return self._records[launch_url]
+
+        # The other lookup failed or is too slow, try again
+        if reading is not None:
+            return read()
+
+        try:
+            record = read()
+            with self._lock:
+                self._records[launch_url] = record
+            return record
+        finally:
+            with self._lock:
+                self._pending.pop(launch_url).set()
 
 
 class _LaunchData(object):
-    def __init__(self, url, launch_url, codename, arch, data_queue):
+    def __init__(self, url, launch_url, codename, arch, data_queue,
+                 cache=None, store=None, snapshot=None, records=None,
+                 progress=None):
         self._url = url
         self._launch_url = launch_url
         self._codename = codename
         self._arch = arch
         self._data_queue = data_queue
-
-    def __parse_mirror_html(self, launch_html):
-        info = {}
-        soup = BeautifulSoup(launch_html, PARSER)
-        # Find elements of the ids we need
-        for line in soup.find_all(id=['arches', 'speed', 'organisation']):
-            if line.name == 'table':
-                # Status information lives in a table column alongside
-                # series name and machine architecture
-                for tr in line.find('tbody').find_all('tr'):
-                    arches = [x.get_text() for x in tr.find_all('td')]
-                    if (self._codename in arches[0] and
-                            arches[1] == self._arch):
-                        info.update({"Status": arches[2]})
-            else:
-                # "Speed" lives in a dl, and we use the key -> value as such
-                info.update({
-                    line.dt.get_text().strip(':'): line.dd.get_text()
-                })
+        self._cache = cache
+        self._store = store
+        self._snapshot = snapshot
+        self._records = records if records is not None else _Records()
+        self._progress = progress
+
+    def __report(self, text):
+        if self._progress is not None:
+            self._progress(text)
+
+    def __select_info(self, record):
+        """Pick the status of our series and arch from a mirror's record"""
+        info = dict(
+            (key, val) for key, val in record.items() if key != "Statuses"
+        )
+        for series, arch, status in record["Statuses"]:
+            if self._codename in series and arch == self._arch:
+                info.update({"Status": status})
 
         return info
 
+    def __known_record(self):
+        """Return a fresh record of the mirror from the snapshot, or another
+           host's from the store, if either has one"""
+        if self._snapshot is not None:
+            record = self._snapshot.record(self._url)
+            if record is not None:
+                return record
+
+        if self._store is None:
+            return None
+
+        return self._store.get(
+            STATUSES, self._launch_url, self._store.status_max_age
+        )
+
+    def __read_record(self):
+        """Return record of the mirror, scraping its page if not known"""
+        record = self.__known_record()
+        if record is None:
+            record = _fetch(
+                self._cache,
+                LAUNCHPAD_MIRRORS,
+                self._launch_url,
+                parse_mirror_page
+            )
+            if self._store is not None:
+                self._store.set(STATUSES, self._launch_url, record)
+
+        return record
+
     def get_info(self):
         """Parse launchpad page HTML for mirror information
 
         Ideally, launchpadlib would be used to get mirror information, but the
         Launchpad API doesn't support access to archivemirror statuses."""
 
+        start = clock()
         try:
-            launch_html = get_text(self._launch_url)
+            with span("launchpad mirror page", "mirror", url=self._launch_url):
+                record = self._records.get(
+                    self._launch_url, self.__read_record
+                )
         except URLGetTextError as err:
-            stderr.write("connection to %s: %s\n" % (self._launch_url, err))
+            self.__report("connection to %s: %s\n" % (self._launch_url, err))
             self._data_queue.put_nowait((self._url, None))
         else:
-            info = self.__parse_mirror_html(launch_html)
+            info = self.__select_info(record)
             if "Status" not in info:
-                stderr.write((
+                self.__report((
                     "Unable to parse status info from %s\n" % self._launch_url
                 ))
                 self._data_queue.put_nowait((self._url, None))
@@ -325,4 +942,5 @@ class _LaunchData(object):
             if "unknown" in info["Status"]:
                 info["Status"] = "unknown"
 
+            info["Lookup"] = clock() - start
             self._data_queue.put((self._url, info))
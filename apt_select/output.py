@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+"""Machine readable output of mirror records
+
+   Records are written as soon as they're available, and flushed, so that
+   consumers can read them before a run completes. Each record has an
+   event of the stage it came from:
+        - latency: a mirror's latency tests completed
+        - throughput: a mirror's download speed was measured
+        - status: a mirror's Launchpad status was looked up, or its
+          release file's freshness checked
+        - rank: a mirror was ranked in the final report"""
+
+import csv
+import json
+from sys import stdout
+
+FORMATS = ("json", "csv", "ndjson")
+
+# Columns of flat records, in CSV output order
+FIELDS = (
+    "event",
+    "rank",
+    "url",
+    "host",
+    "country",
+    "family",
+    "latency",
+    "min",
+    "median",
+    "p90",
+    "stdev",
+    "loss",
+    "samples",
+    "throughput",
+    "score",
+    "status",
+    "speed",
+    "organisation",
+    "launchpad",
+    "lookup_seconds",
+    "released",
+    "lag",
+    "families",
+)
+
+
+def _finite(value):
+    """Return value, or None for infinities JSON can't represent"""
+    if isinstance(value, float) and value in (float('inf'), float('-inf')):
+        return None
+
+    return value
+
+
+def mirror_record(event, url, info, rank=None):
+    """Return flat record of a mirror from its Mirrors.urls entry"""
+    stats = info.get("Stats", {})
+    record = {
+        "event": event,
+        "rank": rank,
+        "url": url,
+        "host": info.get("Host"),
+        "country": info.get("Country"),
+        "family": info.get("Family"),
+        "latency": info.get("Latency"),
+        "throughput": info.get("Throughput"),
+        "score": _finite(info.get("Score")),
+        "status": info.get("Status"),
+        "speed": info.get("Speed"),
+        "organisation": info.get("Organisation"),
+        "launchpad": info.get("Launchpad"),
+        "lookup_seconds": info.get("Lookup"),
+        "released": info.get("Released"),
+        "lag": info.get("Lag"),
+        # Nested statistics of each address family, a JSON column in CSV
+        "families": info.get("Families"),
+    }
+    for key in ("min", "median", "p90", "stdev", "loss", "samples"):
+        record[key] = stats.get(key)
+
+    return record
+
+
+class _Writer(object):
+    def __init__(self, stream=stdout):
+        self._stream = stream
+
+    def write(self, record):
+        self._write(record)
+        self._stream.flush()
+
+    def _write(self, record):
+        raise NotImplementedError
+
+    def close(self):
+        self._stream.flush()
+
+
+class NDJSONWriter(_Writer):
+    """Newline delimited JSON, one object per record"""
+
+    def _write(self, record):
+        self._stream.write(json.dumps(record, sort_keys=True) + "\n")
+
+
+class JSONWriter(_Writer):
+    """JSON array of records, written incrementally"""
+
+    def __init__(self, stream=stdout):
+        _Writer.__init__(self, stream)
+        self._separator = "[\n"
+
+    def _write(self, record):
+        self._stream.write(self._separator)
+        self._stream.write(json.dumps(record, sort_keys=True))
+        self._separator = ",\n"
+
+    def close(self):
+        # An empty array if nothing was written
+        self._stream.write("[]\n" if self._separator == "[\n" else "\n]\n")
+        _Writer.close(self)
+
+
+class CSVWriter(_Writer):
+    """CSV rows of flat records, with a header row
+
+       Nested fields are written as JSON."""
+
+    def __init__(self, stream=stdout):
+        _Writer.__init__(self, stream)
+        self._writer = csv.DictWriter(
+            stream, FIELDS, extrasaction='ignore', lineterminator="\n"
+        )
+        self._writer.writeheader()
+
+    def _write(self, record):
+        if record.get("families") is not None:
+            record = dict(
+                record, families=json.dumps(record["families"], sort_keys=True)
+            )
+        self._writer.writerow(record)
+
+
+WRITERS = {
+    "json": JSONWriter,
+    "csv": CSVWriter,
+    "ndjson": NDJSONWriter,
+}
+
+
+def get_writer(output_format, stream=stdout):
+    """Return writer of records in the given format"""
+    return WRITERS[output_format](stream)
@@ -0,0 +1,509 @@
+#!/usr/bin/env python
+"""Concurrent latency probing of archive mirrors
+
+   A single threaded event loop drives non-blocking TCP connections to every
+   mirror, keeping at most a fixed number of connection attempts in flight.
+   Samples are interleaved across mirrors: a mirror's next round trip is
+   queued behind every other mirror's pending one.
+
+   Round trips are either TCP handshakes, or requests for the release file
+   apt fetches first, timed to the first byte of the response."""
+
+import ssl
+from errno import EINPROGRESS, EWOULDBLOCK, EALREADY
+from socket import socket, SOCK_STREAM, SOL_SOCKET, SO_ERROR, error
+from os import strerror
+from collections import deque
+from math import sqrt
+
+try:
+    from selectors import DefaultSelector, EVENT_READ, EVENT_WRITE
+except ImportError:
+    from selectors34 import DefaultSelector, EVENT_READ, EVENT_WRITE
+
+try:
+    from time import monotonic as clock, sleep
+except ImportError:
+    from time import time as clock, sleep
+
+try:
+    from urlparse import urlparse
+except ImportError:
+    from urllib.parse import urlparse
+
+DEFAULT_MAX_CONNECTIONS = 64
+DEFAULT_NUM_TRIPS = 3
+DEFAULT_INTERVAL = 0
+CONNECT_TIMEOUT = 2.5
+# Seconds to connect and get the first byte of a response, in HTTP probes
+HTTP_TIMEOUT = 5
+
+# Ways mirrors can be probed
+PROBES = ("tcp", "http")
+DEFAULT_PROBE = "tcp"
+RELEASE_FILE = "InRelease"
+# Longest response head read from a mirror
+MAX_HEAD = 65536
+
+# Statistics of round trip times mirrors can be ranked by
+STATS = ("min", "median", "p90", "stdev", "loss")
+DEFAULT_STAT = "min"
+
+_CONNECTING = frozenset([0, EINPROGRESS, EWOULDBLOCK, EALREADY])
+
+
+def percentile(ordered, percent):
+    """Return nearest-rank percentile of sorted values, or None if there
+       are none"""
+    if not ordered:
+        return None
+
+    index = int(-(-len(ordered) * percent // 100)) - 1
+    return ordered[min(max(index, 0), len(ordered) - 1)]
+
+
+def latency_stats(rtts, sent):
+    """Return statistics of round trip times from a number of attempts, or
+       None if every attempt failed"""
+    ordered = sorted(rtts)
+    count = len(ordered)
+    if not count:
+        return None
+
+    middle = count // 2
+    median = ordered[middle]
+    if not count % 2:
+        median = (ordered[middle - 1] + median) / 2.0
+
+    mean = sum(ordered) / float(count)
+    return {
+        "min": ordered[0],
+        "median": median,
+        "p90": percentile(ordered, 90),
+        "stdev": sqrt(sum((x - mean) ** 2 for x in ordered) / count),
+        "loss": float(sent - count) / sent,
+        "samples": sent,
+    }
+
+
+class _Trip(object):
+    """State of round trips to a single address of a mirror"""
+
+    def __init__(self, url, family, sockaddr):
+        self.url = url
+        self.family = family
+        self.sockaddr = sockaddr
+        self.rtts = []
+        self.attempts = 0
+        self.target = 0
+        self.error = None
+        self.sock = None
+        self.sent = 0
+        self.deadline = 0
+
+
+class RoundTrips(object):
+    """Socket connections for latency reporting of many mirrors at once
+
+       Round trips are TCP handshakes. Subclasses time other round trips
+       in the same loop, overriding how one is started (_start) and how it
+       advances as its socket becomes ready (_progress)."""
+
+    def __init__(self, max_connections=DEFAULT_MAX_CONNECTIONS,
+                 num_trips=DEFAULT_NUM_TRIPS, timeout=CONNECT_TIMEOUT,
+                 interval=DEFAULT_INTERVAL):
+        if max_connections < 1:
+            raise ValueError("max_connections must be greater than 0")
+        if num_trips < 1:
+            raise ValueError("num_trips must be greater than 0")
+
+        self._max_connections = max_connections
+        self._num_trips = num_trips
+        self._timeout = timeout
+        self._interval = interval
+        self._trips = []
+        # Time each mirror's first round trip of the latest run started
+        self._started = {}
+
+    def __len__(self):
+        return len(self._trips)
+
+    def add(self, url, family, sockaddr):
+        """Queue round trips to a resolved address of a mirror
+
+           A mirror may be added once for each address family."""
+        self._trips.append(_Trip(url, family, sockaddr))
+
+    def probes(self):
+        """Return number of round trips attempted across all runs"""
+        return sum(trip.attempts for trip in self._trips)
+
+    def started(self, url):
+        """Return the time the latest run started round trips to a mirror,
+           or None if it didn't"""
+        return self._started.get(url)
+
+    def _start(self, selector, trip):
+        """Start a non-blocking connection, registering it for completion
+
+           Returns the error if it couldn't be started, otherwise None."""
+        trip.attempts += 1
+        try:
+            sock = socket(trip.family, SOCK_STREAM)
+        except error as err:
+            # e.g. the address family isn't supported, losing the sample
+            return err
+
+        sock.setblocking(False)
+        trip.sent = clock()
+        trip.deadline = trip.sent + self._timeout
+        err = sock.connect_ex(trip.sockaddr)
+        if err not in _CONNECTING:
+            sock.close()
+            return error(err, strerror(err))
+
+        trip.sock = sock
+        selector.register(sock, EVENT_WRITE, trip)
+        return None
+
+    @staticmethod
+    def __release(selector, trip):
+        """Stop watching a trip's socket and close it"""
+        selector.unregister(trip.sock)
+        trip.sock.close()
+        trip.sock = None
+
+    def _progress(self, selector, trip, ready):
+        """Complete a trip on its socket becoming ready at the time ready
+
+           Returns (rtt, error) once its round trip is done, otherwise
+           None."""
+        err = trip.sock.getsockopt(SOL_SOCKET, SO_ERROR)
+        self.__release(selector, trip)
+        if err:
+            return None, error(err, strerror(err))
+
+        return (ready - trip.sent) * 1000, None
+
+    def _sampled(self, trip, pending, rtt=None, err=None):
+        """Record a round trip's outcome, queueing the address' next one
+
+           Returns (url, family, stats, error) once all of the round trips
+           to an address are done. Stats are None if every round trip
+           failed, error being the last failure."""
+        if err is None:
+            trip.rtts.append(rtt)
+        else:
+            trip.error = err
+
+        if trip.attempts < trip.target:
+            pending.append((trip, clock() + self._interval))
+            return None
+
+        return (trip.url, trip.family, latency_stats(trip.rtts, trip.attempts),
+                trip.error)
+
+    def run(self, urls=None, num_trips=None):
+        """Generate (url, family, stats, error) for every queued address as
+           each completes
+
+           Runs num_trips more round trips (default: the number given at
+           construction) to the mirrors of urls, or to every mirror. Stats
+           are those of latency_stats over all round trips run so far, or
+           None for addresses that could not be connected to."""
+        trips = self._trips
+        if urls is not None:
+            urls = frozenset(urls)
+            trips = [trip for trip in trips if trip.url in urls]
+
+        self._started = {}
+        for trip in trips:
+            trip.target = trip.attempts + (num_trips or self._num_trips)
+
+        selector = DefaultSelector()
+        pending = deque((trip, 0) for trip in trips)
+        active = 0
+        try:
+            while pending or active:
+                while (pending and active < self._max_connections and
+                       pending[0][1] <= clock()):
+                    trip, _ = pending.popleft()
+                    if trip.url not in self._started:
+                        self._started[trip.url] = clock()
+                    err = self._start(selector, trip)
+                    if err is None:
+                        active += 1
+                        continue
+
+                    result = self._sampled(trip, pending, err=err)
+                    if result:
+                        yield result
+
+                now = clock()
+                wakeups = []
+                if pending and active < self._max_connections:
+                    wakeups.append(pending[0][1])
+
+                watched = [key.data for key in selector.get_map().values()]
+                wakeups.extend(t.deadline for t in watched)
+                if not wakeups:
+                    continue
+
+                wait = max(min(wakeups) - now, 0)
+                if not active:
+                    sleep(wait)
+                    continue
+
+                events = selector.select(wait)
+                recv_tstamp = clock()
+                for key, _ in events:
+                    trip = key.data
+                    outcome = self._progress(selector, trip, recv_tstamp)
+                    if outcome is None:
+                        continue
+
+                    active -= 1
+                    rtt, err = outcome
+                    result = self._sampled(trip, pending, rtt, err)
+                    if result:
+                        yield result
+
+                now = clock()
+                for trip in watched:
+                    # Sockets kept alive between trips aren't watched
+                    if (trip.sock and trip.deadline <= now and
+                            trip.sock in selector.get_map()):
+                        self.__release(selector, trip)
+                        active -= 1
+                        result = self._sampled(
+                            trip, pending, err="timed out"
+                        )
+                        if result:
+                            yield result
+        finally:
+            for key in list(selector.get_map().values()):
+                key.fileobj.close()
+                key.data.sock = None
+            selector.close()
+            # Connections are only kept alive within a run
+            for trip in trips:
+                if trip.sock is not None:
+                    trip.sock.close()
+                    trip.sock = None
+
+
+# States of an HTTP round trip
+_CONNECT, _HANDSHAKE, _SEND, _READ = range(4)
+
+
+class _HTTPTrip(_Trip):
+    """State of requests to a single address of a mirror, over a
+       connection kept alive between them"""
+
+    def __init__(self, url, family, sockaddr, path):
+        _Trip.__init__(self, url, family, sockaddr)
+        parsed = urlparse(url)
+        self.hostname = parsed.hostname
+        self.netloc = parsed.netloc
+        self.tls = parsed.scheme == 'https'
+        self.path = path
+        self.state = None
+        self.reused = False
+        self.out = b''
+        self.head = b''
+        self.first = 0
+        self.modified = None
+
+
+class HTTPRoundTrips(RoundTrips):
+    """Time to first byte of requests for a suite's InRelease file
+
+       A mirror's first request is a HEAD, later ones are conditional GETs
+       on the Last-Modified time it returned, so neither has a body to
+       download and connections are kept alive between samples. Mirrors
+       not serving the suite fail each sample, and are dropped like those
+       that can't be connected to."""
+
+    def __init__(self, codename, max_connections=DEFAULT_MAX_CONNECTIONS,
+                 num_trips=DEFAULT_NUM_TRIPS, timeout=HTTP_TIMEOUT,
+                 interval=DEFAULT_INTERVAL, user_agent='apt-select'):
+        RoundTrips.__init__(
+            self, max_connections, num_trips, timeout, interval
+        )
+        self._codename = codename.lower()
+        self._user_agent = user_agent
+        self._context = None
+
+    def add(self, url, family, sockaddr):
+        """Queue requests to a resolved address of a mirror"""
+        path = "%s/dists/%s/%s" % (
+            urlparse(url).path.rstrip('/'), self._codename, RELEASE_FILE
+        )
+        self._trips.append(_HTTPTrip(url, family, sockaddr, path))
+
+    def __request(self, trip):
+        lines = [
+            "%s %s HTTP/1.1" % ("GET" if trip.modified else "HEAD", trip.path),
+            "Host: %s" % trip.netloc,
+            "User-Agent: %s" % self._user_agent,
+            "Connection: keep-alive",
+        ]
+        if trip.modified:
+            lines.append("If-Modified-Since: %s" % trip.modified)
+
+        return ("\r\n".join(lines) + "\r\n\r\n").encode('latin-1')
+
+    def __connect(self, selector, trip):
+        """Start a non-blocking connection, registering it for completion"""
+        try:
+            sock = socket(trip.family, SOCK_STREAM)
+        except error as err:
+            return err
+
+        sock.setblocking(False)
+        err = sock.connect_ex(trip.sockaddr)
+        if err not in _CONNECTING:
+            sock.close()
+            return error(err, strerror(err))
+
+        trip.sock = sock
+        trip.reused = False
+        trip.state = _CONNECT
+        selector.register(sock, EVENT_WRITE, trip)
+        return None
+
+    def _start(self, selector, trip):
+        """Send a request on the address' kept alive connection, or connect
+           for one"""
+        trip.attempts += 1
+        trip.deadline = clock() + self._timeout
+        trip.out = self.__request(trip)
+        trip.head = b''
+        if trip.sock is None:
+            return self.__connect(selector, trip)
+
+        trip.reused = True
+        trip.state = _SEND
+        selector.register(trip.sock, EVENT_WRITE, trip)
+        return None
+
+    @staticmethod
+    def __close(trip):
+        trip.sock.close()
+        trip.sock = None
+
+    def __handshake(self, selector, trip):
+        """Wrap a connected socket in TLS, starting its handshake"""
+        if self._context is None:
+            self._context = ssl.create_default_context()
+
+        selector.unregister(trip.sock)
+        trip.sock = self._context.wrap_socket(
+            trip.sock,
+            server_hostname=trip.hostname,
+            do_handshake_on_connect=False
+        )
+        trip.state = _HANDSHAKE
+        selector.register(trip.sock, EVENT_WRITE, trip)
+
+    def __response(self, trip):
+        """Return error of a complete response head, or None, keeping the
+           connection only if nothing else is to be read from it"""
+        head = trip.head.split(b"\r\n\r\n", 1)[0].decode('latin-1')
+        lines = head.split("\r\n")
+        try:
+            status = int(lines[0].split()[1])
+        except (IndexError, ValueError):
+            self.__close(trip)
+            return "invalid response"
+
+        headers = {}
+        for line in lines[1:]:
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        body_read = len(trip.head) - len(head) - 4
+        if (headers.get('connection', '').lower() == 'close' or
+                not (not trip.modified or status in (204, 304) or
+                     headers.get('content-length') == str(body_read))):
+            self.__close(trip)
+
+        if status >= 400:
+            trip.modified = None
+            if status in (404, 410):
+                return "suite %s not served (HTTP %d)" % (
+                    self._codename, status
+                )
+            return "HTTP %d" % status
+
+        trip.modified = headers.get('last-modified', trip.modified)
+        return None
+
+    def _progress(self, selector, trip, ready):
+        """Advance a trip on its socket becoming ready
+
+           Returns (rtt, error) once its request is answered or has failed,
+           otherwise None."""
+        try:
+            if trip.state == _CONNECT:
+                err = trip.sock.getsockopt(SOL_SOCKET, SO_ERROR)
+                if err:
+                    raise error(err, strerror(err))
+
+                if trip.tls:
+                    self.__handshake(selector, trip)
+                else:
+                    trip.state = _SEND
+
+            if trip.state == _HANDSHAKE:
+                trip.sock.do_handshake()
+                trip.state = _SEND
+
+            if trip.state == _SEND:
+                trip.out = trip.out[trip.sock.send(trip.out):]
+                if trip.out:
+                    selector.modify(trip.sock, EVENT_WRITE, trip)
+                    return None
+
+                trip.sent = clock()
+                trip.state = _READ
+                selector.modify(trip.sock, EVENT_READ, trip)
+                return None
+
+            data = trip.sock.recv(MAX_HEAD)
+        except ssl.SSLWantReadError:
+            selector.modify(trip.sock, EVENT_READ, trip)
+            return None
+        except ssl.SSLWantWriteError:
+            selector.modify(trip.sock, EVENT_WRITE, trip)
+            return None
+        except (error, ssl.SSLError) as err:
+            selector.unregister(trip.sock)
+            self.__close(trip)
+            return None, err
+
+        if not data:
+            selector.unregister(trip.sock)
+            reused = trip.reused and not trip.head
+            self.__close(trip)
+            if reused:
+                # The mirror closed the idle connection, connect again
+                trip.out = self.__request(trip)
+                err = self.__connect(selector, trip)
+                return None if err is None else (None, err)
+
+            return None, "connection closed"
+
+        if not trip.head:
+            trip.first = clock()
+        trip.head += data
+        if b"\r\n\r\n" not in trip.head:
+            if len(trip.head) < MAX_HEAD:
+                return None
+
+            selector.unregister(trip.sock)
+            self.__close(trip)
+            return None, "response head too long"
+
+        selector.unregister(trip.sock)
+        return (trip.first - trip.sent) * 1000, self.__response(trip)
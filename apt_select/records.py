@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+"""Compact records of mirrors, and their ranking
+
+   A MirrorRecord keeps what is measured and looked up of a mirror in
+   slots rather than a dict per mirror, while still being read and
+   updated like the dicts reports and output records are built from:
+
+       record = MirrorRecord(Host="mirror.example.com")
+       record["Latency"] = 12.5
+       "Status" in record  # False until set
+
+   A Ranking keeps mirror URLs sorted by key as they're added, moved and
+   removed, so neither has to re-sort every mirror."""
+
+from bisect import bisect_left, bisect_right
+
+# Keys of mirror information, each kept in a slot of the lower case name
+FIELDS = ("Host", "Families", "Preferred", "Latency", "Stats", "Family",
+          "Country", "Launchpad", "Status", "Organisation", "Speed",
+          "Lookup", "Throughput", "Score", "Released", "Lag", "host_len")
+_SLOTS = dict((field, field.lower()) for field in FIELDS)
+
+
+class MirrorRecord(object):
+    """Information on a mirror, read and updated like a dict
+
+       Keys other than FIELDS, e.g. of unexpected Launchpad page entries,
+       are kept in a dict of their own."""
+
+    __slots__ = tuple(_SLOTS.values()) + ('_extra',)
+
+    def __init__(self, *args, **kwargs):
+        self._extra = None
+        self.update(*args, **kwargs)
+
+    def __getitem__(self, key):
+        slot = _SLOTS.get(key)
+        if slot is None:
+            if self._extra is None:
+                raise KeyError(key)
+            return self._extra[key]
+
+        try:
+            return getattr(self, slot)
+        except AttributeError:
+            raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        slot = _SLOTS.get(key)
+        if slot is None:
+            if self._extra is None:
+                self._extra = {}
+            self._extra[key] = value
+        else:
+            setattr(self, slot, value)
+
+    def __delitem__(self, key):
+        slot = _SLOTS.get(key)
+        try:
+            if slot is None:
+                del self._extra[key]
+            else:
+                delattr(self, slot)
+        except (AttributeError, KeyError, TypeError):
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        slot = _SLOTS.get(key)
+        if slot is None:
+            return self._extra is not None and key in self._extra
+
+        return hasattr(self, slot)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __eq__(self, other):
+        return dict(self.items()) == dict(other.items())
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return "MirrorRecord(%r)" % dict(self.items())
+
+    def keys(self):
+        keys = [field for field in FIELDS if hasattr(self, _SLOTS[field])]
+        if self._extra:
+            keys.extend(self._extra)
+        return keys
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+    def values(self):
+        return [self[key] for key in self.keys()]
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def update(self, *args, **kwargs):
+        for other in args + (kwargs,):
+            pairs = other.items() if hasattr(other, 'items') else other
+            for key, value in pairs:
+                self[key] = value
+
+    def copy(self):
+        """Return a shallow copy of the record"""
+        return MirrorRecord(self)
+
+
+class Ranking(object):
+    """Mirror URLs in ascending order of their keys
+
+       Positions are found by bisection, so adding, moving or removing a
+       mirror doesn't re-sort the others. Mirrors of equal keys stay in
+       the order they were added. Reads like the list of ranked URLs."""
+
+    def __init__(self, keyed=()):
+        pairs = sorted(keyed, key=lambda pair: pair[1])
+        self._urls = [url for url, _ in pairs]
+        self._keys = [key for _, key in pairs]
+        self._key_of = dict(pairs)
+
+    def add(self, url, key):
+        """Rank a mirror by key, moving it if it's already ranked"""
+        if url in self._key_of:
+            self.discard(url)
+
+        index = bisect_right(self._keys, key)
+        self._keys.insert(index, key)
+        self._urls.insert(index, url)
+        self._key_of[url] = key
+
+    def discard(self, url):
+        """Remove a mirror from the ranking, if it's in it"""
+        key = self._key_of.pop(url, None)
+        if key is None:
+            return
+
+        index = bisect_left(self._keys, key)
+        while self._urls[index] != url:
+            index += 1
+        del self._keys[index]
+        del self._urls[index]
+
+    def key(self, url):
+        """Return the key a mirror is ranked by"""
+        return self._key_of[url]
+
+    def top(self, num):
+        """Return the best num mirrors"""
+        return self._urls[:num]
+
+    def copy(self):
+        """Return a ranking of the same mirrors, changed independently"""
+        ranking = Ranking()
+        ranking._urls = list(self._urls)
+        ranking._keys = list(self._keys)
+        ranking._key_of = dict(self._key_of)
+        return ranking
+
+    def __getitem__(self, index):
+        return self._urls[index]
+
+    def __iter__(self):
+        return iter(self._urls)
+
+    def __len__(self):
+        return len(self._urls)
+
+    def __contains__(self, url):
+        return url in self._key_of
+
+    def __repr__(self):
+        return "Ranking(%r)" % self._urls
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+"""Concurrent host name resolution for latency probing
+
+   Hosts are resolved by a pool of threads, as getaddrinfo blocks, and
+   results are kept in an in-process cache for a fixed time to live."""
+
+import socket
+from socket import getaddrinfo, gaierror, AF_INET, AF_INET6, SOCK_STREAM
+from threading import Thread, Lock
+from apt_select.timing import span
+
+try:
+    from queue import Queue, Empty
+except ImportError:
+    from Queue import Queue, Empty
+
+try:
+    from time import monotonic as clock
+except ImportError:
+    from time import time as clock
+
+try:
+    xrange
+except NameError:
+    xrange = range
+
+DEFAULT_RESOLVERS = 16
+# getaddrinfo doesn't expose record TTLs, so a conservative one is assumed
+DNS_TTL = 300
+# Seconds waited for any host to resolve before giving up on the rest
+RESOLVE_TIMEOUT = 30
+# Only resolve families the host has an address of, e.g. no IPv6 addresses
+# where IPv6 is disabled
+_FLAGS = getattr(socket, 'AI_ADDRCONFIG', 0)
+
+FAMILY_NAMES = {AF_INET: "IPv4", AF_INET6: "IPv6"}
+
+_cache = {}
+_cache_lock = Lock()
+
+
+def _getaddrinfo(host):
+    """Return first address of each family, in resolver preference order"""
+    addrs = []
+    for family, _, _, _, sockaddr in getaddrinfo(
+            host, None, 0, SOCK_STREAM, 0, _FLAGS):
+        if family in FAMILY_NAMES and family not in dict(addrs):
+            addrs.append((family, sockaddr))
+
+    if not addrs:
+        raise gaierror("no IPv4 or IPv6 address found")
+
+    return addrs
+
+
+def resolve(host, families=None):
+    """Return [(family, sockaddr)] of a host, from cache if still fresh
+
+       The sockaddr port is 0, to be replaced by the one connected to.
+       Only addresses of the given families are returned, if any."""
+    now = clock()
+    with _cache_lock:
+        cached = _cache.get(host)
+
+    if cached is not None and cached[0] > now:
+        addrs = cached[1]
+    else:
+        addrs = _getaddrinfo(host)
+        with _cache_lock:
+            _cache[host] = (now + DNS_TTL, addrs)
+
+    if families is not None:
+        addrs = [addr for addr in addrs if addr[0] in families]
+        if not addrs:
+            raise gaierror("no address of requested family found")
+
+    return addrs
+
+
+def with_port(sockaddr, port):
+    """Return sockaddr of a resolved address for the given port"""
+    return (sockaddr[0], port) + tuple(sockaddr[2:])
+
+
+def resolve_all(hosts, families=None, workers=DEFAULT_RESOLVERS):
+    """Generate (host, addrs, error) for every host as it's resolved
+
+       addrs are those of resolve, or None with the resolution error."""
+    hosts = list(set(hosts))
+    tasks = Queue()
+    for host in hosts:
+        tasks.put(host)
+
+    results = Queue()
+
+    def work():
+        while True:
+            try:
+                host = tasks.get_nowait()
+            except Empty:
+                return
+
+            try:
+                with span("resolve", "mirror", host=host):
+                    addrs = resolve(host, families)
+            except Exception as err:
+                # Every host gets a result, or the results are waited on
+                results.put((host, None, err))
+            else:
+                results.put((host, addrs, None))
+
+    for _ in xrange(min(workers, len(hosts))):
+        thread = Thread(target=work)
+        thread.daemon = True
+        thread.start()
+
+    remaining = set(hosts)
+    while remaining:
+        try:
+            result = results.get(block=True, timeout=RESOLVE_TIMEOUT)
+        except Empty:
+            for host in remaining:
+                yield host, None, "resolution timed out"
+            return
+
+        remaining.discard(result[0])
+        yield result
@@ -0,0 +1,697 @@
+#!/usr/bin/env python
+"""Library interface selecting mirrors without exiting or printing reports
+
+   A MirrorSelector runs each selection as a pipeline of stages:
+
+       fetch_lists -> prefilter -> resolve -> probe -> enrich -> filter ->
+       rank -> write
+
+   Every stage is a function of the selector and a Selection, updating the
+   selection in place, and can be replaced by passing a function of the
+   same signature in stages. Failures are raised as SelectionError, and
+   progress is only reported to a progress callback, if one is given.
+
+   System information is read once per selector, and selections can be
+   made for other releases and apt directories, e.g. of chroots:
+
+       selector = MirrorSelector(countries=["US", "CA"], top_number=3)
+       for root in chroots:
+           selection = selector.select(
+               codename="noble",
+               sources=Sources("noble", root + "/etc/apt"),
+               work_dir=root + "/tmp"
+           )
+           print(selection.best.url)
+
+   select_batch does the same for many targets at once, e.g. those of a
+   manifest, fetching lists and probing mirrors only once for all of them.
+   """
+
+from os import path
+from threading import Thread
+from apt_select.mirrors import (Mirrors, FAMILIES, DEFAULT_LOOKUP_WORKERS,
+                                _fetch)
+from apt_select.apt import System, Sources, SourcesFileError
+from apt_select.utils import URLGetTextError
+from apt_select.cache import MIRROR_LISTS
+from apt_select.resolver import resolve_all
+from apt_select.probe import (DEFAULT_MAX_CONNECTIONS, DEFAULT_NUM_TRIPS,
+                              DEFAULT_INTERVAL, DEFAULT_STAT, DEFAULT_PROBE)
+from apt_select.throughput import DEFAULT_WEIGHT
+from apt_select.freshness import PRIMARY_ARCHIVE
+from apt_select.catalogue import load_catalogue, PROTOCOLS
+from apt_select.timing import span
+from apt_select.arguments import DEFAULT_COUNTRY
+
+try:
+    from urlparse import urlparse
+except ImportError:
+    from urllib.parse import urlparse
+
+STAGES = ("fetch_lists", "prefilter", "resolve", "probe", "enrich", "filter",
+          "rank", "write")
+
+
+class SelectionError(Exception):
+    """Error class for selections that couldn't be made"""
+    pass
+
+
+class MirrorListError(SelectionError):
+    """Error class for mirror lists that couldn't be fetched"""
+    pass
+
+
+class NoMirrorsError(SelectionError):
+    """Error class for selections without any mirror left to rank"""
+    pass
+
+
+class ManifestError(SelectionError):
+    """Error class for unreadable or malformed target manifests"""
+    pass
+
+
+def mirrors_url(country):
+    """Return URL of the list of a country's mirrors"""
+    return "http://mirrors.ubuntu.com/%s.txt" % country.upper()
+
+
+def status_level(status):
+    """Return Launchpad's form of a status, e.g. one-day-behind"""
+    status = status.replace('-', ' ')
+    if status.lower() == 'unknown':
+        return 'unknown'
+
+    return status.capitalize()
+
+
+def fetch_mirror_lists(countries, cache=None):
+    """Fetch lists of Ubuntu mirrors for many countries concurrently
+
+       Returns de-duplicated list of mirrors, and the countries listing
+       each mirror. Lists that can't be fetched are left out, unless none
+       can be."""
+    lists = {}
+
+    def fetch(country):
+        url = mirrors_url(country)
+        try:
+            with span("mirror list", "mirror", country=country):
+                lists[country] = _fetch(
+                    cache, MIRROR_LISTS, url, lambda text: text.splitlines()
+                )
+        except URLGetTextError as err:
+            lists[country] = err
+
+    threads = [Thread(target=fetch, args=(c,)) for c in countries]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    mirrors_list = []
+    url_countries = {}
+    errors = []
+    for country in countries:
+        if isinstance(lists[country], URLGetTextError):
+            errors.append((country, lists[country]))
+            continue
+
+        for url in lists[country]:
+            if url not in url_countries:
+                url_countries[url] = []
+                mirrors_list.append(url)
+            url_countries[url].append(country)
+
+    if not mirrors_list:
+        raise MirrorListError("\n".join(
+            "The mirror list for country: %s was not found at %s\n\t%s" % (
+                country, mirrors_url(country), err
+            ) for country, err in errors
+        ) or "No mirror lists were found")
+
+    return mirrors_list, url_countries, errors
+
+
+class Target(object):
+    """Release and architecture of a root whose apt sources are to be
+       regenerated, writing the new files to output"""
+
+    __slots__ = ('codename', 'arch', 'root', 'output')
+
+    def __init__(self, codename, arch, root='/', output=None):
+        self.codename = codename
+        self.arch = arch
+        self.root = root
+        self.output = output
+
+    def sources(self):
+        """Return current apt sources of the target's root"""
+        return Sources(self.codename, path.join(self.root, 'etc', 'apt'))
+
+    def __repr__(self):
+        return "<Target %s/%s %s>" % (self.codename, self.arch, self.root)
+
+
+def read_manifest(manifest_path):
+    """Return targets listed in a manifest file
+
+       Each line holds the codename, architecture, root directory and
+       output directory of a target, separated by whitespace. Blank lines
+       and lines starting with # are skipped."""
+    try:
+        with open(manifest_path) as f:
+            lines = f.read().splitlines()
+    except (IOError, OSError) as err:
+        raise ManifestError(
+            "Unable to read manifest %s:\n\t%s" % (manifest_path, err)
+        )
+
+    targets = []
+    for number, line in enumerate(lines, 1):
+        fields = line.split()
+        if not fields or fields[0].startswith('#'):
+            continue
+
+        if len(fields) != 4:
+            raise ManifestError((
+                "%s:%d: expected CODENAME ARCH ROOT OUTPUT, got %r" % (
+                    manifest_path, number, line
+                )
+            ))
+        targets.append(Target(*fields))
+
+    if not targets:
+        raise ManifestError("No targets in manifest %s" % manifest_path)
+
+    return targets
+
+
+class MirrorResult(object):
+    """A ranked mirror and what was measured and looked up of it"""
+
+    __slots__ = ('rank', 'url', 'host', 'country', 'family', 'latency',
+                 'stats', 'throughput', 'status', 'organisation', 'speed',
+                 'launchpad', 'lag')
+
+    def __init__(self, rank, url, host, country=None, family=None,
+                 latency=None, stats=None, throughput=None, status=None,
+                 organisation=None, speed=None, launchpad=None, lag=None):
+        self.rank = rank
+        self.url = url
+        self.host = host
+        self.country = country
+        self.family = family
+        self.latency = latency
+        self.stats = stats
+        self.throughput = throughput
+        self.status = status
+        self.organisation = organisation
+        self.speed = speed
+        self.launchpad = launchpad
+        self.lag = lag
+
+    @classmethod
+    def from_info(cls, rank, url, info):
+        """Return result of a mirror from its Mirrors.urls entry"""
+        return cls(
+            rank,
+            url,
+            info.get("Host"),
+            info.get("Country"),
+            info.get("Family"),
+            info.get("Latency"),
+            info.get("Stats"),
+            info.get("Throughput"),
+            info.get("Status"),
+            info.get("Organisation"),
+            info.get("Speed"),
+            info.get("Launchpad"),
+            info.get("Lag")
+        )
+
+    def __repr__(self):
+        return "<MirrorResult %d %s %.2f ms>" % (
+            self.rank, self.url, self.latency or 0
+        )
+
+
+class Selection(object):
+    """State of a selection, passed from stage to stage
+
+       urls are the mirrors still in the running, and url_countries the
+       countries listing each of them. Once ranked, mirrors are the
+       MirrorResults of the best, and files those written."""
+
+    def __init__(self, countries, codename, arch, sources=None,
+                 work_dir=None):
+        self.countries = countries
+        self.codename = codename
+        self.arch = arch
+        self.sources = sources
+        self.work_dir = work_dir
+        self.urls = []
+        self.url_countries = {}
+        # Catalogue of Launchpad's archive mirrors, once loaded
+        self.catalogue = None
+        # Mirrors left out by a stage, with the reason
+        self.errors = {}
+        self.archives = None
+        self.top_number = 0
+        self.mirrors = []
+        self.current = None
+        self.files = []
+        # SelectionError of a batch target that couldn't be selected for
+        self.error = None
+
+    @property
+    def best(self):
+        """Return the top ranked mirror, or None before ranking"""
+        return self.mirrors[0] if self.mirrors else None
+
+    @property
+    def statuses(self):
+        """Return whether mirrors were filtered by status"""
+        return (self.archives is not None and
+                hasattr(self.archives, "abort_launch") and
+                not self.archives.abort_launch)
+
+
+class MirrorSelector(object):
+    """Reusable pipeline selecting mirrors, see the module docstring
+
+       Options are those of the apt-select command line, taking Python
+       values. cache, store, snapshot and history are those of Mirrors."""
+
+    def __init__(self, countries=(DEFAULT_COUNTRY,), top_number=1,
+                 ping_only=False, min_status="up-to-date",
+                 max_connections=DEFAULT_MAX_CONNECTIONS,
+                 samples=DEFAULT_NUM_TRIPS, interval=DEFAULT_INTERVAL,
+                 rank_by=DEFAULT_STAT, family="any", race=False,
+                 probe=DEFAULT_PROBE, status_source="launchpad",
+                 reference_archive=PRIMARY_ARCHIVE,
+                 lookup_workers=DEFAULT_LOOKUP_WORKERS,
+                 benchmark_throughput=None, throughput_weight=DEFAULT_WEIGHT,
+                 global_list=False, min_speed=None, protocol=None,
+                 cache=None, store=None, snapshot=None, history=None,
+                 system=None,
+                 stages=None, result_callback=None, progress=None):
+        if top_number < 1:
+            raise ValueError("top_number must be greater than 0")
+        if family not in FAMILIES:
+            raise ValueError("family must be one of %s" % ", ".join(
+                sorted(FAMILIES)
+            ))
+        if protocol is not None and protocol not in PROTOCOLS:
+            raise ValueError("protocol must be one of %s" % ", ".join(
+                PROTOCOLS
+            ))
+
+        self.countries = list(countries)
+        self.top_number = top_number
+        self.ping_only = ping_only
+        self.min_status = status_level(min_status)
+        self.max_connections = max_connections
+        self.samples = samples
+        self.interval = interval
+        self.rank_by = rank_by
+        self.family = family
+        self.race = race
+        self.probe_type = probe
+        self.status_source = status_source
+        self.reference_archive = reference_archive
+        self.lookup_workers = lookup_workers
+        self.benchmark_throughput = benchmark_throughput
+        self.throughput_weight = throughput_weight
+        # Candidates are every mirror in Launchpad's catalogue if global,
+        # prefiltered by advertised bits per second and protocol served
+        self.global_list = global_list
+        self.min_speed = min_speed
+        self.protocol = protocol
+        self.cache = cache
+        self.store = store
+        self.snapshot = snapshot
+        self.history = history
+        # Called with (event, url, info) as each mirror's results complete
+        self.result_callback = result_callback
+        # Called with text reporting progress, e.g. sys.stderr.write, the
+        # selector being silent if None
+        self.progress = progress
+        self._system = system
+        self._stages = dict(stages or {})
+        unknown = set(self._stages) - set(STAGES)
+        if unknown:
+            raise ValueError("unknown stages: %s" % ", ".join(
+                sorted(unknown)
+            ))
+
+    @property
+    def system(self):
+        """Return system information, read on first use only"""
+        if self._system is None:
+            try:
+                self._system = System()
+            except OSError as err:
+                raise SelectionError(
+                    "Error setting system information:\n\t%s" % err
+                )
+
+        return self._system
+
+    def report(self, text):
+        """Report progress through the progress callback, if there is one"""
+        if self.progress is not None:
+            self.progress(text)
+
+    def new_selection(self, codename=None, arch=None, sources=None,
+                      work_dir=None, countries=None):
+        """Return a selection for a release and architecture, those of the
+           system by default"""
+        return Selection(
+            countries or self.countries,
+            codename or self.system.codename,
+            arch or self.system.arch,
+            sources,
+            work_dir
+        )
+
+    def run(self, selection, stages=STAGES):
+        """Run the given stages of a selection in pipeline order"""
+        for name in STAGES:
+            if name not in stages:
+                continue
+
+            stage = self._stages.get(name)
+            if stage is None:
+                getattr(self, name)(selection)
+            else:
+                stage(self, selection)
+
+        return selection
+
+    def select(self, codename=None, arch=None, sources=None, work_dir=None,
+               countries=None):
+        """Run every stage of a new selection, returning it
+
+           A new sources file is only written if work_dir is given."""
+        return self.run(self.new_selection(
+            codename, arch, sources, work_dir, countries
+        ))
+
+    def select_batch(self, targets):
+        """Select mirrors for many targets, returning their selections in
+           the same order
+
+           Mirror lists are fetched and mirrors probed once, for the first
+           target's release. Statuses are then looked up once per release
+           and architecture, from Launchpad pages read only once for all of
+           them. A target failing to be selected for has its error set,
+           without stopping the others."""
+        if not targets:
+            return []
+
+        shared = self.new_selection(targets[0].codename, targets[0].arch)
+        self.run(shared, ("fetch_lists", "prefilter", "resolve", "probe"))
+        if not self.ping_only and self.status_source == "launchpad":
+            # Copies of the mirrors keep the pages found here
+            shared.archives.get_launchpad_urls()
+
+        ranked = {}
+        selections = []
+        for target in targets:
+            selection = self.new_selection(
+                target.codename, target.arch, work_dir=target.output
+            )
+            selection.errors = dict(shared.errors)
+            selections.append(selection)
+            key = (selection.codename, selection.arch)
+            try:
+                if key not in ranked:
+                    selection.urls = list(shared.urls)
+                    selection.url_countries = shared.url_countries
+                    selection.archives = shared.archives.copy()
+                    selection.top_number = shared.top_number
+                    ranked[key] = selection
+                    self.run(selection, ("enrich", "filter", "rank"))
+                else:
+                    first = ranked[key]
+                    if first.error is not None:
+                        raise first.error
+
+                    for name in ("urls", "url_countries", "archives",
+                                 "top_number", "mirrors"):
+                        setattr(selection, name, getattr(first, name))
+
+                if selection.work_dir is not None:
+                    try:
+                        selection.sources = target.sources()
+                    except SourcesFileError as err:
+                        raise SelectionError(
+                            "Error with current apt sources:\n\t%s" % err
+                        )
+                    self.run(selection, ("write",))
+            except SelectionError as err:
+                selection.error = err
+
+        return selections
+
+    def new_mirrors(self, selection):
+        """Return Mirrors of a selection's mirrors"""
+        archives = Mirrors(
+            selection.urls,
+            self.ping_only,
+            self.min_status,
+            self.max_connections,
+            self.cache,
+            self.samples,
+            self.interval,
+            self.rank_by,
+            FAMILIES[self.family],
+            self.store,
+            self.snapshot,
+            self.probe_type,
+            selection.codename,
+            self.history
+        )
+        archives.progress = self.progress
+        if self.result_callback is not None:
+            # Records are reported as they're measured, before the probe
+            # stage sets their countries
+            countries = selection.url_countries
+
+            def notify(event, url, info):
+                info.setdefault("Country", ", ".join(countries.get(url, ())))
+                self.result_callback(event, url, info)
+
+            archives.result_callback = notify
+        return archives
+
+    def load_catalogue(self, selection):
+        """Return catalogue of Launchpad's archive mirrors, loading it once
+           per selection"""
+        if selection.catalogue is None:
+            try:
+                selection.catalogue = load_catalogue(self.cache)
+            except URLGetTextError as err:
+                raise MirrorListError(
+                    "Unable to retrieve Launchpad's list of archive "
+                    "mirrors:\n\t%s" % err
+                )
+
+        return selection.catalogue
+
+    def fetch_lists(self, selection):
+        """Fetch the mirror lists of the selection's countries, or the
+           catalogue of all mirrors if global"""
+        if self.global_list:
+            catalogue = self.load_catalogue(selection)
+            selection.urls = []
+            selection.url_countries = {}
+            for entry in catalogue.entries:
+                protocols = entry["Protocols"]
+                url = next((protocols[protocol] for protocol in PROTOCOLS
+                            if protocol in protocols), None)
+                if url is not None and url not in selection.url_countries:
+                    selection.urls.append(url)
+                    selection.url_countries[url] = [entry["Country"]]
+        else:
+            with span("mirror lists"):
+                selection.urls, selection.url_countries, errors = (
+                    fetch_mirror_lists(selection.countries, self.cache)
+                )
+
+            for country, err in errors:
+                selection.errors[mirrors_url(country)] = err
+
+        if self.cache is not None:
+            self.cache.save()
+
+    def prefilter(self, selection):
+        """Leave out mirrors advertising less than min_speed on Launchpad,
+           or not serving protocol, before any is probed
+
+           Mirrors are switched to their URL of the protocol. Mirrors
+           missing from the catalogue can't be vouched for, so are left
+           out too."""
+        if self.min_speed is None and self.protocol is None:
+            return
+
+        catalogue = self.load_catalogue(selection)
+        urls = []
+        url_countries = {}
+        for url in selection.urls:
+            entry = catalogue.entry(url)
+            if entry is None:
+                selection.errors[url] = "not in Launchpad's catalogue"
+            elif (self.min_speed is not None and
+                  (entry["Bandwidth"] or 0) < self.min_speed):
+                selection.errors[url] = "advertised speed %s" % (
+                    entry["Speed"] or "unknown"
+                )
+            elif (self.protocol is not None and
+                  self.protocol not in entry["Protocols"]):
+                selection.errors[url] = "%s not served" % self.protocol
+            else:
+                new_url = url
+                if self.protocol is not None:
+                    new_url = entry["Protocols"][self.protocol]
+                if new_url not in url_countries:
+                    urls.append(new_url)
+                    url_countries[new_url] = selection.url_countries.get(
+                        url, []
+                    )
+
+        if self.cache is not None:
+            self.cache.save()
+
+        selection.urls = urls
+        selection.url_countries = url_countries
+        if not urls:
+            raise NoMirrorsError(
+                "No mirrors are left to test after prefiltering"
+            )
+
+    def resolve(self, selection):
+        """Leave out mirrors whose host names don't resolve
+
+           Addresses are cached, so aren't resolved again when probed."""
+        hosts = {}
+        for url in selection.urls:
+            hosts.setdefault(urlparse(url).hostname, []).append(url)
+
+        with span("resolve hosts"):
+            for host, addrs, err in resolve_all(
+                    [host for host in hosts if host], FAMILIES[self.family]):
+                if not addrs:
+                    for url in hosts[host]:
+                        selection.errors[url] = err
+
+        selection.urls = [url for url in selection.urls
+                          if url not in selection.errors]
+
+    def probe(self, selection):
+        """Test latency to the selection's mirrors, and throughput if asked
+           to, ranking them"""
+        archives = self.new_mirrors(selection)
+        selection.archives = archives
+        archives.get_rtts(self.top_number if self.race else None)
+        for url, info in archives.urls.items():
+            info["Country"] = ", ".join(selection.url_countries.get(url, ()))
+
+        selection.top_number = min(self.top_number, archives.got["ping"])
+        if selection.top_number == 0:
+            raise NoMirrorsError(
+                "Cannot connect to any mirrors in %s\n." % selection.urls
+            )
+
+        if self.benchmark_throughput:
+            archives.benchmark_throughput(
+                selection.codename,
+                selection.arch,
+                self.benchmark_throughput,
+                self.throughput_weight
+            )
+
+        selection.urls = list(archives.ranked)
+
+    def enrich(self, selection):
+        """Look up statuses of the best ranked mirrors, until top_number
+           of them meet the minimum status"""
+        if self.ping_only:
+            return
+
+        archives = selection.archives
+        archives.status_num = selection.top_number
+        archives.lookup_workers = self.lookup_workers
+        if self.status_source == "release":
+            self.report("Checking release files for %d status(es)\n" % (
+                selection.top_number
+            ))
+            archives.check_freshness(
+                selection.codename, self.reference_archive
+            )
+        else:
+            archives.get_launchpad_urls()
+            if archives.abort_launch:
+                return
+
+            self.report("Looking up %d status(es)\n" % (
+                selection.top_number
+            ))
+            archives.lookup_statuses(
+                selection.codename.capitalize(),
+                selection.arch,
+                self.min_status
+            )
+
+        if selection.top_number > 1:
+            self.report('\n')
+
+    def filter(self, selection):
+        """Keep mirrors meeting the minimum status, or every ranked mirror
+           if statuses weren't looked up"""
+        archives = selection.archives
+        if not selection.statuses:
+            archives.top_list = archives.ranked.top(selection.top_number)
+
+        selection.urls = list(archives.top_list)
+        if not selection.urls:
+            raise NoMirrorsError(
+                "No mirrors meet the minimum status %s" % self.min_status
+            )
+
+    def rank(self, selection):
+        """Set the selection's ranked results"""
+        archives = selection.archives
+        selection.mirrors = [
+            MirrorResult.from_info(i + 1, url, archives.urls[url])
+            for i, url in enumerate(selection.urls[:self.top_number])
+        ]
+
+    def write(self, selection):
+        """Generate sources files using the best mirror in the selection's
+           work_dir, unless it's already in use"""
+        if selection.work_dir is None or selection.best is None:
+            return
+
+        try:
+            sources = selection.sources
+            if sources is None:
+                sources = selection.sources = Sources(selection.codename)
+
+            sources.set_current_archives()
+            selection.current = sources.urls['current']
+            if selection.current == selection.best.url:
+                return
+
+            sources.generate_new_config(
+                selection.work_dir, selection.best.url
+            )
+        except SourcesFileError as err:
+            raise SelectionError(
+                "Error with current apt sources:\n\t%s" % err
+            )
+
+        selection.files = list(sources.new_file_paths)
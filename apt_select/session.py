@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+"""Shared HTTP session built on requests
+
+   Imported on first use of the session, so runs which don't need it
+   don't pay for importing requests."""
+
+from threading import Lock, local
+
+import requests
+from requests.adapters import HTTPAdapter
+try:
+    from urllib3.util.retry import Retry
+    from urllib3.connection import HTTPConnection, HTTPSConnection
+    from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+except ImportError:
+    from requests.packages.urllib3.util.retry import Retry
+    from requests.packages.urllib3.connection import (HTTPConnection,
+                                                      HTTPSConnection)
+    from requests.packages.urllib3.connectionpool import (
+        HTTPConnectionPool, HTTPSConnectionPool
+    )
+
+from apt_select.utils import (DEFAULT_REQUEST_HEADERS, DEFAULT_POOL_SIZE,
+                              DEFAULT_TIMEOUT, DEFAULT_RETRIES,
+                              DEFAULT_BACKOFF, RETRY_STATUSES, CHUNK_SIZE,
+                              RequestTiming, URLGetTextError,
+                              summarize_timings)
+
+try:
+    from time import monotonic as clock
+except ImportError:
+    from time import time as clock
+
+# Connections are established in the thread making the request, so time
+# spent connecting is accounted to that thread's current request
+_connecting = local()
+
+
+def _timed_connect(connect):
+    def timed(self):
+        start = clock()
+        connect(self)
+        _connecting.seconds = getattr(_connecting, 'seconds', 0) + (
+            clock() - start
+        )
+    return timed
+
+
+class _TimedHTTPConnection(HTTPConnection):
+    connect = _timed_connect(HTTPConnection.connect)
+
+
+class _TimedHTTPSConnection(HTTPSConnection):
+    connect = _timed_connect(HTTPSConnection.connect)
+
+
+class _TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+
+class _TimedHTTPAdapter(HTTPAdapter):
+    """Adapter whose connection pools time new connections"""
+
+    def init_poolmanager(self, *args, **kwargs):
+        HTTPAdapter.init_poolmanager(self, *args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _TimedHTTPConnectionPool,
+            'https': _TimedHTTPSConnectionPool,
+        }
+
+
+class HTTPSession(object):
+    """Thread safe HTTP session, keeping connections alive in a pool per host
+
+       Failed connections and server errors are retried with exponential
+       backoff, and every request's timing is recorded."""
+
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE, timeout=DEFAULT_TIMEOUT,
+                 retries=DEFAULT_RETRIES, backoff=DEFAULT_BACKOFF):
+        self._timeout = timeout
+        self._session = requests.Session()
+        self._session.headers.update(DEFAULT_REQUEST_HEADERS)
+        adapter = _TimedHTTPAdapter(
+            pool_maxsize=pool_size,
+            max_retries=Retry(
+                total=retries,
+                backoff_factor=backoff,
+                status_forcelist=RETRY_STATUSES,
+                raise_on_status=False
+            )
+        )
+        for scheme in ('http://', 'https://'):
+            self._session.mount(scheme, adapter)
+
+        self._lock = Lock()
+        self.timings = []
+
+    def request(self, method, url, headers=None, stream=False, data=None):
+        """Return response of a request, recording its timing"""
+        _connecting.seconds = 0
+        start = clock()
+        try:
+            response = self._session.request(
+                method, url, headers=headers, stream=stream, data=data,
+                timeout=self._timeout
+            )
+        finally:
+            timing = RequestTiming(
+                url, None, clock() - start, _connecting.seconds
+            )
+            with self._lock:
+                self.timings.append(timing)
+
+        timing.status = response.status_code
+        return response
+
+    def get(self, url, headers=None, stream=False):
+        """Return response of GET request, recording its timing"""
+        return self.request('GET', url, headers, stream)
+
+    def put(self, url, data, headers=None):
+        """Return response of PUT request, recording its timing"""
+        return self.request('PUT', url, headers, data=data)
+
+    def stats(self):
+        """Summarize recorded timings, see utils.summarize_timings"""
+        with self._lock:
+            timings = list(self.timings)
+
+        return summarize_timings(timings)
+
+
+def _iter_text(result):
+    """Generate decoded chunks of a streamed response, closing it after"""
+    if not result.encoding:
+        result.encoding = 'utf-8'
+
+    try:
+        for chunk in result.iter_content(CHUNK_SIZE, decode_unicode=True):
+            yield chunk
+    finally:
+        result.close()
+
+
+def get_conditional_text(session, url, headers, stream=False):
+    """Return text and cache validators of a GET request sent with the
+       session, as utils.get_conditional_text does"""
+    try:
+        result = session.get(url, headers=headers, stream=stream)
+        result.raise_for_status()
+    except requests.RequestException as err:
+        raise URLGetTextError(err)
+
+    validators = {
+        'etag': result.headers.get('ETag', headers.get('If-None-Match')),
+        'modified': result.headers.get(
+            'Last-Modified', headers.get('If-Modified-Since')
+        )
+    }
+    if result.status_code == requests.codes.NOT_MODIFIED:
+        result.close()
+        return None, validators
+
+    # Redirects are followed, so any other status, e.g. of a redirect
+    # without a Location, isn't the document
+    if not 200 <= result.status_code < 300:
+        result.close()
+        raise URLGetTextError("%d %s for url: %s" % (
+            result.status_code, result.reason, url
+        ))
+
+    if stream:
+        return _iter_text(result), validators
+
+    return result.text, validators
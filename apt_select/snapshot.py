@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+"""Snapshots of Launchpad's archive mirror metadata
+
+   A snapshot is a gzip compressed JSON document of mirror records keyed by
+   archive URL, each with the mirror's Launchpad page, organisation, speed,
+   country and the statuses of all of its series/arches, stamped with the
+   time it was scraped. Runs using a snapshot skip scraping Launchpad for
+   the mirrors in it, only looking up mirrors missing from it, or whose
+   records are older than its maximum age.
+
+   `apt-select --build-snapshot` builds one for the given countries in the
+   cache directory, where later runs use it by default."""
+
+import gzip
+import json
+from sys import stderr
+from os import path, makedirs, rename, getpid
+from threading import Thread
+from time import time
+from apt_select.utils import URLGetTextError, progress_msg
+from apt_select.cache import CACHE_DIR, LAUNCHPAD_INDEX, LAUNCHPAD_MIRRORS
+from apt_select.timing import span
+
+try:
+    from queue import Queue, Empty
+except ImportError:
+    from Queue import Queue, Empty
+
+try:
+    xrange
+except NameError:
+    xrange = range
+
+VERSION = 1
+DEFAULT_SNAPSHOT = path.join(CACHE_DIR, 'snapshot.json.gz')
+# Seconds a snapshot's statuses are used before being looked up again
+DEFAULT_MAX_AGE = 86400
+# Keys of records shared with status lookups
+RECORD_KEYS = ("Statuses", "Organisation", "Speed")
+
+
+class SnapshotError(Exception):
+    """Error class for unreadable or unwritable snapshots"""
+    pass
+
+
+class Snapshot(object):
+    """Mirror records of a snapshot, keyed by archive URL"""
+
+    def __init__(self, mirrors=None, generated=None, max_age=DEFAULT_MAX_AGE):
+        self.mirrors = mirrors if mirrors is not None else {}
+        self.generated = generated if generated is not None else time()
+        self.max_age = max_age
+
+    def launchpad_url(self, url):
+        """Return Launchpad page of a mirror, or None if it isn't known
+
+           Pages rarely move, so they're used regardless of age."""
+        entry = self.mirrors.get(url)
+        if entry is None:
+            return None
+
+        return entry.get("Launchpad")
+
+    def record(self, url):
+        """Return a mirror's status record, or None if missing or stale"""
+        entry = self.mirrors.get(url)
+        if entry is None or time() - entry.get("Time", 0) > self.max_age:
+            return None
+
+        return dict((key, entry[key]) for key in RECORD_KEYS if key in entry)
+
+    def add(self, url, launch_url, record, country, stored=None):
+        """Add a mirror's status record, as scraped from its page"""
+        entry = dict(
+            (key, record[key]) for key in RECORD_KEYS if key in record
+        )
+        entry.update({
+            "Launchpad": launch_url,
+            "Country": country,
+            "Time": stored if stored is not None else time()
+        })
+        self.mirrors[url] = entry
+
+    def save(self, snapshot_path):
+        """Write snapshot to a path, replacing any snapshot there at once"""
+        tmp_path = "%s.%d.tmp" % (snapshot_path, getpid())
+        document = {
+            "version": VERSION,
+            "generated": self.generated,
+            "mirrors": self.mirrors
+        }
+        try:
+            directory = path.dirname(snapshot_path)
+            if directory and not path.isdir(directory):
+                makedirs(directory)
+            with span("snapshot write", "io", path=snapshot_path):
+                with gzip.open(tmp_path, 'wb') as f:
+                    f.write(json.dumps(
+                        document, sort_keys=True, separators=(',', ':')
+                    ).encode('utf-8'))
+                rename(tmp_path, snapshot_path)
+        except (IOError, OSError) as err:
+            raise SnapshotError(err)
+
+
+def load_snapshot(snapshot_path, max_age=DEFAULT_MAX_AGE):
+    """Return snapshot read from a path"""
+    try:
+        with span("snapshot read", "io", path=snapshot_path):
+            with gzip.open(snapshot_path, 'rb') as f:
+                document = json.loads(f.read().decode('utf-8'))
+    except (IOError, OSError, ValueError) as err:
+        raise SnapshotError(err)
+
+    if not isinstance(document, dict) or document.get("version") != VERSION:
+        raise SnapshotError(
+            "%s is not a version %d snapshot" % (snapshot_path, VERSION)
+        )
+
+    return Snapshot(document.get("mirrors", {}), document.get("generated"),
+                    max_age)
+
+
+def build_snapshot(url_countries, cache=None, workers=4,
+                   launchpad_url="https://launchpad.net/ubuntu/+archivemirrors",
+                   launchpad_base="https://launchpad.net"):
+    """Scrape a snapshot of the mirrors listed in url_countries, a mapping
+       of archive URLs to the countries listing them"""
+    from apt_select.mirrors import (_fetch, parse_launchpad_index,
+                                    parse_mirror_page)
+
+    stderr.write("Getting list of launchpad URLs...")
+    with span("launchpad index"):
+        index = _fetch(
+            cache,
+            LAUNCHPAD_INDEX,
+            launchpad_url,
+            lambda chunks: parse_launchpad_index(chunks, launchpad_base),
+            stream=True,
+            valid=lambda index: index.get("complete")
+        )
+    stderr.write("done.\n")
+
+    tasks = Queue()
+    for url in url_countries:
+        if url in index["mirrors"]:
+            tasks.put(url)
+    wanted = tasks.qsize()
+    results = Queue()
+
+    def work():
+        while True:
+            try:
+                url = tasks.get_nowait()
+            except Empty:
+                return
+
+            launch_url = index["mirrors"][url]
+            try:
+                with span("launchpad mirror page", "mirror", url=launch_url):
+                    record = _fetch(
+                        cache, LAUNCHPAD_MIRRORS, launch_url, parse_mirror_page
+                    )
+            except URLGetTextError as err:
+                stderr.write("connection to %s: %s\n" % (launch_url, err))
+                record = None
+            results.put((url, record))
+
+    threads = [Thread(target=work) for _ in xrange(min(workers, wanted))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+
+    snapshot = Snapshot()
+    stderr.write("Looking up %d status(es)\n" % wanted)
+    for done in xrange(wanted):
+        url, record = results.get()
+        if record is not None:
+            snapshot.add(url, index["mirrors"][url], record,
+                         ", ".join(url_countries[url]))
+        progress_msg(done + 1, wanted)
+
+    for thread in threads:
+        thread.join()
+
+    if wanted:
+        stderr.write('\n')
+
+    return snapshot
@@ -0,0 +1,264 @@
+#!/usr/bin/env python
+"""Result stores shared by hosts testing the same mirrors
+
+   Launchpad status records and latency test results are kept per
+   namespace and key, stamped with the time they were stored, so hosts of
+   the same network segment can reuse each other's fresh results instead
+   of scraping Launchpad and testing every mirror themselves.
+
+   Stores are either a local SQLite file, or an HTTP key-value endpoint
+   storing JSON documents at <base URL>/<namespace>/<key> with GET and PUT.
+   Running this module serves such an endpoint from memory:
+
+       python -m apt_select.store [HOST:]PORT"""
+
+import json
+from sys import stderr, exit
+from threading import Lock, Thread
+from time import sleep, time
+from apt_select.utils import get_session
+from apt_select.cache import DEFAULT_TTL
+from apt_select.timing import span
+
+try:
+    from urllib.parse import quote, unquote
+except ImportError:
+    from urllib import quote, unquote
+
+try:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+
+RTTS = 'rtts'
+STATUSES = 'statuses'
+
+# Seconds other hosts' latency test results are reused for
+DEFAULT_MAX_AGE = 900
+# Mirrors re-tested by each host when shared results are fresh
+DEFAULT_REPROBE = 10
+DEFAULT_SEGMENT = 'default'
+DEFAULT_LISTEN_HOST = '127.0.0.1'
+
+
+class StoreError(Exception):
+    """Error class for reading from or writing to a result store"""
+    pass
+
+
+class ResultStore(object):
+    """Interface of stores of JSON serialisable results
+
+       Backends implement _read and _write. Failing reads and writes are
+       reported and otherwise ignored, as results can always be measured
+       again."""
+
+    def __init__(self, max_age=DEFAULT_MAX_AGE, segment=DEFAULT_SEGMENT,
+                 reprobe=DEFAULT_REPROBE, status_max_age=DEFAULT_TTL):
+        self.max_age = max_age
+        self.status_max_age = status_max_age
+        self.segment = segment
+        self.reprobe = reprobe
+
+    def _read(self, namespace, key):
+        """Return (time, value) stored for key, or None"""
+        raise NotImplementedError
+
+    def _write(self, namespace, key, stored, value):
+        raise NotImplementedError
+
+    def get(self, namespace, key, max_age=None):
+        """Return value of key, or None if missing or older than max_age"""
+        try:
+            with span("result store read", namespace=namespace, key=key):
+                entry = self._read(namespace, key)
+        except StoreError as err:
+            stderr.write("result store read of %s/%s: %s\n" % (
+                namespace, key, err
+            ))
+            return None
+
+        if entry is None:
+            return None
+
+        stored, value = entry
+        if max_age is not None and time() - stored > max_age:
+            return None
+
+        return value
+
+    def set(self, namespace, key, value):
+        """Store value for key, stamped with the current time"""
+        try:
+            with span("result store write", namespace=namespace, key=key):
+                self._write(namespace, key, time(), value)
+        except StoreError as err:
+            stderr.write("result store write of %s/%s: %s\n" % (
+                namespace, key, err
+            ))
+
+
+class SQLiteStore(ResultStore):
+    """Results kept in a local SQLite database file"""
+
+    def __init__(self, db_path, **kwargs):
+        ResultStore.__init__(self, **kwargs)
+        import sqlite3
+        self._error = sqlite3.Error
+        self._lock = Lock()
+        try:
+            self._db = sqlite3.connect(
+                db_path, timeout=10, check_same_thread=False
+            )
+            with self._db:
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS results ("
+                    "namespace TEXT, key TEXT, stored REAL, value TEXT, "
+                    "PRIMARY KEY (namespace, key))"
+                )
+        except self._error as err:
+            raise StoreError(err)
+
+    def _read(self, namespace, key):
+        try:
+            with self._lock:
+                row = self._db.execute(
+                    "SELECT stored, value FROM results "
+                    "WHERE namespace = ? AND key = ?", (namespace, key)
+                ).fetchone()
+        except self._error as err:
+            raise StoreError(err)
+
+        if row is None:
+            return None
+
+        return row[0], json.loads(row[1])
+
+    def _write(self, namespace, key, stored, value):
+        try:
+            with self._lock, self._db:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)",
+                    (namespace, key, stored, json.dumps(value))
+                )
+        except self._error as err:
+            raise StoreError(err)
+
+
+class HTTPStore(ResultStore):
+    """Results kept by an HTTP key-value endpoint"""
+
+    def __init__(self, base_url, **kwargs):
+        ResultStore.__init__(self, **kwargs)
+        self._base_url = base_url.rstrip('/')
+
+    def __url(self, namespace, key):
+        return "%s/%s/%s" % (self._base_url, namespace, quote(key, safe=''))
+
+    def _read(self, namespace, key):
+        from requests import RequestException
+        try:
+            response = get_session().get(self.__url(namespace, key))
+            if response.status_code == 404:
+                return None
+
+            response.raise_for_status()
+            entry = response.json()
+            return entry['time'], entry['value']
+        except (RequestException, ValueError, KeyError, TypeError) as err:
+            raise StoreError(err)
+
+    def _write(self, namespace, key, stored, value):
+        from requests import RequestException
+        try:
+            get_session().put(
+                self.__url(namespace, key),
+                json.dumps({'time': stored, 'value': value}),
+                headers={'Content-Type': 'application/json'}
+            ).raise_for_status()
+        except RequestException as err:
+            raise StoreError(err)
+
+
+def open_store(location, **kwargs):
+    """Return store at an http(s) URL, or in a SQLite file at a path"""
+    if location.startswith(('http://', 'https://')):
+        return HTTPStore(location, **kwargs)
+
+    return SQLiteStore(location, **kwargs)
+
+
+class _KeyValueHandler(BaseHTTPRequestHandler):
+    def __key(self):
+        return unquote(self.path.split('?')[0].lstrip('/'))
+
+    def __reply(self, status, body=b''):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        with self.server.lock:
+            body = self.server.documents.get(self.__key())
+
+        if body is None:
+            self.__reply(404)
+        else:
+            self.__reply(200, body)
+
+    def do_PUT(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        try:
+            json.loads(body.decode('utf-8'))
+        except ValueError:
+            self.__reply(400)
+            return
+
+        with self.server.lock:
+            self.server.documents[self.__key()] = body
+        self.__reply(204)
+
+    def log_message(self, *args):
+        pass
+
+
+class KeyValueServer(ThreadingMixIn, HTTPServer):
+    """In-memory HTTP key-value endpoint for HTTPStore"""
+
+    daemon_threads = True
+
+    def __init__(self, address):
+        HTTPServer.__init__(self, address, _KeyValueHandler)
+        self.lock = Lock()
+        self.documents = {}
+
+
+def serve_store(address):
+    """Serve an in-memory store on [HOST:]PORT from a background thread,
+       returning the server"""
+    host, _, port = address.rpartition(':')
+    server = KeyValueServer((host or DEFAULT_LISTEN_HOST, int(port)))
+    thread = Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+if __name__ == '__main__':
+    from sys import argv
+
+    if len(argv) != 2:
+        exit("usage: python -m apt_select.store [HOST:]PORT")
+
+    serve_store(argv[1])
+    try:
+        # The server's thread is a daemon, exiting once this one is
+        # interrupted
+        while True:
+            sleep(3600)
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+"""Download speed measurement of archive mirrors
+
+   Bounded byte ranges of a real archive file are downloaded from several
+   mirrors in parallel, each transfer being cut off after a fixed time."""
+
+from threading import Thread
+from apt_select.utils import get_session, CHUNK_SIZE
+from apt_select.timing import span
+
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
+
+try:
+    from time import monotonic as clock
+except ImportError:
+    from time import time as clock
+
+try:
+    xrange
+except NameError:
+    xrange = range
+
+# Compressed package indices are large enough to outlast TCP slow start
+THROUGHPUT_PATH = "dists/%(codename)s/main/binary-%(arch)s/Packages.xz"
+MAX_BYTES = 4 * 1024 * 1024
+MAX_SECONDS = 5
+DEFAULT_CANDIDATES = 5
+DEFAULT_WEIGHT = 0.5
+
+
+def format_throughput(bps):
+    """Return bytes per second in the bit rate units used by Launchpad"""
+    return "%.2f Mbps" % (bps * 8 / 1e6)
+
+
+class _Transfer(object):
+    """Time-boxed download of a byte range from a mirror"""
+
+    def __init__(self, url, file_url, result_queue, max_bytes, max_seconds,
+                 progress=None):
+        self._url = url
+        self._file_url = file_url
+        self._result_queue = result_queue
+        self._max_bytes = max_bytes
+        self._max_seconds = max_seconds
+        self._progress = progress
+
+    def __download(self):
+        """Return bytes per second received after the response headers"""
+        response = get_session().get(
+            self._file_url,
+            headers={'Range': 'bytes=0-%d' % (self._max_bytes - 1)},
+            stream=True
+        )
+        try:
+            response.raise_for_status()
+            received = 0
+            start = clock()
+            deadline = start + self._max_seconds
+            for chunk in response.iter_content(CHUNK_SIZE):
+                received += len(chunk)
+                if received >= self._max_bytes or clock() >= deadline:
+                    break
+            elapsed = clock() - start
+        finally:
+            response.close()
+
+        if not received or not elapsed:
+            raise ValueError("no data received")
+
+        return received / elapsed
+
+    def measure(self):
+        from requests import RequestException
+        try:
+            with span("download", "mirror", url=self._file_url):
+                bps = self.__download()
+        except (RequestException, ValueError) as err:
+            if self._progress is not None:
+                self._progress("\tdownload from %s: %s\n" % (
+                    self._file_url, err
+                ))
+            self._result_queue.put((self._url, None))
+        else:
+            self._result_queue.put((self._url, bps))
+
+
+def measure_throughput(urls, path, max_bytes=MAX_BYTES,
+                       max_seconds=MAX_SECONDS, progress=None):
+    """Generate (url, bytes per second) for each mirror as its transfer of
+       path completes
+
+       Bytes per second is None for mirrors the file couldn't be
+       downloaded from, failures being reported through progress unless
+       it's None."""
+    result_queue = Queue()
+    for url in urls:
+        thread = Thread(
+            target=_Transfer(
+                url,
+                url.rstrip('/') + '/' + path,
+                result_queue,
+                max_bytes,
+                max_seconds,
+                progress
+            ).measure
+        )
+        thread.daemon = True
+        thread.start()
+
+    for _ in xrange(len(urls)):
+        yield result_queue.get(block=True)
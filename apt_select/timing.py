@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+"""Timing of the phases of a run, and of operations on each mirror
+
+   Spans are only recorded once a timeline is started, so instrumented
+   code costs a function call otherwise. Recorded spans can be summarised
+   per phase, or written as a Chrome trace (chrome://tracing, Perfetto)."""
+
+import json
+from os import getpid
+from sys import stderr
+from threading import Lock, current_thread
+
+try:
+    from time import monotonic as clock
+except ImportError:
+    from time import time as clock
+
+_timeline = None
+
+
+class Span(object):
+    """A named period of time on a thread"""
+
+    __slots__ = ('name', 'category', 'start', 'end', 'thread', 'args')
+
+    def __init__(self, name, category, start, end, thread, args):
+        self.name = name
+        self.category = category
+        self.start = start
+        self.end = end
+        self.thread = thread
+        self.args = args
+
+
+class Timeline(object):
+    """Thread safe record of spans"""
+
+    def __init__(self):
+        self._lock = Lock()
+        self._origin = clock()
+        self.spans = []
+
+    def record(self, name, category, start, end, args=None):
+        """Record a span of given monotonic clock start and end times"""
+        span = Span(name, category, start, end, current_thread().name,
+                    args or {})
+        with self._lock:
+            self.spans.append(span)
+
+    def summary(self):
+        """Return (name, count, total, min, max seconds) of each span name,
+           in order of first occurrence"""
+        phases = {}
+        order = []
+        with self._lock:
+            spans = list(self.spans)
+
+        for span in spans:
+            if span.name not in phases:
+                phases[span.name] = []
+                order.append(span.name)
+            phases[span.name].append(span.end - span.start)
+
+        return [
+            (name, len(phases[name]), sum(phases[name]),
+             min(phases[name]), max(phases[name]))
+            for name in order
+        ]
+
+    def trace(self):
+        """Return spans in the Chrome trace event format"""
+        pid = getpid()
+        threads = {}
+        events = []
+        with self._lock:
+            spans = list(self.spans)
+
+        for span in spans:
+            tid = threads.setdefault(span.thread, len(threads))
+            events.append({
+                'name': span.name,
+                'cat': span.category,
+                'ph': 'X',
+                'ts': (span.start - self._origin) * 1e6,
+                'dur': (span.end - span.start) * 1e6,
+                'pid': pid,
+                'tid': tid,
+                'args': span.args,
+            })
+
+        for thread, tid in threads.items():
+            events.append({
+                'name': 'thread_name',
+                'ph': 'M',
+                'pid': pid,
+                'tid': tid,
+                'args': {'name': thread},
+            })
+
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def write_trace(self, trace_path):
+        with open(trace_path, 'w') as f:
+            json.dump(self.trace(), f)
+
+
+class _Timed(object):
+    """Context manager recording a span on exit"""
+
+    __slots__ = ('_timeline', '_name', '_category', '_args', '_start')
+
+    def __init__(self, timeline, name, category, args):
+        self._timeline = timeline
+        self._name = name
+        self._category = category
+        self._args = args
+
+    def __enter__(self):
+        self._start = clock()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._timeline.record(
+            self._name, self._category, self._start, clock(), self._args
+        )
+
+
+class _Untimed(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_untimed = _Untimed()
+
+
+def start_timeline():
+    """Start recording spans, returning the timeline they're recorded to"""
+    global _timeline
+    _timeline = Timeline()
+    return _timeline
+
+
+def get_timeline():
+    """Return the timeline spans are recorded to, None if not started"""
+    return _timeline
+
+
+def span(name, category="phase", **args):
+    """Return context manager timing its block as a span, if recording"""
+    if _timeline is None:
+        return _untimed
+
+    return _Timed(_timeline, name, category, args)
+
+
+def record_span(name, start, category="phase", **args):
+    """Record a span from a monotonic clock time until now, if recording"""
+    if _timeline is not None:
+        _timeline.record(name, category, start, clock(), args)
+
+
+def print_summary(timeline):
+    """Print time spent per span name to stderr"""
+    rows = timeline.summary()
+    if not rows:
+        return
+
+    width = max(len(row[0]) for row in rows)
+    stderr.write("%-*s %6s %10s %10s %10s\n" % (
+        width, "phase", "count", "total (s)", "min (s)", "max (s)"
+    ))
+    for name, count, total, shortest, longest in rows:
+        stderr.write("%-*s %6d %10.3f %10.3f %10.3f\n" % (
+            width, name, count, total, shortest, longest
+        ))
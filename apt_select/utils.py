@@ -1,13 +1,22 @@
 #!/usr/bin/env python
-"""Collection of module neutral utility functions"""
+"""Collection of module neutral utility functions
 
-from sys import stderr
+   Documents are fetched with the requests based session of
+   apt_select.session, only imported once the first request is sent."""
 
-import requests
+from sys import stderr
+from threading import Lock
 
 DEFAULT_REQUEST_HEADERS = {
     'User-Agent': 'apt-select'
 }
+CHUNK_SIZE = 16384
+
+DEFAULT_POOL_SIZE = 10
+DEFAULT_TIMEOUT = 10
+DEFAULT_RETRIES = 2
+DEFAULT_BACKOFF = 0.5
+RETRY_STATUSES = frozenset([500, 502, 503, 504])
 
 
 def utf8_decode(encoded):
@@ -19,20 +28,114 @@ class URLGetTextError(Exception):
     pass
 
 
+class RequestTiming(object):
+    """Time taken by a request, and by connecting for it"""
+
+    __slots__ = ('url', 'status', 'seconds', 'connect_seconds')
+
+    def __init__(self, url, status, seconds, connect_seconds):
+        self.url = url
+        self.status = status
+        self.seconds = seconds
+        self.connect_seconds = connect_seconds
+
+
+def summarize_timings(timings):
+    """Summarize request timings
+
+       Handshake time saved is estimated from the mean time taken to
+       connect, for every request sent on a reused connection."""
+    connected = [t.connect_seconds for t in timings if t.connect_seconds]
+    mean_connect = sum(connected) / len(connected) if connected else 0
+    return {
+        'requests': len(timings),
+        'connections': len(connected),
+        'seconds': sum(t.seconds for t in timings),
+        'connect_seconds': sum(connected),
+        'saved_seconds': mean_connect * (len(timings) - len(connected)),
+    }
+
+
+_session = None
+_session_settings = {}
+_session_lock = Lock()
+
+
+def configure_session(**kwargs):
+    """Set the settings of the shared HTTP session, which is created on
+       first use"""
+    global _session, _session_settings
+    with _session_lock:
+        _session = None
+        _session_settings = kwargs
+
+
+def get_session():
+    """Return the shared HTTP session, creating it on first use"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            from apt_select.session import HTTPSession
+            _session = HTTPSession(**_session_settings)
+        return _session
+
+
+def http_stats():
+    """Summarize timings of every request sent"""
+    with _session_lock:
+        session = _session
+
+    if session is None:
+        return summarize_timings([])
+
+    return session.stats()
+
+
 def get_text(url):
     """Return text from GET request response content"""
-    try:
-        result = requests.get(url, headers=DEFAULT_REQUEST_HEADERS)
-        result.raise_for_status()
-    except requests.HTTPError as err:
-        raise URLGetTextError(err)
+    text, _ = get_conditional_text(url)
+    return text
+
+
+def iter_text(url):
+    """Generate text from GET request response content as it's received"""
+    text, _ = get_conditional_text(url, stream=True)
+    return text
+
+
+def get_conditional_text(url, etag=None, modified=None, stream=False):
+    """Return text and cache validators from a conditional GET request
+
+       Text is None when the server reports the content as not modified
+       since the validators were issued. If streamed, text is a generator
+       of chunks which closes the response once exhausted or closed."""
+    headers = {}
+    if etag:
+        headers['If-None-Match'] = etag
+    if modified:
+        headers['If-Modified-Since'] = modified
+
+    from apt_select.session import get_conditional_text as session_get
+    return session_get(get_session(), url, headers, stream)
+
+
+def get_range_text(url, size):
+    """Return text of the first size bytes of a document from a Range
+       request, or all of it from servers ignoring the range"""
+    headers = {'Range': 'bytes=0-%d' % (size - 1)}
+    from apt_select.session import get_conditional_text as session_get
+    text, _ = session_get(get_session(), url, headers)
+    return text
+
 
-    return result.text
+def write_progress(text):
+    """Write text reporting progress to stderr straight away"""
+    stderr.write(text)
+    stderr.flush()
 
 
-def progress_msg(processed, total):
-    """Update user on percent done"""
-    if total > 1:
+def progress_msg(processed, total, progress=write_progress):
+    """Update user on percent done, through progress unless it's None"""
+    if total > 1 and progress is not None:
         percent = int((float(processed) / total) * 100)
-        stderr.write("\r[%d/%d] %d%%" % (processed, total, percent))
-        stderr.flush()
+        progress("\r[%d/%d] %d%%" % (processed, total, percent))
@@ -0,0 +1,465 @@
+#!/usr/bin/env python
+"""Simulated network of archive mirrors and Launchpad for benchmarks
+
+A single thread serves every mirror from its own TCP listener on the
+loopback interface, plus a stand-in for Launchpad serving archive mirror
+pages. HTTP responses of each listener are delayed by its latency, dropped
+at its loss rate and sent no faster than its bandwidth. A share of the
+mirrors can be dead, with nothing listening at their address.
+
+Connecting on loopback completes in the kernel, so latency tests see the
+prober's own overhead rather than injected latency; latency and loss apply
+to HTTP requests (Launchpad pages, InRelease probes, throughput downloads).
+A share of the live mirrors can be partial, not serving the latest series,
+and the release files of each live mirror lag the archive's by a random
+number of hours.
+
+Launchpad pages are generated in the markup apt-select parses, or read
+from a directory of saved fixtures written with --write:
+
+    python benchmarks/farm.py --mirrors 100 --write fixtures/
+"""
+
+import heapq
+import random
+import re
+import resource
+import socket
+from argparse import ArgumentParser
+from email.utils import formatdate
+from io import open
+from os import path, makedirs
+from threading import Thread
+
+try:
+    from selectors import DefaultSelector, EVENT_READ, EVENT_WRITE
+except ImportError:
+    from selectors34 import DefaultSelector, EVENT_READ, EVENT_WRITE
+
+try:
+    from time import monotonic as clock
+except ImportError:
+    from time import time as clock
+
+LAUNCHPAD_INDEX_PATH = "/ubuntu/+archivemirrors"
+LAUNCHPAD_MIRROR_PATH = "/ubuntu/+mirror/"
+ARCHIVE_PATH = "/ubuntu/"
+# Size of the file throughput is measured by downloading
+ARCHIVE_FILE_SIZE = 8 * 1024 * 1024
+TICK = 0.01
+_ARCHIVE_HREF = re.compile(r'href="((?:https?|ftp)://[^"]+)"')
+STATUSES = (
+    "Up to date",
+    "One day behind",
+    "Two days behind",
+    "One week behind",
+)
+SERIES = ("Focal", "Jammy", "Noble")
+# Publishing time of the archive's release files
+RELEASE_TIME = 1767225600
+# Hours mirrors' release files lag behind the archive's, picked at random
+RELEASE_LAGS = (0, 0, 0, 0.5, 2, 30, 60, 240)
+ARCHES = ("amd64", "i386", "arm64")
+# Countries the index lists mirrors under, in turns of COUNTRY_SIZE
+COUNTRIES = ("United States", "Germany", "Japan", "Brazil")
+COUNTRY_SIZE = 10
+SPEEDS = (u"100 Mbps", u"1 Gbps", u"10 Gbps")
+
+
+def mirror_slug(index):
+    return "mirror-%04d" % index
+
+
+def index_html(archive_urls):
+    """Return archive mirrors page listing each archive URL, under a
+       heading row per country
+
+       Every other mirror also links an rsync URL, which isn't an archive
+       URL apt-select can use."""
+    rows = []
+    for i, url in enumerate(archive_urls):
+        if not i % COUNTRY_SIZE:
+            rows.append((
+                u'<tr class="head"><th colspan="2">%s</th>'
+                u'<th>%d Gbps</th><th></th></tr>\n' % (
+                    COUNTRIES[i // COUNTRY_SIZE % len(COUNTRIES)],
+                    COUNTRY_SIZE
+                )
+            ))
+        rsync = u''
+        if i % 2:
+            rsync = u' <a href="rsync://%s/ubuntu/">rsync</a>' % (
+                url.split('/')[2].split(':')[0]
+            )
+        rows.append((
+            u'<tr><td><a href="%(page)s">Mirror %(i)d</a></td>\n'
+            u'<td><a href="%(url)s">http</a>%(rsync)s</td>\n'
+            u'<td>%(speed)s</td><td>Up to date</td></tr>\n' % {
+                'page': LAUNCHPAD_MIRROR_PATH + mirror_slug(i),
+                'url': url,
+                'rsync': rsync,
+                'i': i,
+                'speed': SPEEDS[i % len(SPEEDS)],
+            }
+        ))
+
+    return (
+        u'<html><head><title>Archive mirrors</title></head><body>\n'
+        u'<table class="listing" id="mirrors_list">\n'
+        u'<thead><tr><th>Country</th><th>Archive</th><th>Speed</th>'
+        u'<th>Status</th></tr></thead>\n<tbody>\n%s</tbody></table>\n'
+        u'<table><tr><td>Footer</td></tr></table>\n'
+        u'</body></html>\n' % u''.join(rows)
+    )
+
+
+def mirror_html(index, seed=0):
+    """Return a mirror's Launchpad page, with statuses of every series"""
+    rng = random.Random(seed * 100003 + index)
+    rows = u''.join(
+        u'<tr><td>%s</td><td>%s</td><td>%s</td></tr>\n' % (
+            series, arch, rng.choice(STATUSES)
+        )
+        for series in SERIES for arch in ARCHES
+    )
+    return (
+        u'<html><body>\n'
+        u'<dl id="organisation"><dt>Organisation:</dt>'
+        u'<dd>Organisation %(i)d</dd></dl>\n'
+        u'<dl id="speed"><dt>Speed:</dt><dd>%(speed)s</dd></dl>\n'
+        u'<table id="arches"><thead><tr><th>Series</th><th>Arch</th>'
+        u'<th>Status</th></tr></thead>\n<tbody>\n%(rows)s</tbody></table>\n'
+        u'</body></html>\n' % {
+            'i': index,
+            'speed': SPEEDS[index % len(SPEEDS)],
+            'rows': rows,
+        }
+    )
+
+
+def write_fixtures(directory, archive_urls, seed=0):
+    """Save generated Launchpad pages to a directory"""
+    pages = path.join(directory, 'mirrors')
+    if not path.isdir(pages):
+        makedirs(pages)
+
+    with open(path.join(directory, 'index.html'), 'w', encoding='utf-8') as f:
+        f.write(index_html(archive_urls))
+    for i in range(len(archive_urls)):
+        with open(path.join(pages, mirror_slug(i) + '.html'), 'w',
+                  encoding='utf-8') as f:
+            f.write(mirror_html(i, seed))
+
+
+class Profile(object):
+    """Simulated network conditions of a listener"""
+
+    def __init__(self, latency=0, loss=0, bandwidth=None):
+        self.latency = latency
+        self.loss = loss
+        self.bandwidth = bandwidth
+
+
+class _Connection(object):
+    def __init__(self, sock, listener):
+        self.sock = sock
+        self.listener = listener
+        self.request = b''
+        self.response = b''
+        self.sent = 0
+        self.keep_alive = True
+
+
+class _Listener(object):
+    def __init__(self, sock, profile, handler):
+        self.sock = sock
+        self.profile = profile
+        self.handler = handler
+
+
+class MirrorFarm(object):
+    """Archive mirrors and Launchpad served from one background thread"""
+
+    def __init__(self, num_mirrors, mirror_profile=None,
+                 launchpad_profile=None, dead=0, fixtures=None, seed=0,
+                 partial=0):
+        _raise_file_limit()
+        self._rng = random.Random(seed)
+        self._seed = seed
+        self._fixtures = fixtures
+        self._selector = DefaultSelector()
+        self._timers = []
+        self._running = False
+        self.mirror_urls = []
+        self.dead_urls = []
+        self.partial_urls = []
+        self.release_lags = {}
+
+        mirror_profile = mirror_profile or Profile()
+        dead_socks = []
+        for i in range(num_mirrors):
+            sock = _listen()
+            url = "http://127.0.0.1:%d%s" % (
+                sock.getsockname()[1], ARCHIVE_PATH
+            )
+            if self._rng.random() < dead:
+                # Nothing accepts at the address once the port is freed
+                dead_socks.append(sock)
+                self.dead_urls.append(url)
+            else:
+                series = SERIES
+                if self._rng.random() < partial:
+                    series = SERIES[:-1]
+                    self.partial_urls.append(url)
+                self.release_lags[url] = self._rng.choice(RELEASE_LAGS)
+                self.__add_listener(sock, mirror_profile, self.__archive_of(
+                    series, self.release_lags[url]
+                ))
+            self.mirror_urls.append(url)
+
+        sock = _listen()
+        self.launchpad_base = "http://127.0.0.1:%d" % sock.getsockname()[1]
+        self.__add_listener(
+            sock, launchpad_profile or Profile(), self.__launchpad
+        )
+        for sock in dead_socks:
+            sock.close()
+        self._index = None
+
+    def __add_listener(self, sock, profile, handler):
+        sock.setblocking(False)
+        self._selector.register(
+            sock, EVENT_READ, _Listener(sock, profile, handler)
+        )
+
+    @property
+    def launchpad_url(self):
+        return self.launchpad_base + LAUNCHPAD_INDEX_PATH
+
+    def __read_fixture(self, name):
+        with open(path.join(self._fixtures, name), encoding='utf-8') as f:
+            return f.read()
+
+    def __farm_index(self, html):
+        """Point archive links of a saved index at the farm's mirrors, in
+           order of appearance"""
+        urls = iter(self.mirror_urls)
+
+        def replace(match):
+            return 'href="%s"' % next(urls, match.group(1))
+
+        return _ARCHIVE_HREF.sub(replace, html)
+
+    def __launchpad(self, request_path, headers):
+        if request_path == LAUNCHPAD_INDEX_PATH:
+            if self._index is None:
+                if self._fixtures:
+                    self._index = self.__farm_index(
+                        self.__read_fixture('index.html')
+                    )
+                else:
+                    self._index = index_html(self.mirror_urls)
+            return 200, self._index.encode('utf-8'), {}
+
+        if request_path.startswith(LAUNCHPAD_MIRROR_PATH):
+            slug = request_path[len(LAUNCHPAD_MIRROR_PATH):]
+            try:
+                if self._fixtures:
+                    page = self.__read_fixture(
+                        path.join('mirrors', slug + '.html')
+                    )
+                else:
+                    page = mirror_html(int(slug.split('-')[-1]), self._seed)
+            except (IOError, ValueError):
+                return 404, b'', {}
+            return 200, page.encode('utf-8'), {}
+
+        return 404, b'', {}
+
+    def __archive_of(self, series, lag):
+        """Return handler of a mirror serving the release and updates
+           suites of the given series, lagging by hours"""
+        releases = frozenset(
+            "%sdists/%s%s/InRelease" % (ARCHIVE_PATH, name.lower(), pocket)
+            for name in series for pocket in ("", "-updates")
+        )
+        released = formatdate(RELEASE_TIME - lag * 3600, usegmt=True)
+        return lambda request_path, headers: self.__archive(
+            request_path, headers, releases, released
+        )
+
+    def __archive(self, request_path, headers, releases, released):
+        if not request_path.startswith(ARCHIVE_PATH + 'dists/'):
+            return 404, b'', {}
+
+        if request_path.endswith('/InRelease'):
+            if request_path not in releases:
+                return 404, b'', {}
+            extra = {'Last-Modified': released}
+            if headers.get('if-modified-since') == released:
+                return 304, b'', extra
+            body = "Origin: Ubuntu\nLabel: Ubuntu\nDate: %s\n" % released
+            return 200, body.encode('ascii'), extra
+
+        size = ARCHIVE_FILE_SIZE
+        start, end = 0, size - 1
+        byte_range = headers.get('range', '')
+        if byte_range.startswith('bytes='):
+            first, _, last = byte_range[6:].partition('-')
+            start = int(first or 0)
+            end = min(int(last), size - 1) if last else size - 1
+            return 206, b'\0' * (end - start + 1), {
+                'Content-Range': 'bytes %d-%d/%d' % (start, end, size)
+            }
+
+        return 200, b'\0' * size, {}
+
+    def __accept(self, listener):
+        try:
+            sock, _ = listener.sock.accept()
+        except socket.error:
+            return
+
+        sock.setblocking(False)
+        self._selector.register(
+            sock, EVENT_READ, _Connection(sock, listener)
+        )
+
+    def __close(self, conn):
+        self._selector.unregister(conn.sock)
+        conn.sock.close()
+
+    def __read(self, conn):
+        try:
+            data = conn.sock.recv(65536)
+        except socket.error:
+            data = b''
+        if not data:
+            self.__close(conn)
+            return
+
+        conn.request += data
+        if b'\r\n\r\n' not in conn.request:
+            return
+
+        head, _, conn.request = conn.request.partition(b'\r\n\r\n')
+        lines = head.decode('latin-1').split('\r\n')
+        method = lines[0].split(' ')[0]
+        request_path = lines[0].split(' ')[1].split('?')[0]
+        headers = dict(
+            (name.strip().lower(), value.strip())
+            for name, _, value in (line.partition(':') for line in lines[1:])
+        )
+        conn.keep_alive = headers.get('connection', '').lower() != 'close'
+        profile = conn.listener.profile
+        self._selector.unregister(conn.sock)
+        if self._rng.random() < profile.loss:
+            conn.sock.close()
+            return
+
+        status, body, extra = conn.listener.handler(request_path, headers)
+        reason = {200: 'OK', 206: 'Partial Content', 304: 'Not Modified',
+                  404: 'Not Found'}
+        head = [
+            'HTTP/1.1 %d %s' % (status, reason[status]),
+            'Content-Length: %d' % len(body),
+            'Content-Type: text/html; charset=utf-8',
+        ]
+        if method == 'HEAD':
+            body = b''
+        head.extend('%s: %s' % item for item in extra.items())
+        if not conn.keep_alive:
+            head.append('Connection: close')
+        conn.response = ('\r\n'.join(head) + '\r\n\r\n').encode() + body
+        conn.sent = 0
+        self.__schedule(clock() + profile.latency, conn)
+
+    def __schedule(self, when, conn):
+        heapq.heappush(self._timers, (when, id(conn), conn))
+
+    def __write(self, conn):
+        """Send a tick's worth of the response, at the listener's rate"""
+        self._selector.unregister(conn.sock)
+        bandwidth = conn.listener.profile.bandwidth
+        limit = len(conn.response) - conn.sent
+        if bandwidth:
+            limit = min(limit, max(int(bandwidth * TICK), 1))
+        try:
+            conn.sent += conn.sock.send(
+                conn.response[conn.sent:conn.sent + limit]
+            )
+        except socket.error:
+            conn.sock.close()
+            return
+
+        if conn.sent < len(conn.response):
+            self.__schedule(clock() + (TICK if bandwidth else 0), conn)
+        elif conn.keep_alive:
+            conn.response = b''
+            self._selector.register(conn.sock, EVENT_READ, conn)
+        else:
+            conn.sock.close()
+
+    def __run(self):
+        while self._running:
+            now = clock()
+            while self._timers and self._timers[0][0] <= now:
+                _, _, conn = heapq.heappop(self._timers)
+                self._selector.register(conn.sock, EVENT_WRITE, conn)
+
+            wait = TICK
+            if self._timers:
+                wait = min(max(self._timers[0][0] - now, 0), TICK)
+            for key, events in self._selector.select(wait):
+                if isinstance(key.data, _Listener):
+                    self.__accept(key.data)
+                elif events & EVENT_WRITE:
+                    self.__write(key.data)
+                else:
+                    self.__read(key.data)
+
+    def start(self):
+        self._running = True
+        self._thread = Thread(target=self.__run)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._running = False
+        self._thread.join()
+        for key in list(self._selector.get_map().values()):
+            key.fileobj.close()
+        self._selector.close()
+
+
+def _listen():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(('127.0.0.1', 0))
+    sock.listen(128)
+    return sock
+
+
+def _raise_file_limit():
+    """Allow as many open files as permitted, a socket being one"""
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard == resource.RLIM_INFINITY or soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--mirrors', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--write', metavar='DIR', required=True,
+                        help="save generated Launchpad pages to DIR")
+    args = parser.parse_args()
+
+    urls = ["http://mirror-%d.example%s" % (i, ARCHIVE_PATH)
+            for i in range(args.mirrors)]
+    write_fixtures(args.write, urls, args.seed)
+
+
+if __name__ == '__main__':
+    main()
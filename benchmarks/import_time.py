@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+"""Benchmark start up import time of apt-select's code paths
+
+Imports what a --ping-only run needs, and what a run looking up Launchpad
+statuses needs on top of it (the requests session and BeautifulSoup), each
+in fresh interpreters under `python -X importtime` (Python 3.7+). Both are
+compared with an eager baseline importing requests and BeautifulSoup up
+front, as apt-select did before their imports were deferred. Reports the
+best total import time of each path, less that of starting the
+interpreter, the time saved against the baseline, and the third party
+packages it loaded:
+
+    python benchmarks/import_time.py
+"""
+
+import re
+from argparse import ArgumentParser
+from os import path
+from subprocess import Popen, PIPE
+from sys import executable
+
+# Import apt_select from the checkout the benchmark is in
+CHECKOUT = path.dirname(path.dirname(path.abspath(__file__)))
+BASELINE = 'eager'
+PATHS = (
+    (BASELINE, (
+        "import requests, bs4, apt_select.__main__, apt_select.mirrors, "
+        "apt_select.session; apt_select.mirrors.get_parser()"
+    )),
+    ('ping-only', (
+        "import apt_select.__main__, apt_select.mirrors"
+    )),
+    ('launchpad', (
+        "import apt_select.__main__, apt_select.mirrors, "
+        "apt_select.session; apt_select.mirrors.get_parser()"
+    )),
+)
+HEAVY = ('requests', 'urllib3', 'bs4', 'lxml', 'certifi', 'idna')
+_LINE = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)')
+
+
+def import_times(statement):
+    """Return cumulative microseconds of each top level import, by module"""
+    process = Popen(
+        [executable, '-X', 'importtime', '-c',
+         "import sys; sys.path.insert(0, %r); %s" % (CHECKOUT, statement)],
+        stdout=PIPE, stderr=PIPE
+    )
+    _, err = process.communicate()
+    if process.returncode:
+        raise RuntimeError(err.decode('utf-8'))
+
+    times = {}
+    for match in _LINE.finditer(err.decode('utf-8')):
+        _, cumulative, indent, module = match.groups()
+        times[module] = (int(cumulative), len(indent))
+
+    return times
+
+
+def top_level_total(times):
+    """Return microseconds of modules imported at the top level, which
+       include their nested imports"""
+    return sum(
+        cumulative for cumulative, depth in times.values() if depth == 1
+    )
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-r', '--repeat', type=int, default=10)
+    args = parser.parse_args()
+
+    print("%-10s %14s %14s %14s  %s" % (
+        "path", "best (ms)", "mean (ms)", "saved (ms)", "third party packages"
+    ))
+    baseline = min(
+        top_level_total(import_times('pass')) for _ in range(args.repeat)
+    )
+    # Packages site imports on start up aren't down to apt-select
+    preloaded = import_times('pass')
+    eager = None
+    for name, statement in PATHS:
+        totals = []
+        for _ in range(args.repeat):
+            times = import_times(statement)
+            totals.append(top_level_total(times) - baseline)
+
+        if name == BASELINE:
+            eager = min(totals)
+        loaded = [module for module in HEAVY
+                  if module in times and module not in preloaded]
+        print("%-10s %14.1f %14.1f %14.1f  %s" % (
+            name,
+            min(totals) / 1000.0,
+            sum(totals) / 1000.0 / len(totals),
+            (eager - min(totals)) / 1000.0,
+            ", ".join(loaded) or "none"
+        ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+"""Benchmark parsing of Launchpad's archive mirrors page
+
+Compares the streaming index parser against the BeautifulSoup tree walk it
+replaced, by wall time and peak resident memory. Every parse runs in a fresh
+child process, so peak memory of one implementation doesn't hide another's.
+
+Save a copy of the page, and optionally a country's mirror list for the
+streaming parser to stop early on:
+
+    curl -o archivemirrors.html https://launchpad.net/ubuntu/+archivemirrors
+    curl -o US.txt http://mirrors.ubuntu.com/US.txt
+    python benchmarks/launchpad_index.py archivemirrors.html US.txt
+"""
+
+import json
+import resource
+from argparse import ArgumentParser
+from io import open
+from os import path
+from subprocess import check_output
+from sys import executable, path as sys_path
+from time import time
+
+# Import apt_select from the checkout the benchmark is in
+sys_path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+from apt_select.mirrors import parse_launchpad_index
+from apt_select.utils import CHUNK_SIZE
+
+BASE = "https://launchpad.net"
+
+
+def soup_index(html_path, wanted):
+    """Original implementation, walking all descendants of the table"""
+    from bs4 import BeautifulSoup
+    try:
+        import lxml
+        parser = "lxml"
+    except ImportError:
+        parser = "html.parser"
+
+    with open(html_path, encoding='utf-8') as f:
+        soup = BeautifulSoup(f.read(), parser)
+
+    index = {}
+    prev = ""
+    for element in soup.table.descendants:
+        try:
+            url = element.a
+        except AttributeError:
+            pass
+        else:
+            try:
+                url = url["href"]
+            except TypeError:
+                pass
+            else:
+                if url.startswith("/ubuntu/+mirror/"):
+                    prev = url
+                elif not wanted or url in wanted:
+                    index[url] = BASE + prev
+
+    return index
+
+
+def stream_index(html_path, wanted):
+    """Streaming implementation, reading the page in chunks"""
+    def chunks():
+        with open(html_path, encoding='utf-8') as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), u''):
+                yield chunk
+
+    index = parse_launchpad_index(chunks(), BASE, wanted or None)["mirrors"]
+    if not wanted:
+        return index
+
+    return dict((url, page) for url, page in index.items() if url in wanted)
+
+
+IMPLEMENTATIONS = {
+    'soup': soup_index,
+    'stream': stream_index,
+}
+
+
+def run_child(name, html_path, wanted):
+    """Parse once, printing wall time, peak memory and resolved mirrors"""
+    start = time()
+    index = IMPLEMENTATIONS[name](html_path, wanted)
+    elapsed = time() - start
+    after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps({
+        'seconds': elapsed,
+        'peak_kb': after,
+        'resolved': len(index),
+        'index': index,
+    }))
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('html', help="saved copy of the archive mirrors page")
+    parser.add_argument('mirrors', nargs='?',
+                        help="mirror list of wanted archive URLs")
+    parser.add_argument('-r', '--repeat', type=int, default=5)
+    parser.add_argument('--child', choices=sorted(IMPLEMENTATIONS),
+                        help="internal: run a single parse")
+    args = parser.parse_args()
+
+    wanted = frozenset()
+    if args.mirrors:
+        with open(args.mirrors, encoding='utf-8') as f:
+            wanted = frozenset(line.strip() for line in f if line.strip())
+
+    if args.child:
+        run_child(args.child, args.html, wanted)
+        return
+
+    cmd = [executable, __file__, args.html]
+    if args.mirrors:
+        cmd.append(args.mirrors)
+
+    indexes = {}
+    print("%-8s %12s %12s %12s %10s" % (
+        "parser", "best (s)", "mean (s)", "peak (KB)", "resolved"))
+    for name in sorted(IMPLEMENTATIONS):
+        runs = [
+            json.loads(check_output(cmd + ['--child', name]).decode('utf-8'))
+            for _ in range(args.repeat)
+        ]
+        seconds = [run['seconds'] for run in runs]
+        indexes[name] = runs[0]['index']
+        print("%-8s %12.4f %12.4f %12d %10d" % (
+            name,
+            min(seconds),
+            sum(seconds) / len(seconds),
+            max(run['peak_kb'] for run in runs),
+            runs[0]['resolved']
+        ))
+
+    # The tree walk only sees the first link of each table cell, so the
+    # streaming parser may resolve more archive URLs, but never differently
+    if any(indexes['stream'].get(url) != page
+           for url, page in indexes['soup'].items()):
+        print("WARNING: parsers resolved different Launchpad pages")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+"""Benchmark mirror testing and Launchpad lookups against a mirror farm
+
+Runs Mirrors.get_rtts, get_launchpad_urls and lookup_statuses against a
+simulated network of 10, 100 and 1000 mirrors (see farm.py), reporting wall
+time, peak resident memory and peak thread count of each phase. Every run
+is a fresh child process, so one run's memory doesn't hide another's, while
+the farm is served from this process.
+
+    python benchmarks/mirrors_scale.py
+    python benchmarks/mirrors_scale.py --sizes 100 --http-latency 0.05 \\
+        --fixtures fixtures/
+    python benchmarks/mirrors_scale.py --probe http --partial 0.1
+"""
+
+import json
+import resource
+import threading
+from argparse import ArgumentParser
+from os import devnull, path, remove
+from tempfile import NamedTemporaryFile
+from subprocess import check_output
+from sys import executable, stderr, path as sys_path
+
+try:
+    from time import monotonic as clock
+except ImportError:
+    from time import time as clock
+
+from farm import MirrorFarm, Profile
+
+# Import apt_select from the checkout the benchmark is in
+sys_path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+PHASES = ('get_rtts', 'get_launchpad_urls', 'lookup_statuses')
+CODENAME = 'Jammy'
+ARCH = 'amd64'
+THREAD_SAMPLE_INTERVAL = 0.005
+
+
+class ThreadSampler(object):
+    """Track the peak number of live threads while running"""
+
+    def __init__(self):
+        self.peak = 0
+        self._running = False
+
+    def __sample(self):
+        while self._running:
+            self.peak = max(self.peak, threading.active_count() - 1)
+            threading.Event().wait(THREAD_SAMPLE_INTERVAL)
+
+    def __enter__(self):
+        self.peak = threading.active_count()
+        self._running = True
+        self._thread = threading.Thread(target=self.__sample)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._running = False
+        self._thread.join()
+
+
+def run_child(config):
+    """Run each phase once, printing its measurements as JSON"""
+    from apt_select.mirrors import Mirrors
+
+    archives = Mirrors(
+        config['urls'],
+        False,
+        'unknown',
+        config['max_connections'],
+        samples=config['samples'],
+        probe=config['probe'],
+        codename=CODENAME
+    )
+    archives._launchpad_base = config['launchpad_base']
+    archives._launchpad_url = config['launchpad_url']
+    archives.status_num = min(config['top'], len(config['urls']))
+    archives.lookup_workers = config['lookup_workers']
+
+    calls = {
+        'get_rtts': archives.get_rtts,
+        'get_launchpad_urls': archives.get_launchpad_urls,
+        'lookup_statuses': lambda: archives.lookup_statuses(
+            CODENAME, ARCH, 'unknown'
+        ),
+    }
+    results = {}
+    for phase in PHASES:
+        with ThreadSampler() as threads:
+            start = clock()
+            calls[phase]()
+            elapsed = clock() - start
+        results[phase] = {
+            'seconds': elapsed,
+            'peak_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            'threads': threads.peak,
+        }
+
+    results['ranked'] = len(archives.ranked)
+    results['statuses'] = len(archives.top_list)
+    print(json.dumps(results))
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[10, 100, 1000])
+    parser.add_argument('-r', '--repeat', type=int, default=3)
+    parser.add_argument('--top', type=int, default=10,
+                        help="statuses looked up per run")
+    parser.add_argument('--samples', type=int, default=3)
+    parser.add_argument('--max-connections', type=int, default=64)
+    parser.add_argument('--lookup-workers', type=int, default=4)
+    parser.add_argument('--probe', choices=('tcp', 'http'), default='tcp')
+    parser.add_argument('--dead', type=float, default=0.05,
+                        help="share of mirrors with nothing listening")
+    parser.add_argument('--partial', type=float, default=0,
+                        help="share of mirrors not serving the series")
+    parser.add_argument('--http-latency', type=float, default=0.02,
+                        help="seconds before each HTTP response")
+    parser.add_argument('--http-loss', type=float, default=0,
+                        help="share of HTTP requests dropped")
+    parser.add_argument('--bandwidth', type=float, default=None,
+                        help="bytes per second of each HTTP response")
+    parser.add_argument('--fixtures', metavar='DIR',
+                        help="serve Launchpad pages saved in DIR")
+    parser.add_argument('--child', metavar='CONFIG',
+                        help="internal: run a single benchmark")
+    args = parser.parse_args()
+
+    if args.child:
+        with open(args.child) as f:
+            run_child(json.load(f))
+        return
+
+    profile = Profile(args.http_latency, args.http_loss, args.bandwidth)
+    quiet = open(devnull, 'w')
+    print("%6s %-20s %10s %10s %12s %8s" % (
+        "size", "phase", "best (s)", "mean (s)", "peak (KB)", "threads"))
+    for size in args.sizes:
+        farm = MirrorFarm(
+            size, profile, profile, args.dead, args.fixtures,
+            partial=args.partial
+        ).start()
+        with NamedTemporaryFile('w', suffix='.json', delete=False) as f:
+            config_path = f.name
+            json.dump({
+                'urls': farm.mirror_urls,
+                'launchpad_base': farm.launchpad_base,
+                'launchpad_url': farm.launchpad_url,
+                'top': args.top,
+                'samples': args.samples,
+                'max_connections': args.max_connections,
+                'lookup_workers': args.lookup_workers,
+                'probe': args.probe,
+            }, f)
+
+        try:
+            runs = [
+                json.loads(check_output(
+                    [executable, __file__, '--child', config_path],
+                    stderr=quiet
+                ).decode('utf-8'))
+                for _ in range(args.repeat)
+            ]
+        finally:
+            farm.stop()
+            remove(config_path)
+
+        for phase in PHASES:
+            seconds = [run[phase]['seconds'] for run in runs]
+            print("%6d %-20s %10.4f %10.4f %12d %8d" % (
+                size,
+                phase,
+                min(seconds),
+                sum(seconds) / len(seconds),
+                max(run[phase]['peak_kb'] for run in runs),
+                max(run[phase]['threads'] for run in runs)
+            ))
+
+        if any(run['statuses'] < min(args.top, run['ranked'])
+               for run in runs):
+            stderr.write("WARNING: fewer statuses than wanted at size %d\n" % (
+                size
+            ))
+
+
+if __name__ == '__main__':
+    main()
@@ -43,7 +43,11 @@ setup(
     ],
     keywords='latency status rank reporting apt configuration',
     packages=find_packages(exclude=['tests']),
-    install_requires=['requests', 'beautifulsoup4'],
+    install_requires=[
+        'requests',
+        'beautifulsoup4',
+        'selectors34; python_version < "3.4"'
+    ],
     entry_points = {
         'console_scripts': [
             'apt-select = apt_select.__main__:main'
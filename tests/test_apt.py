@@ -0,0 +1,297 @@
+#!/usr/bin/env python
+"""Tests of reading apt sources files and rewriting their mirror"""
+
+import unittest
+from os import path, makedirs
+from shutil import rmtree
+from tempfile import mkdtemp
+
+from apt_select.apt import Sources, SourcesFileError, read_sources
+
+MIRROR = "http://mirror.example.com/ubuntu/"
+
+
+class SourcesFilesTest(unittest.TestCase):
+    """Helpers writing apt files to a temporary apt directory"""
+
+    def setUp(self):
+        self.directory = mkdtemp()
+        self.work_dir = mkdtemp()
+
+    def tearDown(self):
+        rmtree(self.directory)
+        rmtree(self.work_dir)
+
+    def write(self, name, text):
+        file_path = path.join(self.directory, name)
+        if not path.isdir(path.dirname(file_path)):
+            makedirs(path.dirname(file_path))
+        with open(file_path, 'w') as f:
+            f.write(text)
+        return file_path
+
+    def read(self, name):
+        with open(path.join(self.work_dir, name)) as f:
+            return f.read()
+
+
+class OneLineTest(SourcesFilesTest):
+
+    def index(self, text):
+        return read_sources([self.write('sources.list', text)])
+
+    def test_fields(self):
+        entries = self.index(
+            "deb http://archive.ubuntu.com/ubuntu/ noble main restricted\n"
+            "deb-src http://archive.ubuntu.com/ubuntu noble-updates main\n"
+        ).entries
+        self.assertEqual(len(entries), 2)
+        self.assertEqual(entries[0].types, ['deb'])
+        self.assertEqual(entries[0].uri, "http://archive.ubuntu.com/ubuntu/")
+        self.assertEqual(entries[0].suites, ['noble'])
+        self.assertEqual(entries[0].components, ['main', 'restricted'])
+        self.assertEqual(entries[1].types, ['deb-src'])
+        self.assertEqual(entries[1].line, 1)
+
+    def test_options(self):
+        entry, = self.index(
+            "deb [arch=amd64 signed-by=/usr/share/keyrings/ubuntu.gpg] "
+            "http://archive.ubuntu.com/ubuntu noble main\n"
+        ).entries
+        self.assertEqual(entry.uri, "http://archive.ubuntu.com/ubuntu")
+        self.assertEqual(entry.suites, ['noble'])
+        self.assertEqual(entry.components, ['main'])
+
+    def test_single_option(self):
+        entry, = self.index(
+            "deb [trusted=yes] http://archive.ubuntu.com/ubuntu noble main\n"
+        ).entries
+        self.assertEqual(entry.uri, "http://archive.ubuntu.com/ubuntu")
+
+    def test_comments(self):
+        entries = self.index(
+            "# deb http://old.example.com/ubuntu noble main\n"
+            "#deb http://old.example.com/ubuntu noble universe\n"
+            "\n"
+            "deb http://archive.ubuntu.com/ubuntu noble main # universe\n"
+        ).entries
+        self.assertEqual([entry.uri for entry in entries],
+                         ["http://archive.ubuntu.com/ubuntu"])
+        self.assertEqual(entries[0].components, ['main'])
+
+    def test_incomplete_lines(self):
+        self.assertEqual(self.index(
+            "deb http://archive.ubuntu.com/ubuntu\n"
+            "deb [arch=amd64] http://archive.ubuntu.com/ubuntu\n"
+            "rpm http://archive.ubuntu.com/ubuntu noble main\n"
+        ).entries, [])
+
+    def test_bracketed_uri(self):
+        entry, = self.index(
+            "deb cdrom:[Ubuntu 24.04 LTS _Noble Numbat_]/ noble main\n"
+        ).entries
+        self.assertEqual(entry.uri, "cdrom:[Ubuntu 24.04 LTS _Noble Numbat_]/")
+        self.assertEqual(entry.suites, ['noble'])
+
+    def test_trailing_slash(self):
+        index = self.index(
+            "deb http://archive.ubuntu.com/ubuntu/ noble main\n"
+            "deb http://archive.ubuntu.com/ubuntu noble-updates main\n"
+        )
+        self.assertEqual(
+            len(index.find(uri="http://archive.ubuntu.com/ubuntu")), 2
+        )
+        self.assertEqual(
+            len(index.find(uri="http://archive.ubuntu.com/ubuntu/")), 2
+        )
+
+    def test_rewrite(self):
+        file_path = self.write('sources.list', (
+            "# Main archive\n"
+            "deb [arch=amd64] http://archive.ubuntu.com/ubuntu/ noble main\n"
+            "deb http://archive.ubuntu.com/ubuntu noble-updates main # x\n"
+            "deb http://ppa.example.com/ubuntu noble main\n"
+        ))
+        rewritten = read_sources([file_path]).rewrite(
+            ["http://archive.ubuntu.com/ubuntu/"], MIRROR
+        )
+        self.assertEqual(rewritten[file_path], [
+            "# Main archive\n",
+            "deb [arch=amd64] %s noble main\n" % MIRROR,
+            "deb %s noble-updates main # x\n" % MIRROR,
+            "deb http://ppa.example.com/ubuntu noble main\n",
+        ])
+
+    def test_rewrite_unused(self):
+        file_path = self.write(
+            'sources.list', "deb http://ppa.example.com/ubuntu noble main\n"
+        )
+        self.assertEqual(read_sources([file_path]).rewrite(
+            ["http://archive.ubuntu.com/ubuntu"], MIRROR
+        ), {})
+
+
+class Deb822Test(SourcesFilesTest):
+
+    def index(self, text):
+        return read_sources([self.write('ubuntu.sources', text)])
+
+    def test_fields(self):
+        entry, = self.index(
+            "Types: deb deb-src\n"
+            "URIs: http://archive.ubuntu.com/ubuntu/\n"
+            "Suites: noble noble-updates\n"
+            "Components: main restricted\n"
+            "Signed-By: /usr/share/keyrings/ubuntu-archive-keyring.gpg\n"
+        ).entries
+        self.assertEqual(entry.types, ['deb', 'deb-src'])
+        self.assertEqual(entry.uri, "http://archive.ubuntu.com/ubuntu/")
+        self.assertEqual(entry.suites, ['noble', 'noble-updates'])
+        self.assertEqual(entry.components, ['main', 'restricted'])
+        self.assertEqual(entry.line, 1)
+
+    def test_stanzas(self):
+        entries = self.index(
+            "Types: deb\n"
+            "URIs: http://archive.ubuntu.com/ubuntu\n"
+            "Suites: noble\n"
+            "Components: main\n"
+            "\n"
+            "Types: deb\n"
+            "URIs: http://security.ubuntu.com/ubuntu\n"
+            "Suites: noble-security\n"
+            "Components: main\n"
+        ).entries
+        self.assertEqual(
+            [(entry.uri, entry.suites) for entry in entries],
+            [("http://archive.ubuntu.com/ubuntu", ['noble']),
+             ("http://security.ubuntu.com/ubuntu", ['noble-security'])]
+        )
+
+    def test_disabled(self):
+        entries = self.index(
+            "Types: deb\n"
+            "URIs: http://old.example.com/ubuntu\n"
+            "Suites: noble\n"
+            "Components: main\n"
+            "Enabled: no\n"
+            "\n"
+            "Types: deb\n"
+            "URIs: http://archive.ubuntu.com/ubuntu\n"
+            "Suites: noble\n"
+            "Components: main\n"
+            "Enabled: yes\n"
+        ).entries
+        self.assertEqual([entry.uri for entry in entries],
+                         ["http://archive.ubuntu.com/ubuntu"])
+
+    def test_comments(self):
+        entries = self.index(
+            "# Types: deb\n"
+            "# URIs: http://old.example.com/ubuntu\n"
+            "Types: deb\n"
+            "# URIs: http://old.example.com/ubuntu\n"
+            "URIs: http://archive.ubuntu.com/ubuntu\n"
+            "Suites: noble\n"
+            "Components: main\n"
+        ).entries
+        self.assertEqual([entry.uri for entry in entries],
+                         ["http://archive.ubuntu.com/ubuntu"])
+
+    def test_other_types(self):
+        self.assertEqual(self.index(
+            "Types: rpm\n"
+            "URIs: http://archive.ubuntu.com/ubuntu\n"
+            "Suites: noble\n"
+            "Components: main\n"
+        ).entries, [])
+
+    def test_multiple_uris(self):
+        entries = self.index(
+            "Types: deb\n"
+            "URIs: http://archive.ubuntu.com/ubuntu/\n"
+            "  http://other.example.com/ubuntu\n"
+            "  http://archive.ubuntu.com/ubuntu\n"
+            "Suites: noble\n"
+            "Components: main\n"
+        ).entries
+        self.assertEqual([(entry.uri, entry.line) for entry in entries], [
+            ("http://archive.ubuntu.com/ubuntu/", 1),
+            ("http://other.example.com/ubuntu", 2),
+            ("http://archive.ubuntu.com/ubuntu", 3),
+        ])
+
+    def test_rewrite(self):
+        file_path = self.write('ubuntu.sources', (
+            "Types: deb\n"
+            "URIs: http://archive.ubuntu.com/ubuntu/ "
+            "http://other.example.com/ubuntu "
+            "http://archive.ubuntu.com/ubuntu\n"
+            "Suites: noble\n"
+            "Components: main\n"
+            "Signed-By: /usr/share/keyrings/ubuntu-archive-keyring.gpg\n"
+        ))
+        rewritten = read_sources([file_path]).rewrite(
+            ["http://archive.ubuntu.com/ubuntu"], MIRROR
+        )
+        self.assertEqual(rewritten[file_path], [
+            "Types: deb\n",
+            "URIs: %s http://other.example.com/ubuntu %s\n" % (
+                MIRROR, MIRROR
+            ),
+            "Suites: noble\n",
+            "Components: main\n",
+            "Signed-By: /usr/share/keyrings/ubuntu-archive-keyring.gpg\n",
+        ])
+
+
+class SourcesTest(SourcesFilesTest):
+
+    def test_missing(self):
+        self.assertRaises(SourcesFileError, Sources, 'noble', self.directory)
+
+    def test_current(self):
+        self.write('sources.list', (
+            "deb http://ppa.example.com/ubuntu noble main\n"
+            "deb http://archive.ubuntu.com/ubuntu noble main\n"
+            "deb http://archive.ubuntu.com/ubuntu noble-updates main\n"
+            "deb http://security.ubuntu.com/ubuntu noble-security main\n"
+        ))
+        sources = Sources('Noble', self.directory)
+        sources.set_current_archives()
+        self.assertEqual(sources.urls, {
+            'current': "http://archive.ubuntu.com/ubuntu",
+            'security': "http://security.ubuntu.com/ubuntu",
+        })
+
+    def test_no_current(self):
+        self.write('sources.list', "deb file:/srv/repo noble main\n")
+        sources = Sources('noble', self.directory)
+        self.assertRaises(SourcesFileError, sources.set_current_archives)
+
+    def test_generate(self):
+        self.write('sources.list', "# Moved to ubuntu.sources\n")
+        self.write('sources.list.d/ppa.list',
+                   "deb http://ppa.example.com/ubuntu noble main\n")
+        self.write('sources.list.d/ubuntu.sources', (
+            "Types: deb\n"
+            "URIs: http://archive.ubuntu.com/ubuntu/\n"
+            "Suites: noble noble-updates\n"
+            "Components: main universe\n"
+        ))
+        sources = Sources('noble', self.directory)
+        sources.set_current_archives()
+        sources.generate_new_config(self.work_dir, MIRROR)
+        self.assertEqual(sources.new_file_paths, [
+            path.join(self.work_dir, 'sources.list.d', 'ubuntu.sources')
+        ])
+        self.assertEqual(self.read('sources.list.d/ubuntu.sources'), (
+            "Types: deb\n"
+            "URIs: %s\n"
+            "Suites: noble noble-updates\n"
+            "Components: main universe\n" % MIRROR
+        ))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+"""Tests of parsing and querying the catalogue of Launchpad's mirrors"""
+
+import unittest
+
+from apt_select.catalogue import Catalogue, parse_catalogue, parse_speed
+
+BASE = "https://launchpad.net"
+PAGE = u"""<html><body>
+<table class="listing" id="mirrors_list">
+  <thead>
+    <tr><th>Country</th><th>Archive</th><th>Speed</th><th>Status</th></tr>
+  </thead>
+  <tbody>
+    <tr class="head">
+      <th colspan="2">Germany</th><th>11 Gbps</th><th></th>
+    </tr>
+    <tr>
+      <td><a href="/ubuntu/+mirror/fast.example.de">Fast Mirror</a></td>
+      <td><a href="http://fast.example.de/ubuntu/">http</a>
+          <a href="https://fast.example.de/ubuntu/">https</a>
+          <a href="rsync://fast.example.de/ubuntu/">rsync</a></td>
+      <td>10 Gbps</td>
+      <td>Up to date</td>
+    </tr>
+    <tr>
+      <td><a href="/ubuntu/+mirror/slow.example.de">Slow Mirror</a></td>
+      <td><a href="ftp://slow.example.de/ubuntu">ftp</a></td>
+      <td>100 Mbps</td>
+      <td>One week behind</td>
+    </tr>
+    <tr class="head">
+      <th colspan="2">United States</th><th>1 Gbps</th><th></th>
+    </tr>
+    <tr>
+      <td><a href="/ubuntu/+mirror/us.example.com">US Mirror</a></td>
+      <td><a href="http://us.example.com/ubuntu/">http</a></td>
+      <td>1 Gbps</td>
+      <td>Two hours behind</td>
+    </tr>
+    <tr>
+      <td><a href="/ubuntu/+mirror/new.example.com">New Mirror</a></td>
+      <td><a href="https://new.example.com/ubuntu/">https</a></td>
+      <td></td>
+      <td>Unknown</td>
+    </tr>
+    <tr><td>Total</td><td></td><td>12 Gbps</td><td></td></tr>
+  </tbody>
+</table>
+<table>
+  <tr>
+    <td><a href="/ubuntu/+mirror/other.example.com">Other</a></td>
+    <td><a href="http://other.example.com/ubuntu/">http</a></td>
+  </tr>
+</table>
+</body></html>
+"""
+
+
+def chunked(text, size):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+class ParseSpeedTest(unittest.TestCase):
+
+    def test_units(self):
+        self.assertEqual(parse_speed("100 Mbps"), 10 ** 8)
+        self.assertEqual(parse_speed("1 Gbps"), 10 ** 9)
+        self.assertEqual(parse_speed("1.5Gbps"), 15 * 10 ** 8)
+        self.assertEqual(parse_speed("1G"), 10 ** 9)
+        self.assertEqual(parse_speed("10 kbit/s"), 10 ** 4)
+        self.assertEqual(parse_speed("56"), 56)
+
+    def test_invalid(self):
+        self.assertIsNone(parse_speed(None))
+        self.assertIsNone(parse_speed(""))
+        self.assertIsNone(parse_speed("fast"))
+        self.assertIsNone(parse_speed("1 Xbps"))
+
+
+class ParseCatalogueTest(unittest.TestCase):
+
+    def test_entries(self):
+        entries = parse_catalogue([PAGE], BASE)
+        self.assertEqual([entry["Name"] for entry in entries], [
+            "Fast Mirror", "Slow Mirror", "US Mirror", "New Mirror"
+        ])
+        self.assertEqual(entries[0], {
+            "Launchpad": BASE + "/ubuntu/+mirror/fast.example.de",
+            "Name": "Fast Mirror",
+            "Country": "Germany",
+            "Protocols": {
+                "http": "http://fast.example.de/ubuntu/",
+                "https": "https://fast.example.de/ubuntu/",
+                "rsync": "rsync://fast.example.de/ubuntu/",
+            },
+            "Speed": "10 Gbps",
+            "Bandwidth": 10 ** 10,
+            "Status": "Up to date",
+        })
+
+    def test_countries(self):
+        self.assertEqual(
+            [entry["Country"] for entry in parse_catalogue([PAGE], BASE)],
+            ["Germany", "Germany", "United States", "United States"]
+        )
+
+    def test_unknown_speed(self):
+        entry = parse_catalogue([PAGE], BASE)[-1]
+        self.assertIsNone(entry["Speed"])
+        self.assertIsNone(entry["Bandwidth"])
+        self.assertEqual(entry["Status"], "Unknown")
+
+    def test_chunks(self):
+        expected = parse_catalogue([PAGE], BASE)
+        for size in (1, 7, 64):
+            self.assertEqual(
+                parse_catalogue(iter(chunked(PAGE, size)), BASE), expected
+            )
+
+    def test_stops_after_table(self):
+        chunks = chunked(PAGE, 16)
+        read = []
+
+        def stream():
+            for chunk in chunks:
+                read.append(chunk)
+                yield chunk
+
+        parse_catalogue(stream(), BASE)
+        self.assertLess(len(read), len(chunks))
+
+
+class CatalogueTest(unittest.TestCase):
+
+    def setUp(self):
+        self.catalogue = Catalogue(parse_catalogue([PAGE], BASE))
+
+    def names(self, entries):
+        return [entry["Name"] for entry in entries]
+
+    def test_entry(self):
+        self.assertEqual(
+            self.catalogue.entry("https://fast.example.de/ubuntu/")["Name"],
+            "Fast Mirror"
+        )
+        self.assertIsNone(self.catalogue.entry("http://none.example/"))
+
+    def test_entry_trailing_slash(self):
+        self.assertEqual(
+            self.catalogue.entry("http://us.example.com/ubuntu")["Name"],
+            "US Mirror"
+        )
+
+    def test_find_all(self):
+        self.assertEqual(len(self.catalogue), 4)
+        self.assertEqual(self.names(self.catalogue.find()), [
+            "Fast Mirror", "Slow Mirror", "US Mirror", "New Mirror"
+        ])
+
+    def test_find_countries(self):
+        self.assertEqual(
+            self.names(self.catalogue.find(countries=["united states"])),
+            ["US Mirror", "New Mirror"]
+        )
+        self.assertEqual(self.catalogue.find(countries=["France"]), [])
+
+    def test_find_min_speed(self):
+        self.assertEqual(
+            self.names(self.catalogue.find(min_speed=10 ** 9)),
+            ["Fast Mirror", "US Mirror"]
+        )
+        self.assertEqual(self.catalogue.find(min_speed=10 ** 12), [])
+
+    def test_find_protocol(self):
+        self.assertEqual(
+            self.names(self.catalogue.find(protocol="https")),
+            ["Fast Mirror", "New Mirror"]
+        )
+        self.assertEqual(
+            self.names(self.catalogue.find(protocol="ftp")), ["Slow Mirror"]
+        )
+
+    def test_find_combined(self):
+        self.assertEqual(self.names(self.catalogue.find(
+            countries=["Germany", "United States"],
+            min_speed=10 ** 9,
+            protocol="http"
+        )), ["Fast Mirror", "US Mirror"])
+
+
+if __name__ == '__main__':
+    unittest.main()
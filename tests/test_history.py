@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+"""Tests of the latency history and mirrors chosen by it"""
+
+import random
+import unittest
+from os import path
+from shutil import rmtree
+from socket import AF_INET, AF_INET6
+from tempfile import mkdtemp
+
+from apt_select import mirrors
+from apt_select.history import (LatencyHistory, HistoryError, FAILURE_PENALTY,
+                                address_prefix)
+from apt_select.mirrors import Mirrors
+from apt_select.probe import latency_stats
+
+SOURCE = "198.51.100.0/24"
+
+
+class AddressPrefixTest(unittest.TestCase):
+
+    def test_ipv4(self):
+        self.assertEqual(
+            address_prefix(AF_INET, "192.0.2.123"), "192.0.2.0/24"
+        )
+
+    def test_ipv6(self):
+        self.assertEqual(
+            address_prefix(AF_INET6, "2001:db8:1:2:3::1"), "2001:db8:1::/48"
+        )
+
+
+class HistoryTest(unittest.TestCase):
+    """Helpers opening a history in a temporary directory"""
+
+    def setUp(self):
+        self.directory = mkdtemp()
+
+    def tearDown(self):
+        rmtree(self.directory)
+
+    def open(self, **kwargs):
+        latency = LatencyHistory(
+            path.join(self.directory, 'latency.db'), **kwargs
+        )
+        latency.source = lambda family, sockaddr: SOURCE
+        return latency
+
+
+class LatencyHistoryTest(HistoryTest):
+
+    def test_unopenable(self):
+        open(path.join(self.directory, 'file'), 'w').close()
+        self.assertRaises(
+            HistoryError, LatencyHistory,
+            path.join(self.directory, 'file', 'latency.db')
+        )
+
+    def test_new_estimate(self):
+        latency = self.open()
+        key = (SOURCE, "192.0.2.0/24")
+        self.assertEqual(latency.estimates([key]), {})
+        latency.update({key: 40.0})
+        self.assertEqual(latency.estimates([key]), {key: 40.0})
+
+    def test_moving_average(self):
+        latency = self.open(alpha=0.5)
+        key = (SOURCE, "192.0.2.0/24")
+        for measured in (40.0, 20.0, 10.0):
+            latency.update({key: measured})
+        self.assertEqual(latency.estimates([key]), {key: 20.0})
+
+    def test_stale(self):
+        latency = self.open(max_age=-1)
+        key = (SOURCE, "192.0.2.0/24")
+        latency.update({key: 40.0})
+        self.assertEqual(latency.estimates([key]), {})
+        # Stale estimates are replaced rather than averaged
+        latency.update({key: 10.0})
+        latency.max_age = 60
+        self.assertEqual(latency.estimates([key]), {key: 10.0})
+
+    def test_shared(self):
+        key = (SOURCE, "192.0.2.0/24")
+        self.open().update({key: 40.0})
+        self.assertEqual(self.open().estimates([key]), {key: 40.0})
+
+    def test_choose(self):
+        latency = self.open(top=2, explore=1)
+        predicted = {"a": 30, "b": 10, "c": 20, "d": 40, "e": 50}
+        random.seed(0)
+        chosen = latency.choose(predicted, ["x"])
+        self.assertEqual(chosen[:3], ["x", "b", "c"])
+        self.assertEqual(len(chosen), 4)
+        self.assertIn(chosen[3], ["a", "d", "e"])
+
+    def test_choose_few(self):
+        latency = self.open(top=10, explore=3)
+        self.assertEqual(
+            latency.choose({"a": 20, "b": 10}, []), ["b", "a"]
+        )
+
+
+class FakeTrips(object):
+    """Round trips of canned times, None being a failed mirror"""
+
+    def __init__(self, times):
+        self.times = times
+        self.tested = []
+
+    def add(self, url, family, sockaddr):
+        self.tested.append(url)
+
+    def probes(self):
+        return len(self.tested)
+
+    def started(self, url):
+        return None
+
+    def run(self, urls=None, num_trips=None):
+        for url in self.tested:
+            rtt = self.times[url]
+            rtts = [] if rtt is None else [rtt]
+            yield url, AF_INET, latency_stats(rtts, 1), "timed out"
+
+
+class ChooseMirrorsTest(HistoryTest):
+
+    def setUp(self):
+        HistoryTest.setUp(self)
+        self.resolve_all = mirrors.resolve_all
+        mirrors.resolve_all = lambda hosts, families: [
+            (host, [(AF_INET, (host, 0))], None) for host in hosts
+        ]
+
+    def tearDown(self):
+        mirrors.resolve_all = self.resolve_all
+        HistoryTest.tearDown(self)
+
+    def run_mirrors(self, times, latency):
+        urls = ["http://%s/ubuntu/" % host for host in sorted(times)]
+        archives = Mirrors(urls, True, None, samples=1, history=latency)
+        archives._trips = FakeTrips(dict(
+            ("http://%s/ubuntu/" % host, rtt) for host, rtt in times.items()
+        ))
+        archives.get_rtts()
+        return sorted(
+            url.split('/')[2] for url in archives._trips.tested
+        )
+
+    def test_top_tested(self):
+        latency = self.open(top=1, explore=0)
+        times = {"192.0.2.1": 30.0, "192.0.3.1": 10.0, "192.0.4.1": 20.0}
+        self.assertEqual(self.run_mirrors(times, latency), sorted(times))
+        times["192.0.5.1"] = 5.0
+        self.assertEqual(
+            self.run_mirrors(times, latency), ["192.0.3.1", "192.0.5.1"]
+        )
+
+    def test_failed_backed_off(self):
+        latency = self.open(top=1, explore=0)
+        times = {"192.0.2.1": None, "192.0.3.1": 10.0}
+        self.assertEqual(self.run_mirrors(times, latency), sorted(times))
+        self.assertEqual(
+            latency.estimates([(SOURCE, "192.0.2.0/24")]),
+            {(SOURCE, "192.0.2.0/24"): FAILURE_PENALTY}
+        )
+        # The failed mirror isn't tested again as if it were unknown
+        self.assertEqual(self.run_mirrors(times, latency), ["192.0.3.1"])
+
+
+if __name__ == '__main__':
+    unittest.main()
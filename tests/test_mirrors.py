@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+"""Tests of parsing Launchpad's archive mirrors page into an index"""
+
+import unittest
+
+from apt_select.mirrors import parse_launchpad_index
+
+BASE = "https://launchpad.net"
+PAGE = u"""<html><body>
+<div><a href="/ubuntu/+mirror/outside.example.com">Not a mirror</a>
+<a href="http://outside.example.com/ubuntu/">http</a></div>
+<table class="listing" id="mirrors_list">
+  <tr><th colspan="2">Germany</th></tr>
+  <tr>
+    <td><a href="/ubuntu/+mirror/de.example.de">DE Mirror</a></td>
+    <td><a href="http://de.example.de/ubuntu/">http</a>
+        <a href="https://de.example.de/ubuntu/">https</a></td>
+  </tr>
+  <tr><th colspan="2">United States</th></tr>
+  <tr>
+    <td><a href="/ubuntu/+mirror/us.example.com">US Mirror</a></td>
+    <td><a href="http://us.example.com/ubuntu/">http</a></td>
+  </tr>
+  <tr>
+    <td><a href="/ubuntu/+mirror/ftp.example.com">FTP Mirror</a></td>
+    <td><a href="ftp://ftp.example.com/ubuntu/">ftp</a></td>
+  </tr>
+</table>
+<table>
+  <tr>
+    <td><a href="/ubuntu/+mirror/other.example.com">Other</a></td>
+    <td><a href="http://other.example.com/ubuntu/">http</a></td>
+  </tr>
+</table>
+</body></html>
+"""
+INDEX = {
+    "http://de.example.de/ubuntu/": BASE + "/ubuntu/+mirror/de.example.de",
+    "https://de.example.de/ubuntu/": BASE + "/ubuntu/+mirror/de.example.de",
+    "http://us.example.com/ubuntu/": BASE + "/ubuntu/+mirror/us.example.com",
+    "ftp://ftp.example.com/ubuntu/": BASE + "/ubuntu/+mirror/ftp.example.com",
+}
+
+
+class Chunks(object):
+    """Chunks of a page, keeping count of those read and whether closed"""
+
+    def __init__(self, text, size):
+        self.chunks = [text[i:i + size] for i in range(0, len(text), size)]
+        self.read = 0
+        self.closed = False
+
+    def __iter__(self):
+        for chunk in self.chunks:
+            self.read += 1
+            yield chunk
+
+    def close(self):
+        self.closed = True
+
+
+class ParseLaunchpadIndexTest(unittest.TestCase):
+
+    def test_index(self):
+        self.assertEqual(parse_launchpad_index([PAGE], BASE), {
+            "mirrors": INDEX, "complete": True
+        })
+
+    def test_chunks(self):
+        for size in (1, 5, 64):
+            self.assertEqual(
+                parse_launchpad_index(Chunks(PAGE, size), BASE)["mirrors"],
+                INDEX
+            )
+
+    def test_stops_after_table(self):
+        chunks = Chunks(PAGE, 16)
+        parse_launchpad_index(chunks, BASE)
+        self.assertLess(chunks.read, len(chunks.chunks))
+        self.assertTrue(chunks.closed)
+
+    def test_wanted(self):
+        chunks = Chunks(PAGE, 16)
+        index = parse_launchpad_index(
+            chunks, BASE, ["http://de.example.de/ubuntu/"]
+        )
+        self.assertEqual(index["mirrors"], {
+            "http://de.example.de/ubuntu/":
+                BASE + "/ubuntu/+mirror/de.example.de",
+        })
+        self.assertFalse(index["complete"])
+        self.assertTrue(chunks.closed)
+
+    def test_wanted_missing(self):
+        index = parse_launchpad_index(
+            [PAGE], BASE, ["http://de.example.de/ubuntu/", "http://none/"]
+        )
+        self.assertEqual(index["mirrors"], INDEX)
+        self.assertTrue(index["complete"])
+
+
+if __name__ == '__main__':
+    unittest.main()
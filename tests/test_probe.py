@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+"""Tests of statistics of round trip times"""
+
+import unittest
+
+from apt_select.probe import latency_stats, percentile
+
+
+class PercentileTest(unittest.TestCase):
+
+    def test_empty(self):
+        self.assertIsNone(percentile([], 90))
+
+    def test_one(self):
+        for percent in (0, 50, 90, 100):
+            self.assertEqual(percentile([7], percent), 7)
+
+    def test_nearest_rank(self):
+        ordered = list(range(1, 11))
+        self.assertEqual(percentile(ordered, 10), 1)
+        self.assertEqual(percentile(ordered, 11), 2)
+        self.assertEqual(percentile(ordered, 50), 5)
+        self.assertEqual(percentile(ordered, 90), 9)
+        self.assertEqual(percentile(ordered, 91), 10)
+
+    def test_bounds(self):
+        ordered = [1, 2, 3]
+        self.assertEqual(percentile(ordered, 0), 1)
+        self.assertEqual(percentile(ordered, 100), 3)
+        self.assertEqual(percentile(ordered, -10), 1)
+        self.assertEqual(percentile(ordered, 110), 3)
+
+
+class LatencyStatsTest(unittest.TestCase):
+
+    def test_empty(self):
+        self.assertIsNone(latency_stats([], 0))
+
+    def test_all_lost(self):
+        self.assertIsNone(latency_stats([], 3))
+
+    def test_one(self):
+        self.assertEqual(latency_stats([12.5], 1), {
+            "min": 12.5, "median": 12.5, "p90": 12.5, "stdev": 0.0,
+            "loss": 0.0, "samples": 1,
+        })
+
+    def test_odd(self):
+        stats = latency_stats([30, 10, 20], 3)
+        self.assertEqual(stats["min"], 10)
+        self.assertEqual(stats["median"], 20)
+        self.assertEqual(stats["p90"], 30)
+        self.assertAlmostEqual(stats["stdev"], (200 / 3.0) ** 0.5)
+
+    def test_even(self):
+        stats = latency_stats([40, 10, 30, 20], 4)
+        self.assertEqual(stats["median"], 25)
+        self.assertEqual(stats["p90"], 40)
+
+    def test_loss(self):
+        stats = latency_stats([10, 20], 4)
+        self.assertEqual(stats["loss"], 0.5)
+        self.assertEqual(stats["samples"], 4)
+        self.assertEqual(stats["median"], 15)
+
+
+if __name__ == '__main__':
+    unittest.main()
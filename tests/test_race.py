@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+"""Tests of racing mirrors down to contenders for the top of the ranking"""
+
+import unittest
+from socket import AF_INET
+
+from apt_select import mirrors
+from apt_select.mirrors import Mirrors
+from apt_select.probe import latency_stats
+
+
+class FakeTrips(object):
+    """Round trips with canned times, a time of None being a lost sample"""
+
+    def __init__(self, times):
+        self.times = times
+        self.attempts = {}
+
+    def add(self, url, family, sockaddr):
+        self.attempts[url] = 0
+
+    def probes(self):
+        return sum(self.attempts.values())
+
+    def started(self, url):
+        return None
+
+    def run(self, urls=None, num_trips=None):
+        for url in sorted(urls or self.attempts):
+            self.attempts[url] += num_trips
+            sent = self.attempts[url]
+            rtts = [rtt for rtt in self.times[url][:sent] if rtt is not None]
+            yield url, AF_INET, latency_stats(rtts, sent), "timed out"
+
+
+def resolve_all(hosts, families):
+    for host in hosts:
+        yield host, [(AF_INET, ('192.0.2.1', 0))], None
+
+
+class RaceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.resolve_all = mirrors.resolve_all
+        mirrors.resolve_all = resolve_all
+
+    def tearDown(self):
+        mirrors.resolve_all = self.resolve_all
+
+    def race(self, times, race_num, rank_by="min"):
+        archives = Mirrors(
+            sorted(times), True, None, samples=5, rank_by=rank_by
+        )
+        archives._trips = FakeTrips(times)
+        archives.get_rtts(race_num)
+        return archives
+
+    def test_contenders_stop_early(self):
+        times = dict(("http://m%d/" % i, [10 * i + 1] * 5) for i in range(8))
+        archives = self.race(times, 1)
+        # 8 mirrors are halved to 4 and then 2 contenders after a sample
+        # each, the contenders taking the remaining 2
+        self.assertEqual(archives._trips.attempts, {
+            "http://m0/": 5, "http://m1/": 5,
+            "http://m2/": 2, "http://m3/": 2,
+            "http://m4/": 1, "http://m5/": 1, "http://m6/": 1, "http://m7/": 1,
+        })
+        self.assertEqual(archives._trips.probes(), 18)
+        self.assertEqual(list(archives.ranked), sorted(times))
+
+    def test_dropped_behind_contenders(self):
+        # Dropped mirrors have no deviation after a single sample
+        times = {
+            "http://a/": [10, 30, 10, 30, 10],
+            "http://b/": [11, 12, 11, 12, 11],
+            "http://c/": [20, 20, 20, 20, 20],
+            "http://d/": [30, 30, 30, 30, 30],
+        }
+        archives = self.race(times, 1, "stdev")
+        self.assertEqual(archives._trips.attempts["http://d/"], 1)
+        self.assertEqual(
+            archives.urls["http://d/"]["Stats"]["stdev"], 0
+        )
+        self.assertEqual(list(archives.ranked), [
+            "http://b/", "http://a/", "http://c/", "http://d/"
+        ])
+
+    def test_lost_samples(self):
+        times = {
+            "http://a/": [10, None, 10, 10, 10],
+            "http://b/": [None, None, None, None, None],
+            "http://c/": [20, 20, 20, 20, 20],
+            "http://d/": [30, 30, 30, 30, 30],
+            "http://e/": [40, 40, 40, 40, 40],
+        }
+        archives = self.race(times, 1)
+        self.assertNotIn("http://b/", archives.urls)
+        self.assertEqual(archives.urls["http://a/"]["Stats"]["loss"], 0.2)
+        self.assertEqual(list(archives.ranked), [
+            "http://a/", "http://c/", "http://d/", "http://e/"
+        ])
+
+    def test_race_num_over_candidates(self):
+        times = {
+            "http://a/": [30, 20, 30, 30, 30],
+            "http://b/": [10, 10, 10, 10, 10],
+            "http://c/": [25, 25, 25, 25, 25],
+        }
+        archives = self.race(times, 10)
+        self.assertEqual(archives._trips.attempts, {
+            "http://a/": 5, "http://b/": 5, "http://c/": 5
+        })
+        self.assertEqual(list(archives.ranked), [
+            "http://b/", "http://a/", "http://c/"
+        ])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+"""Tests of mirror records and their ranking"""
+
+import unittest
+
+from apt_select.records import MirrorRecord, Ranking
+
+INFO = {
+    "Host": "mirror.example.com",
+    "Latency": 12.5,
+    "Status": "Up to date",
+    "Families": {"IPv4": {"min": 12.5}},
+}
+
+
+class MirrorRecordTest(unittest.TestCase):
+
+    def test_dict_round_trip(self):
+        record = MirrorRecord(INFO)
+        self.assertEqual(dict(record), INFO)
+        self.assertEqual(MirrorRecord(dict(record)), record)
+        self.assertEqual(record, INFO)
+
+    def test_field_order(self):
+        record = MirrorRecord(Status="Unknown", Latency=1, Host="m")
+        self.assertEqual(list(record), ["Host", "Latency", "Status"])
+
+    def test_missing(self):
+        record = MirrorRecord(Host="m")
+        self.assertNotIn("Latency", record)
+        self.assertRaises(KeyError, lambda: record["Latency"])
+        self.assertIsNone(record.get("Latency"))
+        self.assertEqual(record.get("Latency", 0), 0)
+        self.assertEqual(len(record), 1)
+
+    def test_extra_keys(self):
+        record = MirrorRecord(Host="m", Mirror="extra")
+        self.assertIn("Mirror", record)
+        self.assertEqual(record["Mirror"], "extra")
+        self.assertEqual(dict(record), {"Host": "m", "Mirror": "extra"})
+        self.assertRaises(KeyError, lambda: record["Other"])
+
+    def test_delete(self):
+        record = MirrorRecord(INFO, Mirror="extra")
+        del record["Latency"]
+        del record["Mirror"]
+        self.assertNotIn("Latency", record)
+        self.assertNotIn("Mirror", record)
+
+        def delete(key):
+            del record[key]
+
+        self.assertRaises(KeyError, delete, "Latency")
+        self.assertRaises(KeyError, delete, "Mirror")
+        self.assertRaises(KeyError, delete, "Other")
+
+    def test_update(self):
+        record = MirrorRecord(Host="m")
+        record.update({"Latency": 1}, Status="Unknown")
+        record.update([("Latency", 2)])
+        self.assertEqual(record.setdefault("Latency", 3), 2)
+        self.assertEqual(record.setdefault("Speed", "1 Gbps"), "1 Gbps")
+        self.assertEqual(dict(record), {
+            "Host": "m", "Latency": 2, "Status": "Unknown", "Speed": "1 Gbps"
+        })
+
+    def test_copy(self):
+        record = MirrorRecord(INFO)
+        copied = record.copy()
+        copied["Latency"] = 20
+        self.assertEqual(record["Latency"], 12.5)
+        self.assertNotEqual(copied, record)
+
+
+class RankingTest(unittest.TestCase):
+
+    def test_sorted(self):
+        ranking = Ranking([("c", 3), ("a", 1), ("b", 2)])
+        self.assertEqual(list(ranking), ["a", "b", "c"])
+        self.assertEqual(ranking[0], "a")
+        self.assertEqual(ranking.top(2), ["a", "b"])
+        self.assertEqual(len(ranking), 3)
+
+    def test_insert_order(self):
+        ranking = Ranking()
+        for url, key in (("b", 2), ("d", 4), ("a", 1), ("c", 3)):
+            ranking.add(url, key)
+        self.assertEqual(list(ranking), ["a", "b", "c", "d"])
+        self.assertEqual(ranking.key("c"), 3)
+
+    def test_ties(self):
+        ranking = Ranking([("x", 1), ("y", 1)])
+        ranking.add("z", 1)
+        ranking.add("w", 0)
+        self.assertEqual(list(ranking), ["w", "x", "y", "z"])
+
+    def test_tuple_keys(self):
+        ranking = Ranking([("a", (True, 1)), ("b", (False, 5))])
+        ranking.add("c", (False, 1))
+        self.assertEqual(list(ranking), ["c", "b", "a"])
+
+    def test_move(self):
+        ranking = Ranking([("a", 1), ("b", 2), ("c", 3)])
+        ranking.add("a", 4)
+        self.assertEqual(list(ranking), ["b", "c", "a"])
+        self.assertEqual(ranking.key("a"), 4)
+        self.assertEqual(len(ranking), 3)
+
+    def test_discard(self):
+        ranking = Ranking([("a", 1), ("b", 1), ("c", 1), ("d", 2)])
+        ranking.discard("b")
+        ranking.discard("none")
+        self.assertEqual(list(ranking), ["a", "c", "d"])
+        self.assertNotIn("b", ranking)
+        self.assertIn("c", ranking)
+        self.assertRaises(KeyError, ranking.key, "b")
+
+    def test_copy(self):
+        ranking = Ranking([("a", 1), ("b", 2)])
+        copied = ranking.copy()
+        copied.add("c", 0)
+        copied.discard("a")
+        self.assertEqual(list(ranking), ["a", "b"])
+        self.assertEqual(list(copied), ["c", "b"])
+
+
+if __name__ == '__main__':
+    unittest.main()
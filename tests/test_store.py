@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+"""Tests of the SQLite and HTTP result stores"""
+
+import unittest
+from os import path
+from shutil import rmtree
+from tempfile import mkdtemp
+
+from apt_select import store
+from apt_select.store import (HTTPStore, SQLiteStore, KeyValueServer,
+                              StoreError, open_store, serve_store)
+
+try:
+    from io import StringIO
+except ImportError:
+    from StringIO import StringIO
+
+URL = "http://mirror.example.com/ubuntu/"
+RESULT = {"Host": "mirror.example.com", "Preferred": "IPv4",
+          "Families": {"IPv4": {"min": 0.01, "median": 0.02}}}
+
+
+class StoreTest(object):
+    """Tests of a store's backend, mixed into a TestCase creating it"""
+
+    def new_store(self, **kwargs):
+        raise NotImplementedError
+
+    def setUp(self):
+        self.store = self.new_store()
+        self.stderr = store.stderr
+        store.stderr = StringIO()
+
+    def tearDown(self):
+        store.stderr = self.stderr
+
+    def test_missing(self):
+        self.assertIsNone(self.store.get("rtts", "none"))
+
+    def test_round_trip(self):
+        self.store.set("rtts", "default/" + URL, RESULT)
+        self.assertEqual(self.store.get("rtts", "default/" + URL), RESULT)
+        self.assertIsNone(self.store.get("statuses", "default/" + URL))
+
+    def test_replace(self):
+        self.store.set("rtts", "key", {"value": 1})
+        self.store.set("rtts", "key", {"value": 2})
+        self.assertEqual(self.store.get("rtts", "key"), {"value": 2})
+
+    def test_max_age(self):
+        self.store.set("rtts", "key", RESULT)
+        self.assertEqual(self.store.get("rtts", "key", 60), RESULT)
+        self.assertIsNone(self.store.get("rtts", "key", -1))
+
+    def test_shared(self):
+        # Hosts storing results of different mirrors keep both
+        other = self.new_store()
+        self.store.set("rtts", "default/http://a/", {"value": 1})
+        other.set("rtts", "default/http://b/", {"value": 2})
+        self.assertEqual(other.get("rtts", "default/http://a/"), {"value": 1})
+        self.assertEqual(
+            self.store.get("rtts", "default/http://b/"), {"value": 2}
+        )
+
+
+class SQLiteStoreTest(StoreTest, unittest.TestCase):
+
+    def setUp(self):
+        self.directory = mkdtemp()
+        StoreTest.setUp(self)
+
+    def tearDown(self):
+        StoreTest.tearDown(self)
+        rmtree(self.directory)
+
+    def new_store(self, **kwargs):
+        return open_store(path.join(self.directory, 'store.db'), **kwargs)
+
+    def test_backend(self):
+        self.assertIsInstance(self.store, SQLiteStore)
+
+    def test_unopenable(self):
+        self.assertRaises(
+            StoreError, SQLiteStore, path.join(self.directory, 'no', 'db')
+        )
+
+
+class HTTPStoreTest(StoreTest, unittest.TestCase):
+
+    def setUp(self):
+        self.server = serve_store("127.0.0.1:0")
+        StoreTest.setUp(self)
+
+    def tearDown(self):
+        StoreTest.tearDown(self)
+        self.server.shutdown()
+        self.server.server_close()
+
+    def new_store(self, **kwargs):
+        return open_store(
+            "http://127.0.0.1:%d/" % self.server.server_address[1], **kwargs
+        )
+
+    def test_backend(self):
+        self.assertIsInstance(self.store, HTTPStore)
+        self.assertIsInstance(self.server, KeyValueServer)
+
+    def test_quoted_keys(self):
+        self.store.set("rtts", "default/" + URL, RESULT)
+        self.assertEqual(list(self.server.documents), [
+            "rtts/default/" + URL
+        ])
+
+    def test_invalid_document(self):
+        self.server.documents["rtts/key"] = b'{"value": 1}'
+        self.assertIsNone(self.store.get("rtts", "key"))
+        self.assertIn("rtts/key", store.stderr.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()